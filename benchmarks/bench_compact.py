@@ -0,0 +1,76 @@
+"""
+Benchmark the memory used by the in-memory shame, prefix and skip count
+tables, in the str keyed form get_all_* return and in the compact form
+DataManager keeps.
+
+Usage: python -m benchmarks.bench_compact [amount of guilds]
+"""
+from gc import collect
+from random import choice, randint, sample, seed
+from sqlite3 import connect
+from sys import argv
+from tracemalloc import get_traced_memory, start, stop
+
+from data_manager import DataManager
+from data_manager.compact import REGIONS
+
+
+def snowflake() -> str:
+    return str(randint(10 ** 17, 10 ** 18))
+
+
+def fill(manager: DataManager, guilds: int, members: int):
+    """
+    Fill a manager with random guilds.
+    :param manager: the DataManager.
+    :param guilds: the amount of guilds.
+    :param members: the maximum amount of shamelist members per guild.
+    """
+    for _ in range(guilds):
+        guild_id = snowflake()
+        manager.set_prefix(guild_id, choice('!?$%'))
+        manager.set_skip(guild_id, randint(1, 10))
+        for _ in range(randint(1, members)):
+            member_id = snowflake()
+            for region in sample(REGIONS, randint(1, 2)):
+                player_id = str(randint(10 ** 9, 10 ** 10))
+                manager.set_shame(guild_id, member_id, region, player_id)
+    manager.flush()
+
+
+def measure(fn) -> int:
+    """
+    Measure the memory held by the result of a function.
+    :param fn: the function.
+    :return: the amount of bytes allocated and still held.
+    """
+    start()
+    res = fn()
+    collect()
+    size = get_traced_memory()[0]
+    stop()
+    del res
+    return size
+
+
+def main(guilds: int, members: int = 20):
+    seed(0)
+    conn = connect(':memory:')
+    fill(DataManager(conn, write_behind=True, flush_ops=10 ** 9), guilds,
+         members)
+    entries = conn.execute('SELECT COUNT(*) FROM shame').fetchone()[0]
+    loaded = DataManager(conn, lazy=True)
+    print(f'guilds: {guilds:,}, shame rows: {entries:,}')
+    for table, get_all in (('shame', loaded.get_all_shame),
+                           ('prefix', loaded.get_all_prefix),
+                           ('skip_count', loaded.get_all_skips)):
+        rows = entries if table == 'shame' else guilds
+        before = measure(get_all)
+        after = measure(lambda: DataManager(conn).tables[table])
+        print(f'{table:<11} str: {before / rows:6.1f}B per row, '
+              f'compact: {after / rows:6.1f}B per row, '
+              f'{before / after:.1f}x smaller')
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 5000)
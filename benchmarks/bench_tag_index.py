@@ -0,0 +1,79 @@
+"""
+Benchmark TagIndex against difflib.get_close_matches.
+
+Usage: python -m benchmarks.bench_tag_index [amount of tags]
+"""
+from difflib import SequenceMatcher, get_close_matches
+from random import choice, randint, seed
+from string import ascii_lowercase
+from sys import argv
+from time import perf_counter
+
+from data_manager.tag_index import TagIndex
+
+
+def random_tags(amt: int) -> list:
+    """
+    Generate booru style tags from a random vocabulary.
+    :param amt: the amount of tags.
+    :return: a list of unique tags.
+    """
+    vocab = [''.join(choice(ascii_lowercase) for _ in range(randint(2, 9)))
+             for _ in range(amt // 4 + 10)]
+    tags = set()
+    while len(tags) < amt:
+        tags.add('_'.join(choice(vocab) for _ in range(randint(1, 3))))
+    return list(tags)
+
+
+def typo(tag: str) -> str:
+    """
+    Introduce a random typo into a tag.
+    :param tag: the tag.
+    :return: the tag with a typo.
+    """
+    i = randint(0, len(tag) - 1)
+    c = choice(ascii_lowercase)
+    return choice((
+        tag[:i] + c + tag[i + 1:],
+        tag[:i] + tag[i + 1:],
+        tag[:i] + c + tag[i:]
+    ))
+
+
+def main(amt: int, queries: int = 200):
+    seed(0)
+    tags = random_tags(amt)
+    words = [typo(choice(tags)) for _ in range(queries)]
+
+    start = perf_counter()
+    index = TagIndex(tags)
+    build = perf_counter() - start
+
+    start = perf_counter()
+    indexed = [index.match(w) for w in words]
+    index_time = (perf_counter() - start) / queries
+
+    difflib_queries = max(1, queries // 10)
+    start = perf_counter()
+    expected = [get_close_matches(w, tags, 1, cutoff=0.4)
+                for w in words[:difflib_queries]]
+    difflib_time = (perf_counter() - start) / difflib_queries
+
+    ratio = lambda a, b: SequenceMatcher(None, b, a).ratio() if b else 0
+    same, as_good = 0, 0
+    for word, e, i in zip(words, expected, indexed):
+        e = e[0] if e else None
+        same += e == i
+        as_good += ratio(word, i) >= ratio(word, e)
+    print(f'tags: {amt:,}')
+    print(f'index build: {build * 1000:.1f}ms')
+    print(f'difflib:     {difflib_time * 1000:.3f}ms per query')
+    print(f'TagIndex:    {index_time * 1000:.3f}ms per query')
+    print(f'speedup:     {difflib_time / index_time:.0f}x')
+    print(f'same match as difflib: {same}/{difflib_queries}')
+    print(f'match as close as difflib: {as_good}/{difflib_queries}')
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 50000)
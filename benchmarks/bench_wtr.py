@@ -0,0 +1,45 @@
+"""
+Benchmark WTREngine against wtr_absolute_sync.
+
+Usage: python -m benchmarks.bench_wtr [amount of ships]
+"""
+from random import seed
+from sys import argv
+from time import perf_counter
+
+from benchmarks.wtr_data import COEFF, random_expected, random_ship_dict, \
+    random_stats
+from scripts.helpers import combine_objects
+from world_of_warships.wtr import wtr_absolute_sync
+from world_of_warships.wtr_engine import WTREngine
+
+
+def main(ships: int, runs: int = 50):
+    seed(0)
+    expected = random_expected(ships)
+    ship_dict = random_ship_dict(ships)
+    player = random_stats(ships, ships * 3 // 4)
+    clan = combine_objects(*[random_stats(ships, ships // 2)
+                             for _ in range(50)])
+
+    start = perf_counter()
+    engine = WTREngine(expected, COEFF, ship_dict)
+    build = perf_counter() - start
+    print(f'ships: {ships:,}, engine build: {build * 1000:.2f}ms')
+    for name, stats in (('player', player), ('clan', clan)):
+        start = perf_counter()
+        for _ in range(runs):
+            scalar = wtr_absolute_sync(expected, COEFF, stats, ship_dict)
+        scalar_time = (perf_counter() - start) / runs
+        start = perf_counter()
+        for _ in range(runs):
+            vectorized = engine.wtr(stats)
+        engine_time = (perf_counter() - start) / runs
+        print(f'{name:<7} wtr_absolute_sync: {scalar_time * 1000:.3f}ms, '
+              f'WTREngine: {engine_time * 1000:.3f}ms, '
+              f'{scalar_time / engine_time:.1f}x faster, '
+              f'WTR {scalar} vs {vectorized}')
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 400)
@@ -0,0 +1,90 @@
+"""
+Benchmark loading the data used for WTR calculations from the JSON files
+and from the binary cache, including building the WTR engines.
+
+Usage: python -m benchmarks.bench_wtr_cache [amount of ships]
+"""
+from gc import collect
+from json import dump, load
+from pathlib import Path
+from random import seed
+from sys import argv
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+
+from benchmarks.wtr_data import COEFF, random_expected, random_ship_dict
+from world_of_warships.wtr_cache import load_wtr_cache, save_wtr_cache
+from world_of_warships.wtr_engine import WTREngine
+
+REGIONS = ('na', 'eu', 'ru', 'asia')
+
+
+def engines(expected_and_coeff: dict, ship_dict: dict) -> list:
+    return [
+        WTREngine(expected_and_coeff[r]['expected'],
+                  expected_and_coeff[r]['coefficients'], ship_dict[r])
+        for r in REGIONS
+    ]
+
+
+def load_json(path: Path):
+    with (path / 'expected_and_coeff.json').open() as f:
+        expected_and_coeff = load(f)
+    with (path / 'ship_dict.json').open() as f:
+        ship_dict = load(f)
+    return expected_and_coeff, ship_dict, engines(expected_and_coeff,
+                                                  ship_dict)
+
+
+def load_cache(path: Path):
+    expected_and_coeff, ship_dict = load_wtr_cache(path / 'wtr_cache')
+    return expected_and_coeff, ship_dict, engines(expected_and_coeff,
+                                                  ship_dict)
+
+
+def measure(fn, path: Path, runs: int = 20):
+    """
+    Measure the time to run a loader and the memory its result holds.
+    :return: a tuple of (seconds per run, bytes held)
+    """
+    begin = perf_counter()
+    for _ in range(runs):
+        fn(path)
+    elapsed = (perf_counter() - begin) / runs
+    collect()
+    start()
+    res = fn(path)
+    collect()
+    size = get_traced_memory()[0]
+    stop()
+    del res
+    return elapsed, size
+
+
+def main(ships: int):
+    seed(0)
+    expected_and_coeff = {
+        r: {'expected': random_expected(ships), 'coefficients': COEFF}
+        for r in REGIONS
+    }
+    ship_dict = {
+        r: {str(k): v for k, v in random_ship_dict(ships).items()}
+        for r in REGIONS
+    }
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp)
+        with (path / 'expected_and_coeff.json').open('w') as f:
+            dump(expected_and_coeff, f)
+        with (path / 'ship_dict.json').open('w') as f:
+            dump(ship_dict, f)
+        save_wtr_cache(path / 'wtr_cache', expected_and_coeff, ship_dict)
+        print(f'ships per region: {ships:,}')
+        for name, fn in (('json', load_json), ('binary', load_cache)):
+            elapsed, size = measure(fn, path)
+            print(f'{name:<7} load: {elapsed * 1000:.2f}ms, '
+                  f'held: {size / 1024:.1f}KiB')
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 600)
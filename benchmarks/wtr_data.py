@@ -0,0 +1,55 @@
+"""
+Random WTR data shared by the WTR benchmarks and tests.
+"""
+from random import randint, random, uniform
+
+from world_of_warships.wtr_engine import STATS
+
+COEFF = {
+    'ship_frags_importance_weight': 10,
+    'wins_weight': 0.2,
+    'damage_weight': 0.5,
+    'frags_weight': 0.3,
+    'capture_weight': 0.0,
+    'dropped_capture_weight': 0.1,
+    'nominal_rating': 1000
+}
+
+
+def random_expected(ships: int) -> dict:
+    """
+    Generate random expected values.
+    :param ships: the amount of ships.
+    :return: a dict of {str ship id: expected values}
+    """
+    res = {}
+    for ship_id in range(1, ships + 1):
+        expected = {s: uniform(0.1, 2) for s in STATS}
+        expected['damage_dealt'] = uniform(10000, 80000)
+        if ship_id % 17 == 0:
+            expected['planes_killed'] = 0
+        if ship_id % 29 == 0:
+            expected['capture_points'] = 0
+        res[str(ship_id)] = expected
+    return res
+
+
+def random_ship_dict(ships: int) -> dict:
+    return {ship_id: randint(1, 10) for ship_id in range(1, ships + 1, 2)}
+
+
+def random_stats(ships: int, played: int) -> dict:
+    """
+    Generate random player ship stats.
+    :param ships: the amount of ships with expected values.
+    :param played: the amount of ships played.
+    :return: a dict of {int ship id: stats}
+    """
+    res = {}
+    for _ in range(played):
+        battles = randint(0, 500)
+        stat = {s: random() * 2 * battles for s in STATS}
+        stat['damage_dealt'] = uniform(5000, 100000) * battles
+        stat['battles'] = battles
+        res[randint(1, ships + 20)] = stat
+    return res
@@ -15,7 +15,7 @@ from wowspy import WowsAsync
 
 from config import Config
 from data_manager import DataManager
-from data_manager.data_utils import get_prefix
+from data_manager.data_utils import command_prefix
 from scripts.helpers import code_block
 from world_of_warships import WowsManager
 from .anime_searcher import AnimeSearcher
@@ -44,7 +44,7 @@ class Yasen(AutoShardedBot):
         self.session_manager = anime_search.session_manager
         self.wows_manager = wows_manager
         self.wows_api = wows_api
-        super().__init__(get_prefix)
+        super().__init__(command_prefix)
 
     @property
     def default_prefix(self):
@@ -129,8 +129,25 @@ class Yasen(AutoShardedBot):
         self.remove_command('help')
         for cog in cogs:
             self.add_cog(cog)
+        if self.config.shared_db:
+            self.loop.create_task(
+                self.data_manager.poll_forever(logger=self.logger)
+            )
         self.run(self.config.token)
 
+    async def close(self):
+        """
+        Flush all pending db writes before closing the bot.
+        Check :func:`discord.Client.close` for more details.
+        """
+        try:
+            pending = self.data_manager.flush()
+            if pending is not None:
+                await pending
+        except Exception as e:
+            self.logger.log(CRITICAL, f'Failed to flush db writes: {e}')
+        await super().close()
+
     def get_channels(self, type_: Optional[type] = None):
         """
         Get all channels the bot can see with an optional filter.
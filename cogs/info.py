@@ -77,7 +77,7 @@ class BotInfo:
         else:
             await ctx.send(f'The prefix for this bot is {prefix}')
 
-    def __set_prefix(self, guild_id, old_prefix, new_prefix):
+    async def __set_prefix(self, guild_id, old_prefix, new_prefix):
         """
         Method to set prefix for a given guild.
         :param guild_id: the guild id.
@@ -93,7 +93,7 @@ class BotInfo:
                 or '@' in new_prefix:
             return (f'Your prefix contains illegal characters. '
                     f'Please consult {old_prefix}help prefix set')
-        self.bot.data_manager.set_prefix(guild_id, new_prefix)
+        await self.bot.data_manager.set_prefix(guild_id, new_prefix)
         return f'The prefix for this guild has been set to `{new_prefix}`'
 
     @prefix.command()
@@ -109,7 +109,9 @@ class BotInfo:
         Usage: "`{prefix}prefix set YOUR_PREFIX`"
         """
         old_prefix = get_prefix(self.bot, ctx.message)
-        await ctx.send(self.__set_prefix(ctx.guild.id, old_prefix, prefix))
+        await ctx.send(
+            await self.__set_prefix(ctx.guild.id, old_prefix, prefix)
+        )
 
     @prefix.command()
     @commands.guild_only()
@@ -123,7 +125,7 @@ class BotInfo:
         """
         old_prefix = get_prefix(self.bot, ctx.message)
         await ctx.send(
-            self.__set_prefix(
+            await self.__set_prefix(
                 ctx.guild.id, old_prefix, self.bot.default_prefix
             )
         )
@@ -213,7 +213,7 @@ class Music:
                 'Please enter a natural number number between 0 and 255'
             )
             return
-        self.bot.data_manager.set_skip(str(ctx.guild.id), num)
+        await self.bot.data_manager.set_skip(str(ctx.guild.id), num)
         await ctx.send(
             f'The skip count for this guild has been set to **{num}**'
         )
@@ -41,7 +41,7 @@ class Nsfw:
         if url:
             await ctx.send(url)
         if tags:
-            self.bot.data_manager.set_nsfw_tags(site, tags)
+            await self.bot.data_manager.set_nsfw_tags(site, tags)
 
     @commands.command()
     @commands.cooldown(rate=1, per=5, type=commands.BucketType.user)
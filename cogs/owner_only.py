@@ -29,6 +29,26 @@ class OwnerOnly:
         )
         await send_anncoucements(self.bot, res)
 
+    @command()
+    async def cachestats(self, ctx: Context):
+        """
+        Display the hit and miss ratios of the bot caches.
+
+        This is hidden in the help message
+        """
+        res = Embed(colour=self.bot.config.colour, title='Cache stats')
+        stats = self.bot.data_manager.cache_stats()
+        stats['wows players'] = self.bot.wows_manager.players.stats
+        for name, stat in stats.items():
+            res.add_field(
+                name=name,
+                value=f'Hits: {stat["hits"]:,}\n'
+                      f'Misses: {stat["misses"]:,}\n'
+                      f'Evictions: {stat["evictions"]:,}\n'
+                      f'Hit ratio: {stat["hit_ratio"]:.2%}'
+            )
+        await ctx.send(embed=res)
+
 
 async def send_anncoucements(bot: Yasen, embed: Embed):
     for guild in bot.guilds:
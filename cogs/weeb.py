@@ -111,7 +111,7 @@ class Weeb:
         if url:
             await ctx.send(url)
         if tags:
-            self.bot.data_manager.set_nsfw_tags('safebooru', tags)
+            await self.bot.data_manager.set_nsfw_tags('safebooru', tags)
 
     @commands.command()
     async def anime(self, ctx, *, search=None):
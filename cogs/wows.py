@@ -8,8 +8,8 @@ from wowspy import Region
 import world_of_warships.war_gaming as wg
 from bot import Yasen
 from data_manager.data_utils import get_prefix
-from world_of_warships.shell_handler import ConvertRegion, get_clan_id, \
-    get_player_id
+from world_of_warships.shell_handler import ConvertRefresh, ConvertRegion, \
+    get_clan_id, get_player_id
 
 
 class WorldOfWarships:
@@ -20,19 +20,23 @@ class WorldOfWarships:
 
     @commands.command()
     async def shame(self, ctx: Context, name=None,
-                    region: ConvertRegion() = None):
+                    region: ConvertRegion() = None,
+                    refresh: ConvertRefresh() = False):
         """
         Description: Get a World of Warships player stats.
         Regions: "`NA, EU, RU, AS`"
         Usage: "`{prefix}shame player_name region`
-        region defaults to NA if not provided."
+        region defaults to NA if not provided. Add `refresh` after the
+        region to skip stats cached in the last few minutes."
         Extra: "You can look up player by using a mention if the player is
         registered in the database via the `{prefix}shamelist add` command."
         """
         async with ctx.typing():
             region = region or Region.NA
             player_id = await get_player_id(ctx, name, region)
-            res = await self.bot.wows_manager.player_embed(region, player_id)
+            res = await self.bot.wows_manager.player_embed(
+                region, player_id, refresh
+            )
         if isinstance(res, Embed):
             await ctx.send(embed=res)
         else:
@@ -45,27 +49,45 @@ class WorldOfWarships:
 
     @commands.command()
     async def clan(self, ctx: Context, name=None,
-                   region: ConvertRegion() = None):
+                   region: ConvertRegion() = None,
+                   refresh: ConvertRefresh() = False):
         """
         Description: Get a World of Warships clan stats.
         Regions: "`NA, EU, RU, AS`"
         Usage: "`{prefix}clan clan_name region`
-        region defaults to NA if not provided."
+        region defaults to NA if not provided. Add `refresh` after the
+        region to skip stats cached in the last few minutes."
         """
         if not name:
             await ctx.send('Please enter a clan name.')
             return
+        status = None
+        last_edit = 0
+
+        async def progress(done, total):
+            nonlocal status, last_edit
+            if total < 20 or time() - last_edit < 2 or done == total:
+                return
+            last_edit = time()
+            msg = f'Fetching clan members... {done}/{total}'
+            if status is None:
+                status = await ctx.send(msg)
+            else:
+                await status.edit(content=msg)
+
         async with ctx.typing():
             region = region or Region.NA
             clan_id = await get_clan_id(ctx, name, region)
             embed, players = await self.bot.wows_manager.process_clan(
-                region, clan_id)
+                region, clan_id, progress, refresh)
+        if status is not None:
+            await status.delete()
         if isinstance(embed, Embed):
             await ctx.send(embed=embed)
         else:
             await ctx.send(embed)
         if players:
-            await self.bot.wows_manager.cache_players(region, players)
+            self.bot.wows_manager.cache_players(region, players)
 
     @commands.group()
     @commands.guild_only()
@@ -87,9 +109,7 @@ class WorldOfWarships:
                      f'Use `{prefix}shamelist add` '
                      f'to add yourself to the shamelist.')
         guild = ctx.guild
-        shame_list = self.bot.data_manager.get_shame_list(
-            guild.members, str(guild.id)
-        )
+        shame_list = self.bot.data_manager.get_shame_list(guild)
         if not shame_list:
             await ctx.send(empty_msg)
             return
@@ -122,12 +142,13 @@ class WorldOfWarships:
             return
         region = region or Region.NA
         player_id = await wg.get_player_id(
-            region, self.bot.wows_api, self.bot.logger, name
+            region, self.bot.wows_api, self.bot.logger, name,
+            self.bot.wows_manager.ids
         )
         if not player_id:
             await ctx.send(f'Player **{name}** not found!')
         else:
-            self.bot.data_manager.set_shame(
+            await self.bot.data_manager.set_shame(
                 str(ctx.guild.id), str(ctx.author.id),
                 region.name, str(player_id)
             )
@@ -150,7 +171,7 @@ class WorldOfWarships:
         if region not in ('ALL', 'NA', 'EU', 'AS', 'RU'):
             await ctx.send('Please enter a region in `all, NA, EU, RU, AS`')
             return
-        self.bot.data_manager.delete_shame(
+        await self.bot.data_manager.delete_shame(
             str(ctx.guild.id), str(ctx.author.id), region
         )
         noun = 'regions' if region == 'ALL' else 'region'
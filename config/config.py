@@ -1,4 +1,5 @@
 from json import dump, load
+from math import isfinite
 from pathlib import Path
 from typing import List, Optional
 
@@ -111,6 +112,19 @@ class Config:
         if p.is_dir() and tuple(p.iterdir()):
             return p
 
+    @property
+    def shared_db(self) -> bool:
+        return self.__content.get('shared_db', False) is True
+
+    @property
+    def wows_refresh_interval(self) -> float:
+        hours = self.__content.get('wows_refresh_hours', 24)
+        if isinstance(hours, bool) or not isinstance(hours, (int, float)):
+            hours = 24
+        elif hours < 0 or not isfinite(hours):
+            hours = 24
+        return hours * 60 * 60
+
     @property
     def mal_user(self):
         return self.__content['mal_user']
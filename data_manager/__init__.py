@@ -1,3 +1,4 @@
+from data_manager.async_data_manager import AsyncDataManager
 from data_manager.data_manager import DataManager
 
-__all__ = ['DataManager']
+__all__ = ['AsyncDataManager', 'DataManager']
@@ -0,0 +1,170 @@
+from asyncio import AbstractEventLoop, get_event_loop, wrap_future
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from sqlite3 import Connection, connect
+from threading import get_ident, local
+from typing import List, Optional, Tuple, Union
+
+from data_manager.backends import SQLiteBackend, SharedSQLiteBackend, \
+    StorageBackend
+from data_manager.data_manager import DataManager
+
+
+class AsyncDataManager(DataManager):
+    """
+    A SQLite3 data manager that runs all SQL off the event loop.
+
+    Writes go through a dedicated writer thread that owns the backend,
+    reads can optionally use a pool of read only connections.
+    The in-memory getters stay synchronous.
+    """
+    __slots__ = ('path', 'loop', 'writer', 'readers', 'mmap_size', '__local',
+                 '__conns', '__writer_thread')
+
+    def __init__(self, backend: Union[Connection, StorageBackend], path: str,
+                 writer: ThreadPoolExecutor, loop: AbstractEventLoop, *,
+                 read_pool: int = 0, mmap_size: int = 1 << 26, **kwargs):
+        """
+        Initialize the instance of AsyncDataManager on the writer thread.
+        Use AsyncDataManager.from_path instead of this.
+        :param backend: the StorageBackend owned by the writer thread.
+        :param path: the path to the db file.
+        :param writer: the single thread executor for the backend.
+        :param loop: the event loop.
+        :param read_pool: the amount of read only connections, 0 to run
+        reads on the writer thread.
+        :param mmap_size: the maximum amount of bytes of the db to memory map.
+        :param kwargs: the keyword arguments for DataManager.
+        """
+        self.path = path
+        self.loop = loop
+        self.writer = writer
+        self.readers = ThreadPoolExecutor(read_pool) if read_pool else None
+        self.mmap_size = mmap_size
+        self.__local = local()
+        self.__conns = []
+        self.__writer_thread = get_ident()
+        super().__init__(backend, loop=loop, mmap_size=mmap_size, **kwargs)
+
+    @classmethod
+    async def from_path(cls, path: Union[str, Path], *,
+                        loop: Optional[AbstractEventLoop] = None,
+                        shared: bool = False, mmap_size: int = 1 << 26,
+                        **kwargs):
+        """
+        Get an instance of AsyncDataManager. Use this instead of __init__
+        :param path: the path to the db file.
+        :param loop: the event loop.
+        :param shared: True if the db is shared by several bot processes.
+        Use poll_forever to keep the in-memory tables in sync.
+        :param mmap_size: the maximum amount of bytes of the db to memory map.
+        :param kwargs: the keyword arguments for AsyncDataManager.
+        :return: a new instance of AsyncDataManager
+        """
+        loop = loop or get_event_loop()
+        writer = ThreadPoolExecutor(1)
+        path = str(path)
+        backend_cls = SharedSQLiteBackend if shared else SQLiteBackend
+
+        def init():
+            conn = connect(path, check_same_thread=False)
+            return cls(
+                backend_cls(conn, mmap_size), path, writer, loop,
+                mmap_size=mmap_size, **kwargs
+            )
+
+        return await loop.run_in_executor(writer, init)
+
+    def _commit(self, ops: List[Tuple[str, tuple]]):
+        """
+        Commit a list of writes on the writer thread.
+        See DataManager._commit for parameters.
+        :return: a Future of the commit.
+        """
+        return wrap_future(
+            self.writer.submit(super()._commit, ops), loop=self.loop
+        )
+
+    def _load(self, sql: str, params: tuple = ()) -> list:
+        """
+        Run a read query for the lazy caches on the writer thread.
+        This blocks the calling thread, and so the event loop, until the
+        writer thread is done with the pending writes. In lazy mode call
+        preload before using the guild getters so cache misses are loaded
+        off the loop instead.
+        See DataManager._load for parameters.
+        """
+        if get_ident() == self.__writer_thread:
+            return super()._load(sql, params)
+        self.flush()
+        return self.writer.submit(self.backend.query, sql, params).result()
+
+    async def _run(self, fn, *args):
+        """
+        Run a blocking backend call on the writer thread.
+        See DataManager._run for parameters.
+        """
+        return await self.loop.run_in_executor(self.writer, partial(fn, *args))
+
+    def __read(self, sql: str, params: tuple) -> list:
+        """
+        Run a read query on the current reader thread.
+        """
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            conn = connect(
+                f'file:{self.path}?mode=ro', uri=True, check_same_thread=False
+            )
+            conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+            self.__local.conn = conn
+            self.__conns.append(conn)
+        return conn.execute(sql, params).fetchall()
+
+    async def fetch(self, sql: str, params: tuple = ()) -> list:
+        """
+        Run a read query off the event loop, on the read pool if there is
+        one. Writes still pending in the journal are not visible to it.
+        See DataManager.fetch for parameters.
+        """
+        if self.readers is None:
+            return await super().fetch(sql, params)
+        return await self.loop.run_in_executor(
+            self.readers, self.__read, sql, params
+        )
+
+    @staticmethod
+    async def __wait(fut):
+        if fut is not None:
+            await fut
+
+    async def set_prefix(self, guild_id: str, prefix: str):
+        await self.__wait(super().set_prefix(guild_id, prefix))
+
+    async def set_shame(self, guild_id: str, member_id: str, region: str,
+                        player_id: str):
+        await self.__wait(
+            super().set_shame(guild_id, member_id, region, player_id)
+        )
+
+    async def delete_shame(self, guild_id: str, member_id: str, region: str):
+        await self.__wait(super().delete_shame(guild_id, member_id, region))
+
+    async def set_nsfw_tags(self, site: str, tags: List[str]):
+        await self.__wait(super().set_nsfw_tags(site, tags))
+
+    async def set_skip(self, guild_id: str, count: int):
+        await self.__wait(super().set_skip(guild_id, count))
+
+    def close(self):
+        """
+        Flush all pending writes, wait for them to finish and close the
+        db connections.
+        """
+        self.flush()
+        self.writer.submit(self.backend.close)
+        self.writer.shutdown(wait=True)
+        if self.readers is not None:
+            self.readers.shutdown(wait=True)
+        for conn in self.__conns:
+            conn.close()
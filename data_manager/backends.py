@@ -0,0 +1,166 @@
+"""
+Storage backends for DataManager.
+"""
+from abc import ABC, abstractmethod
+from sqlite3 import Connection
+from time import time
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from data_manager.migrations import configure, migrate
+
+__all__ = ['SQLiteBackend', 'SharedSQLiteBackend', 'StorageBackend']
+
+KEY_COLUMNS = {
+    'prefix': ('guild_id', None),
+    'shame': ('guild_id', None),
+    'nsfw': ('site', 'tag'),
+    'skip_count': ('guild_id', None)
+}
+
+
+class StorageBackend(ABC):
+    """
+    The interface of the storage used by DataManager.
+    """
+    __slots__ = ()
+
+    @abstractmethod
+    def commit(self, ops: List[Tuple[str, tuple]]):
+        """
+        Commit a list of writes in one transaction.
+        :param ops: the list of (sql, params)
+        """
+
+    @abstractmethod
+    def query(self, sql: str, params: tuple = ()) -> list:
+        """
+        Run a read query.
+        :param sql: the sql query.
+        :param params: the query parameters.
+        :return: all rows of the result.
+        """
+
+    def changes(self) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        Get the rows changed by other processes since the last call.
+        :return: a list of (table, key, item) where key is the guild id or
+        the nsfw site, and item is the nsfw tag or None for other tables.
+        """
+        return []
+
+    def db_file(self) -> str:
+        """
+        :return: the path to the db file, empty if there is none.
+        """
+        return ''
+
+    def close(self):
+        """
+        Release the storage.
+        """
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    A backend for a SQLite db used by a single process.
+    """
+    __slots__ = ('connection',)
+
+    def __init__(self, connection: Connection, mmap_size: int = 1 << 26):
+        """
+        Tune the connection and bring the db schema up to date.
+        :param connection: the SQLite3 Connection object.
+        :param mmap_size: the maximum amount of bytes of the db to memory map.
+        """
+        configure(connection, mmap_size)
+        migrate(connection)
+        self.connection = connection
+
+    def commit(self, ops: List[Tuple[str, tuple]]):
+        """
+        See StorageBackend.commit
+        Consecutive writes with the same statement are sent as one executemany.
+        """
+        i = 0
+        try:
+            while i < len(ops):
+                sql = ops[i][0]
+                j = i
+                while j < len(ops) and ops[j][0] == sql:
+                    j += 1
+                self.connection.executemany(sql, [p for _, p in ops[i:j]])
+                i = j
+        except Exception:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        return self.connection.execute(sql, params).fetchall()
+
+    def db_file(self) -> str:
+        return self.connection.execute('PRAGMA database_list').fetchone()[2]
+
+    def close(self):
+        self.connection.close()
+
+
+class SharedSQLiteBackend(SQLiteBackend):
+    """
+    A backend for a SQLite db shared by several processes.
+
+    Every write made through this backend is logged into the changes table
+    by temporary triggers on its connection, tagged with a per-process
+    origin. Other processes poll that table to keep their caches coherent.
+    """
+    __slots__ = ('origin', 'last_change', 'retention', '__pruned')
+
+    def __init__(self, connection: Connection, mmap_size: int = 1 << 26,
+                 retention: int = 3600):
+        """
+        :param connection: the SQLite3 Connection object.
+        :param mmap_size: the maximum amount of bytes of the db to memory map.
+        :param retention: the amount of seconds changes are kept for.
+        """
+        super().__init__(connection, mmap_size)
+        self.origin = uuid4().hex
+        self.retention = retention
+        self.__pruned = time()
+        for table, (column, item) in KEY_COLUMNS.items():
+            for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'),
+                               ('DELETE', 'OLD')):
+                item_val = f'{row}.{item}' if item else 'NULL'
+                connection.execute(
+                    f'CREATE TEMP TRIGGER IF NOT EXISTS '
+                    f'{table}_{event.lower()}_log '
+                    f'AFTER {event} ON main.{table} BEGIN '
+                    f'INSERT INTO changes(tbl, key, item, origin, created_at) '
+                    f"VALUES ('{table}', {row}.{column}, {item_val}, "
+                    f"'{self.origin}', "
+                    f"CAST(strftime('%s', 'now') AS INTEGER)); END"
+                )
+        row = connection.execute('SELECT MAX(id) FROM changes').fetchone()
+        self.last_change = row[0] or 0
+
+    def changes(self) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        See StorageBackend.changes
+        Changes older than the retention time are pruned along the way.
+        """
+        rows = self.query(
+            'SELECT id, tbl, key, item, origin FROM changes WHERE id > ? '
+            'ORDER BY id', (self.last_change,)
+        )
+        if rows:
+            self.last_change = rows[-1][0]
+        now = time()
+        if now - self.__pruned > self.retention / 2:
+            self.__pruned = now
+            self.commit([(
+                'DELETE FROM changes WHERE created_at < ?',
+                (int(now) - self.retention,)
+            )])
+        return [(tbl, key, item) for _, tbl, key, item, origin in rows
+                if origin != self.origin]
@@ -0,0 +1,53 @@
+"""
+Compact in-memory forms of the ids and shame entries kept by DataManager.
+
+Discord snowflakes and Wargaming account ids are stored as ints instead of
+strs, and the player ids of a shame entry are kept in a fixed 4-slot tuple
+indexed by region instead of a dict.
+"""
+from typing import Optional, Tuple, Union
+
+REGIONS = ('NA', 'EU', 'AS', 'RU')
+REGION_INDEX = {region: i for i, region in enumerate(REGIONS)}
+EMPTY_ENTRY = (None,) * len(REGIONS)
+
+CompactId = Union[int, str]
+ShameEntry = Tuple[Optional[CompactId], ...]
+
+
+def pack_id(id_: str) -> CompactId:
+    """
+    Get the compact form of an id.
+    :param id_: the id.
+    :return: the id as an int, or as is if it doesn't survive the round
+    trip through int.
+    >>> pack_id('123'), pack_id('0123')
+    (123, '0123')
+    """
+    if isinstance(id_, str) and id_.isdigit():
+        packed = int(id_)
+        if str(packed) == id_:
+            return packed
+    return id_
+
+
+def unpack_id(id_: CompactId) -> str:
+    """
+    Get an id back from its compact form.
+    :param id_: the compact id.
+    :return: the id as a str.
+    """
+    return id_ if isinstance(id_, str) else str(id_)
+
+
+def set_region(entry: ShameEntry, region: str,
+               player_id: Optional[CompactId]) -> ShameEntry:
+    """
+    Get a copy of a shame entry with the player id of a region replaced.
+    :param entry: the shame entry.
+    :param region: the region.
+    :param player_id: the compact player id, None to clear the region.
+    :return: the new shame entry.
+    """
+    i = REGION_INDEX[region]
+    return entry[:i] + (player_id,) + entry[i + 1:]
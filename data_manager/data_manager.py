@@ -1,35 +1,527 @@
+from asyncio import AbstractEventLoop, get_event_loop, sleep
 from collections import OrderedDict
-from difflib import get_close_matches
-from sqlite3 import Connection
-from typing import List, Optional
+from json import dumps, loads
+from logging import getLogger
+from pathlib import Path
+from sqlite3 import Connection, connect
+from typing import Hashable, List, Optional, TextIO, Tuple, Union
 
-from discord.utils import get
+from data_manager.backends import SQLiteBackend, StorageBackend
+from data_manager.compact import EMPTY_ENTRY, REGIONS, REGION_INDEX, \
+    pack_id, set_region, unpack_id
+from data_manager.lru_cache import LRUCache
+from data_manager.tag_index import TagIndex
+from data_manager.write_journal import WriteJournal
+
+TABLES = ('prefix', 'shame', 'nsfw', 'skip_count')
+
+logger = getLogger(__name__)
+
+
+def _build_prefix(rows: list) -> Optional[str]:
+    return rows[0][0] if rows else None
+
+
+def _build_shame(rows: list) -> Optional[dict]:
+    if not rows:
+        return
+    res = {}
+    for m, r, p in rows:
+        m = pack_id(m)
+        res[m] = set_region(res.get(m, EMPTY_ENTRY), r, pack_id(p))
+    return res
+
+
+def _build_site(rows: list) -> Optional[dict]:
+    return dict.fromkeys(t for t, in rows) if rows else None
+
+
+def _build_skip(rows: list) -> Optional[int]:
+    return rows[0][0] if rows else None
+
+
+KEY_QUERIES = {
+    'prefix': ('SELECT prefix FROM prefix WHERE guild_id=?', _build_prefix),
+    'shame': ('SELECT member_id, region, player_id FROM shame '
+              'WHERE guild_id=?', _build_shame),
+    'nsfw': ('SELECT tag FROM nsfw WHERE site=?', _build_site),
+    'skip_count': ('SELECT count FROM skip_count WHERE guild_id=?',
+                   _build_skip)
+}
 
 
 class DataManager:
     """
     A SQLite3 data manager.
+
+    The in-memory tables are keyed by compact ids, see data_manager.compact.
+    Shame entries are kept as {guild: {member: (NA, EU, AS, RU)}}.
     """
-    __slots__ = ('connection', 'nsfw', 'prefix', 'shame', 'skip_count')
+    __slots__ = ('backend', 'nsfw', 'prefix', 'shame', 'skip_count',
+                 'journal', 'tag_index', '__dirty')
 
-    def __init__(self, connection: Connection):
+    def __init__(self, backend: Union[Connection, StorageBackend], *,
+                 write_behind: bool = False,
+                 loop: Optional[AbstractEventLoop] = None,
+                 flush_interval: int = 500, flush_ops: int = 64,
+                 lazy: bool = False, cache_size: int = 4096,
+                 mmap_size: int = 1 << 26):
         """
         Initialize the instance of DataManager.
-        :param connection: the SQLite3 Connection object.
+        :param backend: the StorageBackend, or a SQLite3 Connection object
+        to use with the default SQLiteBackend.
+        :param write_behind: True to batch writes instead of committing
+        every write right away.
+        :param loop: the event loop used for timed flushes in write behind
+        mode.
+        :param flush_interval: the maximum time in ms a write stays pending in
+        write behind mode.
+        :param flush_ops: the amount of pending writes that triggers a flush
+        in write behind mode.
+        :param lazy: True to load rows on first access instead of loading
+        every table at startup.
+        :param cache_size: the weight cap of each table cache in lazy mode,
+        roughly the amount of rows kept in memory per table. The tag index
+        of a site is dropped along with its cached tags.
+        :param mmap_size: the maximum amount of bytes of the db to memory map,
+        used when a Connection is passed in.
+        """
+        if isinstance(backend, Connection):
+            backend = SQLiteBackend(backend, mmap_size)
+        self.backend = backend
+        self.journal = WriteJournal(
+            self._commit, loop, flush_interval, flush_ops
+        ) if write_behind else None
+        self.tag_index = {}
+        self.__dirty = set()
+        if lazy:
+            self.nsfw = LRUCache(
+                self.__loader('nsfw'), cache_size, len,
+                lambda site: self.tag_index.pop(site, None)
+            )
+            self.prefix = LRUCache(self.__loader('prefix'), cache_size)
+            self.shame = LRUCache(self.__loader('shame'), cache_size, len)
+            self.skip_count = LRUCache(
+                self.__loader('skip_count'), cache_size
+            )
+        else:
+            self.nsfw = self.get_nsfw_tags()
+            self.prefix = self.__load_all('prefix')
+            self.shame = self.__load_all('shame')
+            self.skip_count = self.__load_all('skip_count')
+
+    @property
+    def connection(self) -> Optional[Connection]:
+        """
+        :return: the SQLite3 Connection of the backend, if it has one.
+        """
+        return getattr(self.backend, 'connection', None)
+
+    @property
+    def tables(self) -> dict:
+        """
+        :return: a dict of {table name: in-memory table}
+        """
+        return {
+            'prefix': self.prefix,
+            'shame': self.shame,
+            'nsfw': self.nsfw,
+            'skip_count': self.skip_count
+        }
+
+    @property
+    def pending_writes(self) -> int:
+        """
+        :return: the amount of writes not yet committed to the db.
+        """
+        return self.journal.pending if self.journal is not None else 0
+
+    @property
+    def flushed_writes(self) -> int:
+        """
+        :return: the amount of writes committed by the write behind journal.
+        """
+        return self.journal.flushed if self.journal is not None else 0
+
+    def _commit(self, ops: List[Tuple[str, tuple]]):
+        """
+        Commit a list of writes to the db in one transaction.
+        :param ops: the list of (sql, params)
+        """
+        self.backend.commit(ops)
+
+    def _write(self, key: Hashable, sql: str, params: tuple,
+               supersedes=None):
+        """
+        Write to the db, either right away or through the journal.
+        :param key: the coalescing key of the write.
+        :param sql: the sql statement.
+        :param params: the statement parameters.
+        :param supersedes: see WriteJournal.add
+        :return: the result of _commit if the write was committed right away.
+        """
+        self.__dirty.add(key[:2])
+        if self.journal is not None:
+            self.journal.add(key, sql, params, supersedes)
+        else:
+            return self._commit([(sql, params)])
+
+    def _load(self, sql: str, params: tuple = ()) -> list:
+        """
+        Run a read query for the in-memory tables.
+        Pending writes are flushed first so the result is never stale.
+        :param sql: the sql query.
+        :param params: the query parameters.
+        :return: all rows of the result.
+        """
+        self.flush()
+        return self.backend.query(sql, params)
+
+    async def _run(self, fn, *args):
+        """
+        Run a blocking backend call.
+        :param fn: the function.
+        :param args: the function arguments.
+        :return: the result of the call.
+        """
+        return fn(*args)
+
+    def __loader(self, table: str):
+        """
+        Get a function that loads the in-memory entry of a key from the db.
+        :param table: the table name.
+        :return: the loader function for the table.
+        """
+        sql, build = KEY_QUERIES[table]
+        return lambda key: build(self._load(sql, (unpack_id(key),)))
+
+    def __load_all(self, table: str) -> dict:
+        """
+        Load a guild table into its in-memory form.
+        :param table: the table name, one of prefix, shame and skip_count.
+        :return: a dict of {guild: entry}
+        """
+        rows = self._load(f'SELECT * FROM {table}')
+        if table != 'shame':
+            return {pack_id(g): val for g, val in rows}
+        res = {}
+        for g, m, r, p in rows:
+            guild = res.setdefault(pack_id(g), {})
+            m = pack_id(m)
+            guild[m] = set_region(guild.get(m, EMPTY_ENTRY), r, pack_id(p))
+        return res
+
+    def cache_stats(self) -> dict:
+        """
+        Get the hit and miss stats of the table caches in lazy mode.
+        :return: a dict of
+        {table: {'hits': hits, 'misses': misses, 'evictions': evictions,
+        'hit_ratio': hit ratio}}
+        """
+        return {
+            name: {
+                'hits': cache.hits,
+                'misses': cache.misses,
+                'evictions': cache.evictions,
+                'hit_ratio': cache.hit_ratio
+            } for name, cache in self.tables.items()
+            if isinstance(cache, LRUCache)
+        }
+
+    async def preload(self, guild_id: str):
+        """
+        Load the rows of a guild into the lazy caches with fetch, so the
+        getters don't have to load them on the spot. Does nothing for
+        eager tables and guilds already cached.
+        :param guild_id: the guild id.
+        """
+        for table in ('prefix', 'shame', 'skip_count'):
+            store = self.tables[table]
+            key = pack_id(guild_id)
+            if not isinstance(store, LRUCache) or store.cached(key):
+                continue
+            await self.__settle()
+            sql, build = KEY_QUERIES[table]
+            val = build(await self.fetch(sql, (guild_id,)))
+            if not store.cached(key):
+                store.fill(key, val)
+
+    def flush(self):
+        """
+        Commit all pending writes in write behind mode.
+        :return: the result of _commit if there were pending writes.
+        """
+        if self.journal is not None:
+            return self.journal.flush()
+
+    async def fetch(self, sql: str, params: tuple = ()) -> list:
+        """
+        Run a read query.
+        :param sql: the sql query.
+        :param params: the query parameters.
+        :return: all rows of the result.
         """
-        self.connection = connection
-        self.nsfw = self.get_nsfw_tags()
-        self.prefix = self.get_all_prefix()
-        self.shame = self.get_all_shame()
-        self.skip_count = self.get_all_skips()
+        return await self._run(self.backend.query, sql, params)
+
+    async def __settle(self):
+        """
+        Flush all pending writes and wait for them to be committed.
+        """
+        pending = self.flush()
+        if pending is not None:
+            await pending
+
+    async def export_snapshot(self, fp: TextIO, chunk_size: int = 1000):
+        """
+        Export every table as newline delimited JSON, one row per line in
+        the form of {"table": table, "row": [values]}.
+        Rows are read in chunks and the event loop is yielded to between
+        chunks.
+        :param fp: a writable text file object.
+        :param chunk_size: the amount of rows read at once.
+        :return: the amount of rows exported.
+        """
+        await self.__settle()
+        total = 0
+        for table in TABLES:
+            last = 0
+            while True:
+                rows = await self.fetch(
+                    f'SELECT rowid, * FROM {table} '
+                    f'WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                    (last, chunk_size)
+                )
+                if not rows:
+                    break
+                last = rows[-1][0]
+                fp.writelines(
+                    dumps({'table': table, 'row': list(row[1:])}) + '\n'
+                    for row in rows
+                )
+                total += len(rows)
+                await sleep(0)
+        return total
+
+    async def import_snapshot(self, fp: TextIO, chunk_size: int = 1000):
+        """
+        Import rows exported by export_snapshot.
+        Existing rows with the same keys are replaced.
+        :param fp: a readable text file object.
+        :param chunk_size: the amount of rows written per transaction.
+        :return: the amount of rows imported.
+        """
+        await self.__settle()
+        total = 0
+        ops, rows = [], []
+        for line in fp:
+            if not line.strip():
+                continue
+            entry = loads(line)
+            table, row = entry['table'], tuple(entry['row'])
+            if table not in TABLES:
+                raise ValueError(f'Unknown table {table}')
+            marks = ','.join('?' * len(row))
+            verb = 'INSERT OR IGNORE' if table == 'nsfw' else 'REPLACE'
+            ops.append((f'{verb} INTO {table} VALUES ({marks})', row))
+            rows.append((table, row))
+            if len(ops) >= chunk_size:
+                total += await self.__import_chunk(ops, rows)
+                ops, rows = [], []
+        if ops:
+            total += await self.__import_chunk(ops, rows)
+        return total
+
+    async def __import_chunk(self, ops: List[Tuple[str, tuple]],
+                             rows: List[Tuple[str, tuple]]) -> int:
+        """
+        Commit a chunk of imported rows, then apply them to the in-memory
+        tables so they never hold rows the db doesn't have.
+        """
+        pending = self._commit(ops)
+        if pending is not None:
+            await pending
+        for table, row in rows:
+            self.__apply(table, row)
+        await sleep(0)
+        return len(ops)
+
+    def __apply(self, table: str, row: tuple):
+        """
+        Apply an imported row to the in-memory tables.
+        In lazy mode the cached entry is dropped instead.
+        """
+        store = self.tables[table]
+        if table == 'nsfw':
+            key = row[0]
+            self.tag_index.pop(key, None)
+        else:
+            key = pack_id(row[0])
+        if isinstance(store, LRUCache):
+            store.invalidate(key)
+        elif table == 'shame':
+            _, member, region, player = row
+            guild = store.setdefault(key, {})
+            member = pack_id(member)
+            guild[member] = set_region(
+                guild.get(member, EMPTY_ENTRY), region, pack_id(player)
+            )
+        elif table == 'nsfw':
+            store.setdefault(key, {})[row[1]] = None
+        else:
+            store[key] = row[1]
+
+    async def backup(self, path: Union[str, Path], pages: int = 256):
+        """
+        Take a hot backup of the db into another SQLite file.
+        File backed dbs are copied with the SQLite online backup API from a
+        separate connection in a worker thread, so the event loop and the
+        writer are not blocked.
+        :param path: the path to the backup file.
+        :param pages: the amount of pages copied per backup step.
+        """
+        await self.__settle()
+        source = await self._run(self.backend.db_file)
+
+        def run(src: Connection):
+            target = connect(str(path))
+            try:
+                if hasattr(src, 'backup'):
+                    src.backup(target, pages=pages, sleep=0)
+                else:
+                    target.executescript('\n'.join(src.iterdump()))
+            finally:
+                target.close()
+
+        if not source:
+            await self._run(run, self.connection)
+            return
+
+        def run_file():
+            src = connect(source)
+            try:
+                run(src)
+            finally:
+                src.close()
+
+        await get_event_loop().run_in_executor(None, run_file)
+
+    def close(self):
+        """
+        Flush all pending writes and close the backend.
+        """
+        self.flush()
+        self.backend.close()
+
+    async def poll_changes(self) -> int:
+        """
+        Apply the changes other processes made to the db through a shared
+        backend to the in-memory tables.
+        Keys written by this process while polling are left alone, since
+        the local write is the newer one.
+        :return: the amount of changed rows applied.
+        """
+        self.__dirty.clear()
+        await self.__settle()
+        keys = set()
+        tags = {}
+        for table, key, item in await self._run(self.backend.changes):
+            if table == 'nsfw':
+                tags.setdefault(key, {})[item] = None
+            else:
+                keys.add((table, key))
+        for table, key in keys:
+            await self.__refresh(table, key)
+        for site, site_tags in tags.items():
+            await self.__refresh_tags(site, list(site_tags))
+        return len(keys) + sum(len(t) for t in tags.values())
+
+    async def poll_forever(self, interval: float = 1, logger=None):
+        """
+        Poll for changes from other processes until cancelled.
+        A change becomes visible within interval seconds plus the flush
+        interval of the process that made it.
+        :param interval: the amount of seconds between polls.
+        :param logger: the logger for failed polls, if None a failed poll
+        stops polling.
+        """
+        while True:
+            await sleep(interval)
+            try:
+                await self.poll_changes()
+            except Exception as e:
+                if logger is None:
+                    raise
+                logger.warning(f'Failed to poll db changes: {e}')
+
+    async def __refresh(self, table: str, key: str):
+        """
+        Reload the in-memory entry of a key from the db.
+        In lazy mode the cached entry is dropped instead.
+        :param table: the table name.
+        :param key: the guild id.
+        """
+        store = self.tables[table]
+        if isinstance(store, LRUCache):
+            store.invalidate(pack_id(key))
+            return
+        if (table, key) in self.__dirty:
+            return
+        sql, build = KEY_QUERIES[table]
+        val = build(await self.fetch(sql, (key,)))
+        if (table, key) in self.__dirty:
+            return
+        if val is None:
+            store.pop(pack_id(key), None)
+        else:
+            store[pack_id(key)] = val
+
+    async def __refresh_tags(self, site: str, tags: List[str]):
+        """
+        Apply changed nsfw tags of a site to the in-memory tables and the
+        tag index, without reloading the whole site.
+        :param site: the site.
+        :param tags: the changed tags.
+        """
+        store = self.nsfw
+        lazy = isinstance(store, LRUCache)
+        if lazy and store.peek(site) is None:
+            return
+        present = set()
+        for i in range(0, len(tags), 500):
+            chunk = tuple(tags[i:i + 500])
+            marks = ','.join('?' * len(chunk))
+            rows = await self.fetch(
+                f'SELECT tag FROM nsfw WHERE site=? AND tag IN ({marks})',
+                (site,) + chunk
+            )
+            present.update(t for t, in rows)
+        known = store.peek(site) if lazy else store.get(site)
+        if known is None:
+            if lazy:
+                return
+            known = {}
+        added = [t for t in tags if t in present and t not in known]
+        removed = []
+        if ('nsfw', site) not in self.__dirty:
+            removed = [t for t in tags if t not in present and t in known]
+        known.update(dict.fromkeys(added))
+        for tag in removed:
+            del known[tag]
+        if removed:
+            self.tag_index.pop(site, None)
+        elif site in self.tag_index:
+            self.tag_index[site].update(added)
+        if known:
+            store[site] = known
+        elif site in store:
+            del store[site]
 
     def get_all_prefix(self) -> dict:
         """
         Get all prefix from the db.
         :return: a dict of {guild_id: prefix}
         """
-        cur = self.connection.execute('SELECT * FROM prefix')
-        rows = cur.fetchall()
+        rows = self._load('SELECT * FROM prefix')
         return {i: p for i, p in rows} if rows else {}
 
     def get_prefix(self, guild_id: str) -> Optional[str]:
@@ -38,7 +530,7 @@ class DataManager:
         :param guild_id: the guild id.
         :return: the guild prefix if there is any else None.
         """
-        return self.prefix.get(guild_id, None)
+        return self.prefix.get(pack_id(guild_id), None)
 
     def set_prefix(self, guild_id: str, prefix: str):
         """
@@ -46,13 +538,14 @@ class DataManager:
         :param guild_id: the guild id.
         :param prefix: the prefix.
         """
-        if self.prefix.get(guild_id, None) == prefix:
+        key = pack_id(guild_id)
+        if self.prefix.get(key, None) == prefix:
             return
-        self.prefix[guild_id] = prefix
-        self.connection.execute(
+        self.prefix[key] = prefix
+        return self._write(
+            ('prefix', guild_id),
             'REPLACE INTO prefix VALUES(?, ?)', (guild_id, prefix)
         )
-        self.connection.commit()
 
     def get_all_shame(self) -> dict:
         """
@@ -60,8 +553,7 @@ class DataManager:
         :return: a dict of
         {guild_id: {member_id: {'region': region, 'player_id': player_id}}}
         """
-        cur = self.connection.execute('SELECT * FROM shame')
-        rows = cur.fetchall()
+        rows = self._load('SELECT * FROM shame')
         if not rows:
             return {}
         res = {}
@@ -82,11 +574,13 @@ class DataManager:
         :param region: the player region.
         :return: the player id found.
         """
-        assert region in ('NA', 'EU', 'AS', 'RU')
+        assert region in REGION_INDEX
         try:
-            return self.shame[guild_id][member_id][region]
+            entry = self.shame[pack_id(guild_id)][pack_id(member_id)]
         except KeyError:
             return None
+        player_id = entry[REGION_INDEX[region]]
+        return None if player_id is None else unpack_id(player_id)
 
     def set_shame(self, guild_id: str, member_id: str, region: str,
                   player_id: str):
@@ -97,19 +591,22 @@ class DataManager:
         :param region: the region.
         :param player_id: the player id.
         """
-        assert region in ('NA', 'EU', 'AS', 'RU')
-        if self.get_shame(guild_id, member_id, region) == player_id:
+        assert region in REGION_INDEX
+        key, member, player = pack_id(guild_id), pack_id(member_id), \
+            pack_id(player_id)
+        guild = self.shame.get(key, None)
+        if guild is None:
+            guild = {}
+        entry = guild.get(member, EMPTY_ENTRY)
+        if entry[REGION_INDEX[region]] == player:
             return
-        if guild_id not in self.shame:
-            self.shame[guild_id] = {}
-        if member_id not in self.shame[guild_id]:
-            self.shame[guild_id][member_id] = {}
-        self.shame[guild_id][member_id][region] = player_id
-        self.connection.execute(
+        guild[member] = set_region(entry, region, player)
+        self.shame[key] = guild
+        return self._write(
+            ('shame', guild_id, member_id, region),
             'REPLACE INTO shame VALUES (?,?,?,?)',
             (guild_id, member_id, region, player_id)
         )
-        self.connection.commit()
 
     def delete_shame(self, guild_id: str, member_id: str, region: str):
         """
@@ -118,90 +615,142 @@ class DataManager:
         :param member_id: the member id.
         :param region: the region.
         """
-        assert region in ('ALL', 'NA', 'EU', 'AS', 'RU')
+        assert region == 'ALL' or region in REGION_INDEX
+        key, member = pack_id(guild_id), pack_id(member_id)
+        guild = self.shame.get(key, None)
         if region == 'ALL':
             sql = 'DELETE FROM shame WHERE guild_id=? AND member_id=?'
-            self.connection.execute(sql, (guild_id, member_id))
-            try:
-                self.shame[guild_id].pop(member_id)
-            except KeyError:
-                pass
+            res = self._write(
+                ('shame', guild_id, member_id), sql, (guild_id, member_id),
+                lambda k: k[:3] == ('shame', guild_id, member_id)
+            )
+            if guild is not None and guild.pop(member, None) is not None:
+                self.shame[key] = guild
         else:
             sql = ('DELETE FROM shame '
                    'WHERE guild_id=? AND member_id=? AND region=?')
-            self.connection.execute(sql, (guild_id, member_id, region))
-            try:
-                self.shame[guild_id][member_id].pop(region)
-            except KeyError:
-                pass
-        self.connection.commit()
+            res = self._write(
+                ('shame', guild_id, member_id, region),
+                sql, (guild_id, member_id, region)
+            )
+            entry = guild.get(member) if guild is not None else None
+            if entry is not None:
+                entry = set_region(entry, region, None)
+                if entry == EMPTY_ENTRY:
+                    del guild[member]
+                else:
+                    guild[member] = entry
+                self.shame[key] = guild
+        return res
 
-    def get_shame_list(self, members, guild_id: str) -> Optional[OrderedDict]:
+    def _delete_members(self, guild_id: str, member_ids: List[str]):
         """
-        Get shamelist for a given guild.
-        :param members: the list of discord Member objects in the guild list.
+        Delete all shame entries of a list of members in one transaction.
         :param guild_id: the guild id.
+        :param member_ids: the list of member ids.
+        """
+        self.__dirty.add(('shame', guild_id))
+        key = pack_id(guild_id)
+        guild = self.shame.get(key, None)
+        if guild:
+            for member_id in member_ids:
+                guild.pop(pack_id(member_id), None)
+            self.shame[key] = guild
+        ops = []
+        for i in range(0, len(member_ids), 500):
+            chunk = tuple(member_ids[i:i + 500])
+            marks = ','.join('?' * len(chunk))
+            sql = ('DELETE FROM shame '
+                   f'WHERE guild_id=? AND member_id IN ({marks})')
+            ops.append((sql, (guild_id,) + chunk))
+        if self.journal is None:
+            return self._commit(ops)
+        stale = {('shame', guild_id, m) for m in member_ids}
+        for sql, params in ops:
+            self.journal.add(
+                ('shame', guild_id, params[1:]), sql, params,
+                lambda k: k[:3] in stale
+            )
+
+    def get_shame_list(self, guild) -> Optional[OrderedDict]:
+        """
+        Get shamelist for a given guild.
+        Members that left the guild are removed from the shamelist.
+        :param guild: the discord Guild object.
         :return: an OrderedDict of {region: player discord name}
         """
-        guild = self.shame.get(guild_id, None)
-        if not guild:
+        guild_id = str(guild.id)
+        entries = self.shame.get(pack_id(guild_id), None)
+        if not entries:
             return
         bad = []
-        res = OrderedDict({
-            'NA': [],
-            'EU': [],
-            'AS': [],
-            'RU': []
-        })
-        for member_id, val in guild.items():
-            if not val or not any(val.values()):
+        res = OrderedDict((r, []) for r in REGIONS)
+        for member_id, entry in entries.items():
+            if not any(entry):
                 continue
-            member = get(members, id=int(member_id))
+            member = guild.get_member(int(member_id))
             if not member:
-                bad.append(member_id)
+                bad.append(unpack_id(member_id))
                 continue
-            for r in val:
-                if val[r]:
+            for r, player_id in zip(REGIONS, entry):
+                if player_id:
                     res[r].append(str(member))
-        for bad_id in set(bad):
-            self.delete_shame(guild_id, bad_id, 'ALL')
+        if bad:
+            pending = self._delete_members(guild_id, bad)
+            if pending is not None:
+                pending.add_done_callback(self.__log_failure)
         return res if any(res.values()) else None
 
+    @staticmethod
+    def __log_failure(fut):
+        """
+        Log the error of a write nobody waits for.
+        :param fut: the Future of the write.
+        """
+        if not fut.cancelled() and fut.exception() is not None:
+            logger.error(f'Failed to commit db writes: {fut.exception()}')
+
     def get_nsfw_tags(self) -> dict:
         """
         Get all nsfw tags stored.
-        :return: a dict of {site: tags}
+        The tags of a site are stored as the keys of a dict, so membership
+        checks are O(1) while the insertion order is kept.
+        :return: a dict of {site: {tag: None}}
         """
-        cur = self.connection.execute('SELECT * FROM nsfw')
-        rows = cur.fetchall()
+        rows = self._load('SELECT * FROM nsfw')
         if not rows:
             return {}
         res = {}
         for site, tag in rows:
             if site not in res:
-                res[site] = []
-            res[site].append(tag)
+                res[site] = {}
+            res[site][tag] = None
         return res
 
     def set_nsfw_tags(self, site: str, tags: List[str]):
         """
         Set nsfw tags for a site.
+        Only the tags not already stored are written, in one executemany.
         :param site: the site.
-        :param tags: the list of tags.
+        :param tags: the list of tags, may contain duplicates.
         """
         if site not in self.nsfw:
-            self.nsfw[site] = []
-        new = []
-        for tag in tags:
-            if tag not in self.nsfw[site]:
-                self.nsfw[site].append(tag)
-                new.append(tag)
-        if new:
-            self.connection.executemany(
-                'INSERT INTO nsfw(site, tag) VALUES (?, ?)',
-                [(site, t) for t in new]
-            )
-            self.connection.commit()
+            self.nsfw[site] = {}
+        known = self.nsfw[site]
+        new = [tag for tag in dict.fromkeys(tags) if tag not in known]
+        known.update(dict.fromkeys(new))
+        if not new:
+            return
+        self.nsfw[site] = known
+        self.__dirty.add(('nsfw', site))
+        index = self.tag_index.get(site)
+        if index is not None:
+            index.update(new)
+        sql = 'INSERT OR IGNORE INTO nsfw(site, tag) VALUES (?, ?)'
+        if self.journal is None:
+            return self._commit([(sql, (site, tag)) for tag in new])
+        for tag in new:
+            self.journal.add(('nsfw', site, tag), sql, (site, tag))
 
     def match_tag(self, site: str, tag: str) -> Optional[str]:
         """
@@ -214,8 +763,9 @@ class DataManager:
             return
         if tag in self.nsfw[site]:
             return tag
-        res = get_close_matches(tag, self.nsfw[site], 1, cutoff=0.4)
-        return res[0] if res else None
+        if site not in self.tag_index:
+            self.tag_index[site] = TagIndex(self.nsfw[site])
+        return self.tag_index[site].match(tag, cutoff=0.4)
 
     def tag_exist(self, site: str, tag: str) -> bool:
         """
@@ -231,8 +781,7 @@ class DataManager:
         Get all skip count for all guilds.
         :return: a dict of {guild_id: skip count}
         """
-        cur = self.connection.execute('SELECT * FROM skip_count')
-        rows = cur.fetchall()
+        rows = self._load('SELECT * FROM skip_count')
         return {id_: count for id_, count in rows} if rows else {}
 
     def get_skip(self, guild_id: str) -> Optional[int]:
@@ -241,7 +790,7 @@ class DataManager:
         :param guild_id:
         :return:
         """
-        return self.skip_count.get(guild_id, None)
+        return self.skip_count.get(pack_id(guild_id), None)
 
     def set_skip(self, guild_id: str, count: int):
         """
@@ -249,10 +798,11 @@ class DataManager:
         :param guild_id: the guild id.
         :param count: the count.
         """
-        if self.skip_count.get(guild_id, None) == count:
+        key = pack_id(guild_id)
+        if self.skip_count.get(key, None) == count:
             return
-        self.skip_count[guild_id] = count
-        self.connection.execute(
+        self.skip_count[key] = count
+        return self._write(
+            ('skip_count', guild_id),
             'REPLACE INTO skip_count VALUES (?, ?)', (guild_id, count)
         )
-        self.connection.commit()
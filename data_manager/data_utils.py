@@ -16,3 +16,17 @@ def get_prefix(yasen, message: Message):
         return yasen.data_manager.get_prefix(str(guild.id)) or default
     except AttributeError:
         return default
+
+
+async def command_prefix(yasen, message: Message):
+    """
+    Get command prefix for a message, used as the bot's command prefix.
+    The guild's rows are loaded into the lazy caches on the way, so the
+    commands run by the message don't block on the db.
+    :param yasen: the bot instance.
+    :param message: the message.
+    :return: the prefix for that message.
+    """
+    if message.guild:
+        await yasen.data_manager.preload(str(message.guild.id))
+    return get_prefix(yasen, message)
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache(MutableMapping):
+    """
+    A read through mapping that keeps the least recently used entries
+    under a weight cap.
+
+    Keys not in the cache are loaded with the loader, keys the loader
+    doesn't find are cached as missing so they are not looked up again.
+    """
+    __slots__ = ('loader', 'capacity', 'weigher', 'on_evict', 'weight',
+                 'hits', 'misses', 'evictions', '__data')
+
+    def __init__(self, loader: Callable[[Hashable], Optional[object]],
+                 capacity: int, weigher: Callable[[object], int] = None,
+                 on_evict: Callable[[Hashable], None] = None):
+        """
+        :param loader: a callable that returns the value for a key,
+        or None if the key doesn't exist.
+        :param capacity: the maximum total weight of the cached entries.
+        :param weigher: a callable that returns the weight of a value,
+        every entry weighs 1 if not provided. Values changed in place must
+        be stored again to be weighed again.
+        :param on_evict: an optional callable called with the key of every
+        entry evicted or invalidated.
+        """
+        self.loader = loader
+        self.capacity = capacity
+        self.weigher = weigher
+        self.on_evict = on_evict
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__data = OrderedDict()
+
+    def __weigh(self, val) -> int:
+        if val is _MISSING or not self.weigher:
+            return 1
+        return max(1, self.weigher(val))
+
+    def __store(self, key, val):
+        old = self.__data.pop(key, None)
+        if old is not None:
+            self.weight -= old[1]
+        weight = self.__weigh(val)
+        self.__data[key] = (val, weight)
+        self.weight += weight
+        while self.weight > self.capacity and len(self.__data) > 1:
+            old_key, (_, w) = self.__data.popitem(last=False)
+            self.weight -= w
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(old_key)
+
+    def __getitem__(self, key):
+        try:
+            val = self.__data[key][0]
+        except KeyError:
+            self.misses += 1
+            val = self.loader(key)
+            if val is None:
+                val = _MISSING
+            self.__store(key, val)
+        else:
+            self.hits += 1
+            self.__data.move_to_end(key)
+        if val is _MISSING:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key, val):
+        self.__store(key, val)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.__store(key, _MISSING)
+
+    def __iter__(self):
+        return (k for k, (v, _) in self.__data.items() if v is not _MISSING)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def items(self):
+        """
+        :return: a list of the cached (key, value), without touching the
+        LRU order.
+        """
+        data = self.__data.items()
+        return [(k, v) for k, (v, _) in data if v is not _MISSING]
+
+    def values(self):
+        return [v for _, v in self.items()]
+
+    def cached(self, key: Hashable) -> bool:
+        """
+        Check if a key is cached, as a value or as missing.
+        :param key: the key.
+        :return: True if looking up the key won't call the loader.
+        """
+        return key in self.__data
+
+    def fill(self, key: Hashable, val):
+        """
+        Cache a value loaded outside of the cache.
+        :param key: the key.
+        :param val: the value, None to cache the key as missing.
+        """
+        self.__store(key, _MISSING if val is None else val)
+
+    def peek(self, key: Hashable, default=None):
+        """
+        Get a cached value without loading it or touching the LRU order.
+        :param key: the key.
+        :param default: the value returned if the key is not cached.
+        :return: the cached value, or default.
+        """
+        entry = self.__data.get(key)
+        if entry is None or entry[0] is _MISSING:
+            return default
+        return entry[0]
+
+    def invalidate(self, key: Hashable = None):
+        """
+        Drop cached entries so they are loaded again on next access.
+        :param key: the key to drop, None to drop every entry.
+        """
+        if key is None:
+            keys = list(self.__data)
+            self.__data.clear()
+            self.weight = 0
+        else:
+            old = self.__data.pop(key, None)
+            if old is None:
+                return
+            self.weight -= old[1]
+            keys = [key]
+        if self.on_evict:
+            for k in keys:
+                self.on_evict(k)
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        :return: the ratio of lookups served from the cache.
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
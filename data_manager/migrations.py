@@ -0,0 +1,141 @@
+"""
+Versioned schema migrations for the bot db.
+"""
+from sqlite3 import Connection
+from time import time
+from typing import List, Tuple
+
+__all__ = ['MIGRATIONS', 'configure', 'migrate', 'schema_version']
+
+
+def _ensure_index(connection: Connection, name: str, table: str,
+                  columns: Tuple[str, ...]):
+    """
+    Create an index unless an existing index already starts with the
+    same columns, e.g. the one SQLite builds for a UNIQUE constraint.
+    :param connection: the SQLite3 Connection object.
+    :param name: the index name.
+    :param table: the table name.
+    :param columns: the indexed columns.
+    """
+    for row in connection.execute(f'PRAGMA index_list({table})'):
+        info = connection.execute(f'PRAGMA index_info({row[1]})').fetchall()
+        indexed = tuple(col for _, _, col in sorted(info))
+        if indexed[:len(columns)] == columns:
+            return
+    connection.execute(
+        f'CREATE INDEX IF NOT EXISTS {name} ON {table}({",".join(columns)})'
+    )
+
+
+def _create_tables(connection: Connection):
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS nsfw('
+        'site VARCHAR NOT NULL,'
+        'tag VARCHAR NOT NULL,'
+        'UNIQUE (site, tag)'
+        ')'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS prefix('
+        'guild_id VARCHAR PRIMARY KEY,'
+        'prefix VARCHAR NOT NULL'
+        ')'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS shame('
+        'guild_id VARCHAR NOT NULL,'
+        'member_id VARCHAR NOT NULL,'
+        'region VARCHAR NOT NULL,'
+        'player_id VARCHAR NOT NULL,'
+        'UNIQUE (guild_id, member_id, region)'
+        ')'
+    )
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS skip_count('
+        'guild_id VARCHAR PRIMARY KEY,'
+        'count INT NOT NULL'
+        ')'
+    )
+
+
+def _create_indexes(connection: Connection):
+    _ensure_index(
+        connection, 'shame_guild_member', 'shame', ('guild_id', 'member_id')
+    )
+    _ensure_index(connection, 'nsfw_site', 'nsfw', ('site',))
+
+
+def _create_change_log(connection: Connection):
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS changes('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT,'
+        'tbl VARCHAR NOT NULL,'
+        'key VARCHAR NOT NULL,'
+        'item VARCHAR,'
+        'origin VARCHAR NOT NULL,'
+        'created_at INTEGER NOT NULL'
+        ')'
+    )
+
+
+MIGRATIONS = [
+    (1, 'Create tables', _create_tables),
+    (2, 'Index shame by guild and member, nsfw by site', _create_indexes),
+    (3, 'Create change log for shared mode', _create_change_log),
+]
+
+
+def configure(connection: Connection, mmap_size: int):
+    """
+    Tune a connection for the bot's query patterns.
+    :param connection: the SQLite3 Connection object.
+    :param mmap_size: the maximum amount of bytes of the db to memory map.
+    """
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+
+
+def schema_version(connection: Connection) -> int:
+    """
+    Get the schema version of a db.
+    :param connection: the SQLite3 Connection object.
+    :return: the latest applied migration version, 0 if none.
+    """
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS schema_version('
+        'version INTEGER PRIMARY KEY,'
+        'description VARCHAR NOT NULL,'
+        'applied_at INTEGER NOT NULL'
+        ')'
+    )
+    connection.commit()
+    row = connection.execute(
+        'SELECT MAX(version) FROM schema_version'
+    ).fetchone()
+    return row[0] or 0
+
+
+def migrate(connection: Connection) -> List[int]:
+    """
+    Apply all migrations newer than the db schema version.
+    Each migration runs in its own transaction along with its version
+    record.
+    :param connection: the SQLite3 Connection object.
+    :return: the list of applied versions.
+    """
+    current = schema_version(connection)
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        with connection:
+            connection.execute('BEGIN')
+            apply(connection)
+            connection.execute(
+                'INSERT INTO schema_version VALUES (?, ?, ?)',
+                (version, description, int(time()))
+            )
+        applied.append(version)
+    return applied
@@ -0,0 +1,115 @@
+from collections import Counter
+from difflib import SequenceMatcher
+from heapq import nlargest
+from typing import Iterable, List, Optional
+
+
+def trigrams(s: str) -> set:
+    """
+    Get the set of trigrams of a string, padded so short strings have some.
+    :param s: the string.
+    :return: the set of trigrams.
+    >>> sorted(trigrams('ab'))
+    ['\\x00\\x00a', '\\x00ab', 'ab\\x00']
+    """
+    padded = f'\0\0{s}\0'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TagIndex:
+    """
+    A trigram inverted index for fuzzy tag matching.
+
+    Candidates are picked by the amount of trigrams they share with the
+    query, then ranked with the same ratio difflib.get_close_matches uses.
+    Tags that share less than half as many trigrams as the best candidate
+    are never ranked.
+    """
+    __slots__ = ('tags', 'grams', 'postings', 'candidates')
+
+    def __init__(self, tags: Iterable[str] = (), candidates: int = 16):
+        """
+        :param tags: the initial tags.
+        :param candidates: the amount of candidates ranked per query.
+        """
+        self.tags = []
+        self.grams = []
+        self.postings = {}
+        self.candidates = candidates
+        self.update(tags)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def add(self, tag: str):
+        """
+        Add a tag to the index. The tag must not already be indexed.
+        :param tag: the tag.
+        """
+        i = len(self.tags)
+        grams = trigrams(tag)
+        self.tags.append(tag)
+        self.grams.append(len(grams))
+        for gram in grams:
+            try:
+                self.postings[gram].append(i)
+            except KeyError:
+                self.postings[gram] = [i]
+
+    def update(self, tags: Iterable[str]):
+        """
+        Add a list of tags to the index.
+        :param tags: the tags.
+        """
+        for tag in tags:
+            self.add(tag)
+
+    def match(self, word: str, cutoff: float = 0.4) -> Optional[str]:
+        """
+        Get the indexed tag closest to a word.
+        :param word: the word.
+        :param cutoff: the minimum similarity ratio of a match.
+        :return: the closest tag if any is similar enough, else None.
+        """
+        res = self.close_matches(word, 1, cutoff)
+        return res[0] if res else None
+
+    def close_matches(self, word: str, n: int = 3,
+                      cutoff: float = 0.6) -> List[str]:
+        """
+        Same as difflib.get_close_matches, but only ranks the tags that
+        share the most trigrams with the word.
+        :param word: the word.
+        :param n: the maximum amount of matches.
+        :param cutoff: the minimum similarity ratio of a match.
+        :return: a list of the best matches, best first.
+        """
+        word_grams = trigrams(word)
+        counts = Counter()
+        postings = self.postings
+        for gram in word_grams:
+            posting = postings.get(gram)
+            if posting:
+                counts.update(posting)
+        if not counts:
+            return []
+        least = max(counts.values()) // 2
+        size = len(word_grams)
+        grams = self.grams
+        dice = lambda i: counts[i] / (size + grams[i])
+        picked = nlargest(
+            self.candidates,
+            [i for i, c in counts.items() if c >= least], key=dice
+        )
+        matcher = SequenceMatcher()
+        matcher.set_seq2(word)
+        res = []
+        for i in picked:
+            tag = self.tags[i]
+            matcher.set_seq1(tag)
+            if matcher.real_quick_ratio() >= cutoff and \
+                    matcher.quick_ratio() >= cutoff:
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    res.append((ratio, tag))
+        return [tag for _, tag in nlargest(n, res)]
@@ -0,0 +1,160 @@
+from asyncio import AbstractEventLoop
+from collections import OrderedDict
+from functools import partial
+from logging import getLogger
+from typing import Callable, Hashable, List, Optional, Tuple
+
+logger = getLogger(__name__)
+
+MAX_BACKOFF = 60000
+
+
+class WriteJournal:
+    """
+    A coalescing write-behind journal for SQL statements.
+
+    Every write is stored under a key, a later write with the same key
+    replaces the earlier one. The pending writes are handed to a sink in
+    one batch, either after a delay or when enough writes accumulate.
+    If the sink fails, the batch is put back and flushed again later, the
+    delay doubles with every consecutive failure up to MAX_BACKOFF ms.
+    """
+    __slots__ = ('sink', 'loop', 'interval', 'max_ops', 'flushed',
+                 'failures', '__ops', '__handle')
+
+    def __init__(self, sink: Callable[[List[Tuple[str, tuple]]], None],
+                 loop: Optional[AbstractEventLoop] = None,
+                 interval: int = 500, max_ops: int = 64):
+        """
+        :param sink: a callable that commits a list of (sql, params) in one
+        transaction, it may return a Future of the commit.
+        :param loop: the event loop used to schedule timed flushes. If None,
+        the journal is only flushed by size or by calling flush.
+        :param interval: the maximum time in ms a write stays pending.
+        :param max_ops: the amount of pending writes that triggers a flush.
+        """
+        self.sink = sink
+        self.loop = loop
+        self.interval = interval
+        self.max_ops = max_ops
+        self.flushed = 0
+        self.failures = 0
+        self.__ops = OrderedDict()
+        self.__handle = None
+
+    def __len__(self):
+        return len(self.__ops)
+
+    def __contains__(self, key: Hashable):
+        return key in self.__ops
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: the amount of writes waiting to be flushed.
+        """
+        return len(self.__ops)
+
+    def add(self, key: Hashable, sql: str, params: tuple,
+            supersedes: Callable[[Hashable], bool] = None):
+        """
+        Add a write to the journal.
+        :param key: the coalescing key of the write.
+        :param sql: the sql statement.
+        :param params: the statement parameters.
+        :param supersedes: an optional predicate, pending writes with a
+        matching key are dropped since this write makes them obsolete.
+        """
+        if supersedes:
+            for old in [k for k in self.__ops if supersedes(k)]:
+                del self.__ops[old]
+        self.__ops.pop(key, None)
+        self.__ops[key] = (sql, params)
+        if len(self.__ops) >= self.max_ops:
+            self.flush()
+        else:
+            self.__schedule()
+
+    def __schedule(self):
+        """
+        Schedule a timed flush if there is a loop and none is scheduled.
+        The delay backs off after failed flushes.
+        """
+        if self.__handle is None and self.loop is not None:
+            delay = min(self.interval << min(self.failures, 16), MAX_BACKOFF)
+            self.__handle = self.loop.call_later(
+                delay / 1000, self.__timed_flush
+            )
+
+    def __timed_flush(self):
+        """
+        Flush from the loop, a failure is logged and retried later.
+        """
+        self.__handle = None
+        try:
+            self.flush()
+        except Exception as e:
+            self.__failed(e)
+
+    def __failed(self, e: Optional[BaseException]):
+        """
+        Log a failed flush and schedule a retry.
+        """
+        self.failures += 1
+        logger.error(
+            f'Failed to commit {len(self.__ops)} db writes, '
+            f'attempt {self.failures}: {e!r}'
+        )
+        if self.__handle is not None:
+            self.__handle.cancel()
+            self.__handle = None
+        self.__schedule()
+
+    def __restore(self, pending: OrderedDict):
+        """
+        Put a failed batch back in front of the writes added since.
+        A key written again since keeps only its newest write, at the
+        position of that write, so the batch can't reorder it.
+        """
+        ops = OrderedDict(pending)
+        for key, op in self.__ops.items():
+            ops.pop(key, None)
+            ops[key] = op
+        self.__ops = ops
+
+    def __done(self, pending: OrderedDict, fut):
+        """
+        Count a batch committed by a Future, or put it back if it failed.
+        """
+        if fut.cancelled() or fut.exception() is not None:
+            self.__restore(pending)
+            self.__failed(None if fut.cancelled() else fut.exception())
+        else:
+            self.failures = 0
+            self.flushed += len(pending)
+
+    def flush(self):
+        """
+        Hand all pending writes to the sink in one batch.
+        Writes are only counted as flushed once the sink, or the Future
+        it returns, succeeds.
+        :return: the result of the sink, if it was called.
+        """
+        if self.__handle is not None:
+            self.__handle.cancel()
+            self.__handle = None
+        if not self.__ops:
+            return
+        pending = self.__ops
+        self.__ops = OrderedDict()
+        try:
+            res = self.sink(list(pending.values()))
+        except Exception:
+            self.__restore(pending)
+            raise
+        if hasattr(res, 'add_done_callback'):
+            res.add_done_callback(partial(self.__done, pending))
+        else:
+            self.failures = 0
+            self.flushed += len(pending)
+        return res
@@ -1,7 +1,9 @@
 import re
-from collections import Iterable
+from collections.abc import Iterable
 from datetime import date, timedelta
 from itertools import chain, zip_longest
+from os import replace
+from pathlib import Path
 from textwrap import wrap
 from typing import List, Type, Union
 
@@ -93,6 +95,21 @@ def get_date(diff: int) -> str:
     return yesterday.strftime('%Y%m%d')
 
 
+def write_atomic(path: Path, data: Union[str, bytes]):
+    """
+    Write a file so readers see either the old or the new content.
+    The data is written to a temporary file next to path, then moved over
+    it.
+    :param path: the path to the file.
+    :param data: the file content.
+    """
+    tmp = path.with_name(path.name + '.tmp')
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    with tmp.open(mode) as f:
+        f.write(data)
+    replace(str(tmp), str(path))
+
+
 def try_divide(numerator: Union[int, float], denominator: Union[int, float]):
     """
     Try to divide two numbers.
@@ -2,43 +2,28 @@ from random import sample
 from sqlite3 import connect
 
 from data_manager import DataManager
+from data_manager.compact import REGIONS, pack_id
 
-__tables = [
-    'CREATE TABLE nsfw('
-    'site VARCHAR NOT NULL,'
-    'tag VARCHAR NOT NULL,'
-    'UNIQUE (site, tag)'
-    ')',
 
-    'CREATE TABLE prefix('
-    'guild_id VARCHAR PRIMARY KEY,'
-    'prefix VARCHAR NOT NULL'
-    ')',
+def get_manager(**kwargs):
+    return DataManager(connect(':memory:'), **kwargs)
 
-    'CREATE TABLE shame('
-    'guild_id VARCHAR NOT NULL,'
-    'member_id VARCHAR NOT NULL,'
-    'region VARCHAR NOT NULL,'
-    'player_id VARCHAR NOT NULL,'
-    'UNIQUE (guild_id, member_id, region)'
-    ')',
 
-    'CREATE TABLE skip_count('
-    'guild_id VARCHAR PRIMARY KEY,'
-    'count INT NOT NULL'
-    ')'
-]
+def random_strs(amt):
+    return [str(i) for i in sample(range(1, 10000), amt)]
 
 
-def get_manager():
-    conn = connect(':memory:')
-    for sql in __tables:
-        conn.execute(sql)
-    return DataManager(conn)
+def compact_keys(d):
+    return {pack_id(k): v for k, v in d.items()}
 
 
-def random_strs(amt):
-    return [str(i) for i in sample(range(1, 10000), amt)]
+def compact_shame(d):
+    return {
+        pack_id(g): {
+            pack_id(m): tuple(pack_id(p.get(r)) for r in REGIONS)
+            for m, p in members.items()
+        } for g, members in d.items()
+    }
 
 
-__all__ = ['get_manager', 'random_strs']
+__all__ = ['compact_keys', 'compact_shame', 'get_manager', 'random_strs']
@@ -1,8 +1,14 @@
+from asyncio import new_event_loop, sleep
+from io import StringIO
 from random import randint, sample
+from sqlite3 import OperationalError, connect
 
-from pytest import fixture
+from pytest import fixture, mark, raises
 
-from data_manager import DataManager
+from data_manager import AsyncDataManager, DataManager
+from data_manager.backends import SharedSQLiteBackend
+from data_manager.migrations import MIGRATIONS, migrate, schema_version
+from data_manager.write_journal import WriteJournal
 from tests import *
 
 
@@ -42,7 +48,8 @@ def test_prefix(manager: DataManager):
         manager.set_prefix(id_, prefix)
         assert manager.get_prefix(id_) == prefix
         expected[id_] = prefix
-    assert manager.get_all_prefix() == expected == manager.prefix
+    assert manager.get_all_prefix() == expected
+    assert compact_keys(expected) == manager.prefix
 
 
 def test_shame(manager: DataManager):
@@ -61,7 +68,8 @@ def test_shame(manager: DataManager):
                 manager.set_shame(guild, member, reg, id_)
                 assert manager.get_shame(guild, member, reg) == id_
             expected[guild][member] = player
-    assert expected == manager.get_all_shame() == manager.shame
+    assert expected == manager.get_all_shame()
+    assert compact_shame(expected) == manager.shame
 
 
 def test_nsfw(manager: DataManager):
@@ -73,8 +81,13 @@ def test_nsfw(manager: DataManager):
     for site in sites:
         tags = random_strs(60)
         expected[site] = tags
-        manager.set_nsfw_tags(site, tags)
-    assert manager.get_nsfw_tags() == expected == manager.nsfw
+        manager.set_nsfw_tags(site, tags + tags[:10])
+        manager.set_nsfw_tags(site, tags[30:])
+        assert manager.tag_exist(site, tags[0])
+        assert not manager.tag_exist(site, 'not a tag')
+    as_lists = lambda d: {site: list(tags) for site, tags in d.items()}
+    assert as_lists(manager.get_nsfw_tags()) == expected
+    assert as_lists(manager.nsfw) == expected
 
 
 def test_skip_count(manager: DataManager):
@@ -89,4 +102,405 @@ def test_skip_count(manager: DataManager):
         manager.set_skip(id_, skip)
         assert manager.get_skip(id_) == skip
         expected[id_] = skip
-    assert manager.get_all_skips() == expected == manager.skip_count
+    assert manager.get_all_skips() == expected
+    assert compact_keys(expected) == manager.skip_count
+
+
+def test_write_behind():
+    """
+    Test write behind mode in DataManager
+    """
+    manager = get_manager(write_behind=True, flush_ops=1000)
+    count = lambda t: manager.connection.execute(
+        f'SELECT COUNT(*) FROM {t}').fetchone()[0]
+    ids = random_strs(20)
+    for id_ in ids:
+        manager.set_prefix(id_, '!')
+        manager.set_prefix(id_, '?')
+        manager.set_skip(id_, 3)
+    manager.set_shame(ids[0], ids[1], 'NA', ids[2])
+    manager.set_shame(ids[0], ids[1], 'EU', ids[3])
+    manager.delete_shame(ids[0], ids[1], 'ALL')
+    manager.set_shame(ids[0], ids[1], 'AS', ids[4])
+    manager.set_nsfw_tags('site', ids)
+    assert manager.pending_writes == 20 + 20 + 2 + 20
+    assert count('prefix') == count('skip_count') == count('shame') == 0
+    manager.flush()
+    assert manager.pending_writes == 0
+    assert manager.flushed_writes == 62
+    assert manager.get_all_prefix() == {id_: '?' for id_ in ids}
+    assert manager.get_all_shame() == {ids[0]: {ids[1]: {'AS': ids[4]}}}
+    assert list(manager.get_nsfw_tags()['site']) == ids
+    assert compact_keys(manager.get_all_skips()) == manager.skip_count
+
+
+def test_write_behind_max_ops():
+    """
+    Test the write behind journal flushes when it's full
+    """
+    manager = get_manager(write_behind=True, flush_ops=5)
+    for id_ in random_strs(12):
+        manager.set_skip(id_, 1)
+    assert manager.pending_writes == 2
+    assert manager.flushed_writes == 10
+    assert len(manager.get_all_skips()) == 12
+
+
+def test_write_behind_failed_commit():
+    """
+    Test a batch whose commit Future fails is put back in the journal
+    """
+    loop = new_event_loop()
+    fail = [True]
+
+    def sink(ops):
+        fut = loop.create_future()
+        if fail[0]:
+            fut.set_exception(OperationalError('database is locked'))
+        else:
+            fut.set_result(len(ops))
+        return fut
+
+    journal = WriteJournal(sink, max_ops=100)
+    journal.add('a', 'sql', (1,))
+    journal.add('b', 'sql', (2,))
+    with raises(OperationalError):
+        loop.run_until_complete(journal.flush())
+    assert journal.pending == 2
+    assert journal.flushed == 0
+    journal.add('a', 'sql', (3,))
+    fail[0] = False
+    assert loop.run_until_complete(journal.flush()) == 2
+    assert journal.pending == 0
+    assert journal.flushed == 2
+    loop.close()
+
+
+def test_journal_restore_order(caplog):
+    """
+    Test a failed batch is put back without reordering the writes added
+    while it was committing, and timed retries back off and are logged
+    """
+    loop = new_event_loop()
+    futs = []
+    batches = []
+
+    def sink(ops):
+        batches.append(ops)
+        futs.append(loop.create_future())
+        return futs[-1]
+
+    journal = WriteJournal(sink, loop, interval=10, max_ops=100)
+    journal.add(('g', 'NA'), 'REPLACE', ('3',))
+    journal.flush()
+    journal.add(('g', 'ALL'), 'DELETE', (),
+                lambda k: k[0] == 'g' and k != ('g', 'ALL'))
+    journal.add(('g', 'NA'), 'REPLACE', ('4',))
+    futs[-1].set_exception(OperationalError('database is locked'))
+    loop.run_until_complete(sleep(0))
+    assert journal.failures == 1
+    assert 'database is locked' in caplog.text
+    loop.run_until_complete(sleep(0.01))
+    assert len(batches) == 1
+    loop.run_until_complete(sleep(0.02))
+    assert batches[-1] == [('DELETE', ()), ('REPLACE', ('4',))]
+    futs[-1].set_result(2)
+    loop.run_until_complete(sleep(0))
+    assert journal.failures == 0
+    assert journal.pending == 0
+    assert journal.flushed == 2
+    loop.close()
+
+
+def test_async_manager(tmp_path):
+    """
+    Test AsyncDataManager against a db file
+    """
+    path = tmp_path / 'db'
+    get_manager().connection.backup(connect(str(path)))
+    loop = new_event_loop()
+
+    async def run():
+        manager = await AsyncDataManager.from_path(
+            path, loop=loop, read_pool=2
+        )
+        ids = random_strs(10)
+        for id_ in ids:
+            await manager.set_prefix(id_, id_)
+            assert manager.get_prefix(id_) == id_
+        await manager.set_shame(ids[0], ids[1], 'NA', ids[2])
+        await manager.set_skip(ids[0], 5)
+        await manager.set_nsfw_tags('site', ids)
+        rows = await manager.fetch('SELECT * FROM prefix')
+        assert compact_keys(dict(rows)) == manager.prefix
+        await manager.delete_shame(ids[0], ids[1], 'NA')
+        assert not await manager.fetch('SELECT * FROM shame')
+        await manager.backup(tmp_path / 'copy')
+        manager.close()
+
+    loop.run_until_complete(run())
+    loop.close()
+    reopened = DataManager(connect(str(path)))
+    assert len(reopened.prefix) == 10
+    assert len(reopened.nsfw['site']) == 10
+    copy = DataManager(connect(str(tmp_path / 'copy')))
+    assert copy.prefix == reopened.prefix
+
+
+def test_lazy():
+    """
+    Test lazy mode in DataManager
+    """
+    eager = get_manager()
+    ids = random_strs(20)
+    for id_ in ids:
+        eager.set_prefix(id_, id_)
+        eager.set_skip(id_, 1)
+        eager.set_shame(id_, ids[0], 'NA', id_)
+    eager.set_nsfw_tags('site', ids)
+    manager = DataManager(eager.connection, lazy=True, cache_size=5)
+    assert not manager.cache_stats()['prefix']['misses']
+    for id_ in ids:
+        assert manager.get_prefix(id_) == id_
+        assert manager.get_prefix(id_) == id_
+        assert manager.get_skip(id_) == 1
+        assert manager.get_shame(id_, ids[0], 'NA') == id_
+    assert manager.get_prefix('missing') is None
+    assert manager.get_prefix('missing') is None
+    assert manager.tag_exist('site', ids[-1])
+    assert len(manager.prefix) <= 5
+    stats = manager.cache_stats()['prefix']
+    assert stats['hits'] == 21
+    assert stats['misses'] == 21
+    assert stats['evictions'] == 21 - 5
+    manager.set_prefix(ids[0], '!')
+    manager.delete_shame(ids[1], ids[0], 'ALL')
+    assert manager.get_all_prefix()[ids[0]] == '!'
+    assert ids[1] not in manager.get_all_shame()
+    fresh = DataManager(eager.connection, lazy=True)
+    loop = new_event_loop()
+    loop.run_until_complete(fresh.preload(ids[2]))
+    loop.run_until_complete(fresh.preload('missing'))
+    loop.close()
+    assert fresh.get_prefix(ids[2]) == ids[2]
+    assert fresh.get_shame(ids[2], ids[0], 'NA') == ids[2]
+    assert fresh.get_prefix('missing') is None
+    assert fresh.cache_stats()['prefix']['misses'] == 0
+
+
+def test_lazy_weight():
+    """
+    Test lazy caches are weighed again after in-place changes
+    """
+    manager = get_manager(lazy=True, cache_size=100)
+    tags = random_strs(150)
+    manager.set_nsfw_tags('a', tags[:50])
+    manager.set_nsfw_tags('a', tags[50:])
+    assert manager.match_tag('a', 'tag') is None
+    assert 'a' in manager.tag_index
+    assert manager.nsfw.weight == 150
+    manager.set_nsfw_tags('b', tags[:10])
+    assert manager.nsfw.weight == 10
+    assert 'a' not in manager.tag_index
+    assert manager.tag_exist('a', tags[-1])
+    ids = random_strs(120)
+    for id_ in ids:
+        manager.set_shame('guild', id_, 'NA', id_)
+    manager.set_shame('other', ids[0], 'NA', ids[0])
+    assert manager.shame.weight <= 100
+    assert manager.get_shame('guild', ids[-1], 'NA') == ids[-1]
+    manager.delete_shame('guild', ids[0], 'ALL')
+    assert manager.shame.weight == 119
+
+
+def test_match_tag(manager: DataManager):
+    """
+    Test fuzzy tag matching in DataManager
+    """
+    assert manager.match_tag('site', 'tag') is None
+    manager.set_nsfw_tags('site', ['long_hair', 'short_hair', 'blue_eyes'])
+    assert manager.match_tag('site', 'blue_eyes') == 'blue_eyes'
+    assert manager.match_tag('site', 'long_hiar') == 'long_hair'
+    manager.set_nsfw_tags('site', ['red_eyes'])
+    assert manager.match_tag('site', 'red_eye') == 'red_eyes'
+    assert manager.match_tag('site', 'zzzzzzzzzzzz') is None
+
+
+def test_migrations(tmp_path):
+    """
+    Test schema migrations on a db created before they existed
+    """
+    conn = connect(str(tmp_path / 'db'))
+    conn.execute(
+        'CREATE TABLE shame(guild_id VARCHAR NOT NULL, '
+        'member_id VARCHAR NOT NULL, region VARCHAR NOT NULL, '
+        'player_id VARCHAR NOT NULL)'
+    )
+    conn.execute("INSERT INTO shame VALUES ('1', '2', 'NA', '3')")
+    conn.commit()
+    assert schema_version(conn) == 0
+    manager = DataManager(conn)
+    assert manager.get_shame('1', '2', 'NA') == '3'
+    assert schema_version(conn) == MIGRATIONS[-1][0]
+    assert not migrate(conn)
+    indexes = [row[1] for row in conn.execute('PRAGMA index_list(shame)')]
+    assert indexes == ['shame_guild_member']
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    manager.set_prefix('1', '!')
+    assert DataManager(conn).get_prefix('1') == '!'
+
+
+class FakeGuild:
+    def __init__(self, id_, member_ids):
+        self.id = int(id_)
+        self.members = {int(i): f'member#{i}' for i in member_ids}
+
+    def get_member(self, id_):
+        return self.members.get(id_)
+
+
+@mark.parametrize('write_behind', [False, True])
+def test_shame_list(write_behind):
+    """
+    Test shamelist with members that left the guild
+    """
+    manager = get_manager(write_behind=write_behind)
+    ids = random_strs(1200)
+    guild_id, present = ids[0], ids[1:5]
+    for member_id in ids[1:]:
+        manager.set_shame(guild_id, member_id, 'NA', member_id)
+    manager.set_shame(guild_id, present[0], 'EU', present[0])
+    res = manager.get_shame_list(FakeGuild(guild_id, present))
+    assert res['NA'] == [f'member#{i}' for i in present]
+    assert res['EU'] == [f'member#{present[0]}']
+    assert not res['AS'] and not res['RU']
+    assert set(manager.shame[int(guild_id)]) == set(map(int, present))
+    manager.flush()
+    assert compact_shame(manager.get_all_shame()) == manager.shame
+    assert manager.get_shame_list(FakeGuild(guild_id, [])) is None
+    assert manager.get_all_shame() == {}
+    assert manager.shame == {int(guild_id): {}}
+
+
+class FailingManager(DataManager):
+    def _commit(self, ops):
+        fut = self.loop.create_future()
+        fut.set_exception(OperationalError('database is locked'))
+        return fut
+
+
+def test_shame_list_failed_delete(caplog):
+    """
+    Test a failed shamelist cleanup is logged
+    """
+    manager = get_manager()
+    manager.set_shame('1', '2', 'NA', '3')
+    failing = FailingManager(manager.connection)
+    failing.loop = new_event_loop()
+    assert failing.get_shame_list(FakeGuild('1', [])) is None
+    failing.loop.run_until_complete(sleep(0))
+    failing.loop.close()
+    assert 'database is locked' in caplog.text
+
+
+def test_snapshot(tmp_path):
+    """
+    Test snapshot export, import and backup
+    """
+    source = get_manager(write_behind=True)
+    ids = random_strs(30)
+    for id_ in ids:
+        source.set_prefix(id_, id_)
+        source.set_skip(id_, 2)
+        source.set_shame(ids[0], id_, 'RU', id_)
+    source.set_nsfw_tags('site', ids)
+    loop = new_event_loop()
+    path = tmp_path / 'snapshot.ndjson'
+    with path.open('w') as f:
+        total = loop.run_until_complete(source.export_snapshot(f, 7))
+    assert total == 30 * 4
+    for lazy in (False, True):
+        target = get_manager(lazy=lazy)
+        target.set_prefix(ids[0], '!')
+        target.get_shame(ids[0], ids[1], 'RU')
+        with path.open() as f:
+            loop.run_until_complete(target.import_snapshot(f, 11))
+        assert target.get_prefix(ids[0]) == ids[0]
+        assert target.get_shame(ids[0], ids[1], 'RU') == ids[1]
+        assert target.get_skip(ids[-1]) == 2
+        assert target.match_tag('site', ids[3]) == ids[3]
+        assert target.get_all_shame() == source.get_all_shame()
+        assert target.get_all_prefix() == source.get_all_prefix()
+    db = tmp_path / 'db'
+    loop.run_until_complete(source.backup(db))
+    assert DataManager(connect(str(db))).skip_count == source.skip_count
+    backup = tmp_path / 'backup'
+    loop.run_until_complete(DataManager(connect(str(db))).backup(backup, 1))
+    assert DataManager(connect(str(backup))).prefix == source.prefix
+    loop.close()
+
+
+@mark.parametrize('lazy', [False, True])
+def test_shared_backend(tmp_path, lazy):
+    """
+    Test two managers sharing one db file see each other's writes
+    """
+    path = str(tmp_path / 'db')
+    first = DataManager(SharedSQLiteBackend(connect(path)))
+    second = DataManager(SharedSQLiteBackend(connect(path)), lazy=lazy)
+    ids = random_strs(4)
+    loop = new_event_loop()
+    assert second.get_prefix(ids[0]) is None
+    second.set_nsfw_tags('site', ids[:1])
+    assert second.match_tag('site', 'tag') is None
+    first.set_prefix(ids[0], '!')
+    first.set_shame(ids[0], ids[1], 'NA', ids[2])
+    first.set_nsfw_tags('site', ids)
+    assert second.get_prefix(ids[0]) is None or lazy
+    assert loop.run_until_complete(second.poll_changes()) == 5
+    assert second.get_prefix(ids[0]) == '!'
+    assert second.get_shame(ids[0], ids[1], 'NA') == ids[2]
+    assert list(second.nsfw['site']) == ids
+    assert len(second.tag_index['site']) == 4
+    assert loop.run_until_complete(first.poll_changes()) == 1
+    first.delete_shame(ids[0], ids[1], 'ALL')
+    second.set_prefix(ids[0], '?')
+    loop.run_until_complete(second.poll_changes())
+    assert second.get_shame(ids[0], ids[1], 'NA') is None
+    loop.run_until_complete(first.poll_changes())
+    assert first.get_prefix(ids[0]) == '?'
+    loop.close()
+
+
+def test_snapshot_failed_import():
+    """
+    Test a failed import chunk leaves the in-memory tables alone
+    """
+    manager = get_manager()
+    snapshot = StringIO(
+        '{"table": "prefix", "row": ["1", "!"]}\n'
+        '{"table": "prefix", "row": ["2", "?", "extra"]}\n'
+    )
+    loop = new_event_loop()
+    with raises(OperationalError):
+        loop.run_until_complete(manager.import_snapshot(snapshot))
+    loop.close()
+    assert manager.get_prefix('1') is None
+    assert manager.get_all_prefix() == {}
+
+
+def test_compact_ids(manager: DataManager):
+    """
+    Test ids that don't fit in an int survive the compact form
+    """
+    manager.set_shame('01', '02', 'EU', 'abc')
+    manager.set_shame('1', '2', 'EU', '3')
+    assert manager.get_shame('01', '02', 'EU') == 'abc'
+    assert manager.get_shame('1', '2', 'EU') == '3'
+    assert manager.get_shame('1', '2', 'NA') is None
+    manager.set_shame('1', '2', 'NA', '4')
+    manager.delete_shame('1', '2', 'EU')
+    assert manager.shame[1] == {2: (4, None, None, None)}
+    manager.delete_shame('1', '2', 'NA')
+    assert manager.shame[1] == {}
+    assert manager.get_all_shame() == {'01': {'02': {'EU': 'abc'}}}
@@ -0,0 +1,678 @@
+from asyncio import gather, new_event_loop, sleep
+from json import dumps, loads
+from logging import getLogger
+from random import seed
+from time import monotonic
+
+from wowspy import Region
+
+from benchmarks.wtr_data import COEFF, random_expected, random_ship_dict, \
+    random_stats
+import world_of_warships.wows_manager as manager_module
+from world_of_warships import WowsManager
+from world_of_warships.batcher import RequestBatcher
+from world_of_warships.player import Player
+from world_of_warships.player_cache import PlayerCache
+from world_of_warships.player_store import PlayerStore
+from world_of_warships.rate_limit import RateLimitedApi, RateLimiter
+from world_of_warships.refresher import RefreshScheduler
+from world_of_warships.war_gaming import IdCache, get_player_id
+from world_of_warships.wtr import EXECUTOR_THRESHOLD, wtr_absolute, \
+    wtr_absolute_sync
+from world_of_warships.wtr_cache import ExpectedTable, load_wtr_cache, \
+    save_wtr_cache
+from world_of_warships.wtr_engine import STATS, WTRBreakdown, WTREngine
+
+
+class FakeApi:
+    """
+    A fake WowsAsync that answers after a delay and records its calls.
+    """
+
+    def __init__(self, delay=0.05, bad_ids=()):
+        self.delay = delay
+        self.bad_ids = set(bad_ids)
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call(self, name, account_id, data):
+        self.calls.append((name, account_id))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if not isinstance(account_id, list) and account_id in self.bad_ids:
+            raise ValueError(f'bad account {account_id}')
+        return {'data': data}
+
+    async def player_personal_data(self, region, account_id, **kwargs):
+        ids = account_id if isinstance(account_id, list) else [account_id]
+        return await self.__call('info', account_id, {
+            str(i): {'nickname': f'player{i}', 'hidden_profile': False,
+                     'statistics': {'pvp': {'battles': i}}}
+            for i in ids
+        })
+
+    async def player_clan_data(self, region, account_id, **kwargs):
+        ids = account_id if isinstance(account_id, list) else [account_id]
+        return await self.__call('clan', account_id, {
+            str(i): {'clan': {'name': f'clan{i % 3}'}} for i in ids
+        })
+
+    async def player_statistics_by_date(self, region, account_id, **kwargs):
+        ids = account_id if isinstance(account_id, list) else [account_id]
+        return await self.__call('recent', account_id, {
+            str(i): {'pvp': {}} for i in ids
+        })
+
+    async def players(self, region, search, **kwargs):
+        data = [] if search.lower() == 'nobody' else [{'account_id': 42}]
+        return await self.__call('players', search, data)
+
+    async def warships(self, region, **kwargs):
+        return await self.__call('warships', region, {'1': {'tier': 5}})
+
+    async def statistics_of_players_ships(self, region, account_id, **kwargs):
+        return await self.__call('ships', account_id, {
+            str(account_id): [{'ship_id': 1, 'pvp': {'battles': 1}}]
+        })
+
+
+class FakeResponse:
+    """
+    A fake aiohttp response.
+    """
+
+    def __init__(self, status, body=b'', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def read(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSessionManager:
+    """
+    A fake SessionManager that answers Warships Today requests after a
+    delay, with an ETag of the nominal rating of the region.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.urls = []
+        self.ratings = {}
+
+    def __body(self, url):
+        expected = dict.fromkeys(STATS, 1)
+        coeff = dict(COEFF, nominal_rating=self.ratings.get(url, 1000))
+        return dumps({'expected': [dict(expected, ship_id=1)],
+                      'coefficients': coeff}).encode()
+
+    async def get_json(self, url):
+        self.urls.append(url)
+        await sleep(self.delay)
+        return loads(self.__body(url))
+
+    async def get(self, url, range_, headers):
+        self.urls.append(url)
+        await sleep(self.delay)
+        etag = str(self.ratings.get(url, 1000))
+        if headers.get('If-None-Match') == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.__body(url), {'ETag': etag})
+
+
+def test_rate_limiter():
+    """
+    Test RateLimiter caps the call rate and the calls in flight
+    """
+    loop = new_event_loop()
+    api = FakeApi(delay=0.01)
+    limited = RateLimitedApi(api, RateLimiter(10, 0.5, concurrency=3))
+
+    async def run():
+        start = monotonic()
+        await gather(*[
+            limited.statistics_of_players_ships(None, i) for i in range(16)
+        ])
+        return monotonic() - start
+
+    elapsed = loop.run_until_complete(run())
+    loop.close()
+    assert len(api.calls) == 16
+    assert api.max_in_flight <= 3
+    assert 0.25 <= elapsed < 1.5
+
+
+def test_clan_players():
+    """
+    Test clan players are fetched concurrently and failures are isolated
+    """
+    loop = new_event_loop()
+    api = FakeApi(bad_ids={7})
+    manager = WowsManager(RateLimitedApi(api, RateLimiter(100)), getLogger())
+    seen = []
+
+    async def progress(done, total):
+        seen.append((done, total))
+        if done == 10:
+            raise ValueError('status message deleted')
+
+    async def run():
+        start = monotonic()
+        players = await manager.get_clan_players(
+            Region.NA, list(range(50)), progress
+        )
+        return players, monotonic() - start
+
+    players, elapsed = loop.run_until_complete(run())
+    loop.close()
+    assert [p.player_id for p in players] == [
+        str(i) for i in range(50) if i != 7
+    ]
+    assert api.max_in_flight > 10
+    assert elapsed < 50 * api.delay / 2
+    assert seen[-1] == (50, 50)
+
+
+def test_request_batcher():
+    """
+    Test concurrent player lookups are sent as batched calls
+    """
+    loop = new_event_loop()
+    api = FakeApi()
+    batcher = RequestBatcher(api, window=0.01)
+    players = [Player(Region.NA, str(i), getLogger()) for i in range(1, 251)]
+
+    async def run():
+        res = await gather(*[p.fetch(batcher) for p in players])
+        clans = await gather(*[p.fetch_clan(batcher) for p in players[:5]])
+        await batcher.player_personal_data(Region.EU, [1, 2])
+        return res, clans
+
+    res, clans = loop.run_until_complete(run())
+    loop.close()
+    assert res[41] == ({'battles': 42}, 'player42')
+    assert clans == ['clan1', 'clan2', 'clan0', 'clan1', 'clan2']
+    assert [len(ids) for name, ids in api.calls] == [100, 100, 50, 5, 2]
+    assert batcher.calls == 4
+
+
+def test_player_update():
+    """
+    Test Player.update makes two rounds of concurrent requests
+    """
+    loop = new_event_loop()
+    api = FakeApi(delay=0.1)
+    player = Player(Region.NA, '5', getLogger())
+
+    async def update():
+        start = monotonic()
+        updated = await player.update(api, {}, {}, {}, True)
+        return updated, monotonic() - start
+
+    updated, elapsed = loop.run_until_complete(update())
+    assert updated
+    assert sorted(name for name, _ in api.calls) == [
+        'clan', 'info', 'recent', 'ships'
+    ]
+    assert player.ship_stats == {1: {'battles': 1}}
+    assert 0.2 <= elapsed < 0.3
+    api.calls.clear()
+    updated, elapsed = loop.run_until_complete(update())
+    loop.close()
+    assert not updated
+    assert elapsed < 0.2
+    assert 'recent' not in [name for name, _ in api.calls]
+
+
+def test_wtr_engine():
+    """
+    Test WTREngine matches wtr_absolute, including ships with zero expected
+    values, ships without expected values and ships without battles
+    """
+    seed(0)
+    loop = new_event_loop()
+    expected = random_expected(100)
+    ship_dict = random_ship_dict(100)
+    engine = WTREngine(expected, COEFF, ship_dict)
+    for _ in range(20):
+        stats = random_stats(100, 50)
+        assert engine.wtr(stats) == loop.run_until_complete(
+            wtr_absolute(expected, COEFF, stats, ship_dict)
+        )
+    loop.close()
+    assert engine.wtr({}) == 0
+    assert engine.wtr(None) == 0
+    assert engine.wtr({1: {'battles': 0}, 500: {'battles': 3}}) == 0
+
+
+def test_wtr_awaitable():
+    """
+    Test the awaitable WTR wrappers match the synchronous versions on both
+    sides of the executor threshold
+    """
+    seed(1)
+    loop = new_event_loop()
+    ships = EXECUTOR_THRESHOLD * 2
+    expected = random_expected(ships)
+    ship_dict = random_ship_dict(ships)
+    engine = WTREngine(expected, COEFF, ship_dict)
+    small = random_stats(ships, 20)
+    large = {i: s for i, s in enumerate(random_stats(ships, ships).values())}
+    assert len(large) > EXECUTOR_THRESHOLD
+    for stats in (small, large):
+        sync = wtr_absolute_sync(expected, COEFF, stats, ship_dict)
+        assert loop.run_until_complete(
+            wtr_absolute(expected, COEFF, stats, ship_dict)
+        ) == sync
+        assert loop.run_until_complete(engine.wtr_async(stats)) == sync
+    loop.close()
+
+
+def test_wtr_breakdown():
+    """
+    Test WTRBreakdown only recalculates changed ships and matches WTREngine
+    """
+    seed(2)
+    expected = random_expected(100)
+    engine = WTREngine(expected, COEFF, random_ship_dict(100))
+    breakdown = WTRBreakdown(engine)
+    stats = random_stats(100, 60)
+    assert breakdown.update(stats) == engine.wtr(stats)
+    before = dict(breakdown.ships)
+    stats = dict(stats)
+    changed = next(iter(stats))
+    stats[changed] = dict(stats[changed], battles=stats[changed]['battles'])
+    stats[changed]['battles'] += 1
+    stats.pop(next(reversed(stats)))
+    assert breakdown.update(stats) == engine.wtr(stats)
+    assert breakdown.ships.keys() == stats.keys()
+    assert [
+        ship_id for ship_id, entry in breakdown.ships.items()
+        if entry is not before[ship_id]
+    ] == [changed]
+    assert breakdown.update({}) == 0
+    assert breakdown.ships == {}
+
+
+def test_player_cache():
+    """
+    Test PlayerCache demotes, evicts and expires players
+    """
+    cache = PlayerCache(
+        lambda region, id_: Player(region, id_, getLogger()),
+        capacity=3, hot=1, ttl=60
+    )
+    first = cache.get(Region.NA, '1')
+    first.ship_stats = {1: {'battles': 2}}
+    assert cache.get(Region.NA, '1') is first
+    cache.get(Region.NA, '2')
+    assert cache.demotions == 1
+    assert first.ship_stats == {1: {'battles': 2}}
+    cache.get(Region.NA, '3')
+    cache.get(Region.NA, '4')
+    assert len(cache) == 3
+    assert cache.evictions == 1
+    assert (Region.NA, '1') not in cache
+    assert cache.get(Region.NA, '1') is not first
+    cache.ttl = -1
+    player = cache.get(Region.NA, '1')
+    loop = new_event_loop()
+    update = loop.create_task(player.update(FakeApi(), {}, {}, {}, False))
+    loop.run_until_complete(sleep(0))
+    assert player.updating
+    assert cache.get(Region.NA, '1') is player
+    loop.run_until_complete(update)
+    loop.close()
+    assert not player.updating
+    assert cache.get(Region.NA, '1') is not player
+    stats = cache.stats
+    assert stats['hits'] == 2
+    assert stats['misses'] == 7
+    assert stats['expirations'] == 2
+    assert stats['size'] == 3
+
+
+def test_player_single_flight():
+    """
+    Test concurrent player updates share one set of requests, and an
+    update that needs ship stats does not join one without them
+    """
+    loop = new_event_loop()
+    api = FakeApi()
+    player = Player(Region.NA, '5', getLogger())
+
+    async def updates():
+        return await gather(
+            player.update(api, {}, {}, {}, False),
+            player.update(api, {}, {}, {}, False),
+            player.refresh_ship_stats(api),
+            player.refresh_ship_stats(api)
+        )
+
+    first, second, ships, same = loop.run_until_complete(updates())
+    assert first is second is True
+    assert ships == same == {1: {'battles': 1}}
+    assert sorted(name for name, _ in api.calls) == [
+        'clan', 'info', 'recent', 'ships'
+    ]
+    api.calls.clear()
+
+    async def with_ships():
+        return await gather(
+            player.update(api, {}, {}, {}, False),
+            player.update(api, {}, {}, {}, True)
+        )
+
+    assert loop.run_until_complete(with_ships()) == [False, False]
+    assert sorted(name for name, _ in api.calls) == [
+        'clan', 'clan', 'info', 'info', 'ships'
+    ]
+    assert not player.updating
+    loop.close()
+
+
+def test_player_store(tmp_path):
+    """
+    Test players are warmed from the store and refreshed in the background
+    """
+    loop = new_event_loop()
+    path = tmp_path / 'wows_cache.db'
+    api = FakeApi(delay=0.1)
+    store = loop.run_until_complete(PlayerStore.from_path(path, loop=loop))
+    manager = WowsManager(api, getLogger(), store)
+    players = loop.run_until_complete(
+        manager.get_clan_players(Region.NA, [1, 2])
+    )
+    assert store.journal.pending == 2
+    assert loop.run_until_complete(store.load(Region.NA, '1'))
+    assert store.journal.pending == 0
+    manager.close()
+    assert len(api.calls) == 2
+
+    api.calls.clear()
+    store = loop.run_until_complete(PlayerStore.from_path(path, loop=loop))
+    manager = WowsManager(api, getLogger(), store)
+
+    async def warm():
+        start = monotonic()
+        warmed = await manager.get_clan_players(Region.NA, [1, 2])
+        return warmed, monotonic() - start
+
+    warmed, elapsed = loop.run_until_complete(warm())
+    assert [p.player_id for p in warmed] == ['1', '2']
+    assert warmed[0].ship_stats == {1: {'battles': 1}}
+    assert not warmed[0].stale
+    assert elapsed < api.delay / 2
+    loop.run_until_complete(sleep(api.delay * 1.5))
+    assert sorted(api.calls) == [('ships', 1), ('ships', 2)]
+    players[0].stats = {'battles': 3}
+    players[0].wtr = 1200
+    restored = Player.restore(
+        Region.NA, '9', getLogger(), players[0].snapshot()
+    )
+    assert restored.stale
+    assert restored.stats == {'battles': 3}
+    assert restored.wtr == 1200
+    assert restored.ship_stats == {1: {'battles': 1}}
+    loop.run_until_complete(store.prune())
+    assert loop.run_until_complete(store.load(Region.NA, '1'))
+    store.max_age = -1
+    assert loop.run_until_complete(store.load(Region.NA, '1')) is None
+    manager.close()
+    loop.close()
+
+
+def test_refresh_scheduler():
+    """
+    Test RefreshScheduler refreshes the latest requests first, dedups and
+    drops the oldest jobs over its size, with a bounded amount of workers
+    """
+    loop = new_event_loop()
+    refreshed = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def refresh(region, id_):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await sleep(0.01)
+        in_flight -= 1
+        if id_ == 'bad':
+            raise ValueError(id_)
+        refreshed.append(id_)
+
+    scheduler = RefreshScheduler(refresh, getLogger(), workers=2, max_size=4)
+
+    async def run():
+        scheduler.schedule((Region.NA, i) for i in ('1', '2', '3', '4'))
+        scheduler.schedule([(Region.NA, 'bad'), (Region.NA, '3')])
+        assert len(scheduler) == 4
+        while len(scheduler) or in_flight:
+            await sleep(0.01)
+
+    loop.run_until_complete(run())
+    scheduler.close()
+    loop.close()
+    assert refreshed == ['3', '1', '2']
+    assert max_in_flight == 2
+    assert scheduler.dropped == 1
+    assert scheduler.failed == 1
+    assert scheduler.done == 3
+
+
+def test_reference_data(tmp_path, monkeypatch):
+    """
+    Test the WTR data is fetched concurrently, written to file, and loaded
+    from file on the next start while it's updated in the background
+    """
+    monkeypatch.setattr(manager_module, 'data_path', tmp_path)
+    loop = new_event_loop()
+    api = FakeApi()
+    session = FakeSessionManager()
+
+    async def start():
+        begin = monotonic()
+        manager = await WowsManager.wows_manager(session, api, getLogger())
+        return manager, monotonic() - begin
+
+    manager, elapsed = loop.run_until_complete(start())
+    assert len(session.urls) == 4 and len(api.calls) == 4
+    assert elapsed < api.delay * 2
+    assert manager.engines[Region.NA].wtr({1: {'battles': 0}}) == 0
+    assert manager.ship_dict['NA'] == {'1': 5}
+    assert (tmp_path / 'ship_dict.json').exists()
+    assert not list(tmp_path.glob('*.tmp'))
+
+    manager, elapsed = loop.run_until_complete(start())
+    assert elapsed < api.delay / 2
+    assert manager.check_data()
+    assert not manager.data_task.done()
+    loop.run_until_complete(manager.data_task)
+    assert len(session.urls) == 8
+    manager.close()
+    loop.close()
+
+
+def test_reference_data_refresh(tmp_path, monkeypatch):
+    """
+    Test unchanged WTR data is skipped and only the engines of regions
+    whose data changed are rebuilt
+    """
+    monkeypatch.setattr(manager_module, 'data_path', tmp_path)
+    loop = new_event_loop()
+    session = FakeSessionManager(delay=0)
+    manager = WowsManager(FakeApi(delay=0), getLogger())
+    assert loop.run_until_complete(manager.update_data(session))
+    engines = dict(manager.engines)
+    assert not loop.run_until_complete(manager.update_data(session))
+    assert manager.engines == engines
+    na_url = next(url for url in session.urls if '.na.' in url)
+    session.ratings[na_url] = 2000
+    assert loop.run_until_complete(manager.update_data(session))
+    assert manager.coeff(Region.NA)['nominal_rating'] == 2000
+    for region, engine in manager.engines.items():
+        assert (engine is engines[region]) == (region != Region.NA)
+    assert isinstance(manager.expected(Region.NA), ExpectedTable)
+    assert isinstance(manager.expected(Region.EU), ExpectedTable)
+    loop.close()
+
+
+def test_reference_data_restart(tmp_path, monkeypatch):
+    """
+    Test the response validators are kept over a restart, so unchanged
+    data isn't written again and the engines are kept
+    """
+    monkeypatch.setattr(manager_module, 'data_path', tmp_path)
+    loop = new_event_loop()
+    session = FakeSessionManager(delay=0)
+    api = FakeApi(delay=0)
+    manager = loop.run_until_complete(
+        WowsManager.wows_manager(session, api, getLogger())
+    )
+    manager.close()
+    written = (tmp_path / 'ship_dict.json').stat().st_mtime_ns
+    header = (tmp_path / 'wtr_cache' / 'header.json').read_text()
+
+    manager = loop.run_until_complete(
+        WowsManager.wows_manager(session, api, getLogger())
+    )
+    engines = dict(manager.engines)
+    loop.run_until_complete(manager.data_task)
+    assert manager.engines == engines
+    assert isinstance(manager.expected(Region.NA), ExpectedTable)
+    assert (tmp_path / 'ship_dict.json').stat().st_mtime_ns == written
+    assert (tmp_path / 'wtr_cache' / 'header.json').read_text() == header
+    manager.close()
+    loop.close()
+
+
+def test_wtr_cache(tmp_path):
+    """
+    Test the binary WTR data cache round trips and gives the same WTR
+    """
+    seed(3)
+    expected = random_expected(50)
+    tiers = {str(k): v for k, v in random_ship_dict(50).items()}
+    data = {'na': {'expected': expected, 'coefficients': COEFF}}
+    assert save_wtr_cache(tmp_path, data, {'NA': tiers})
+    loaded, ship_dict = load_wtr_cache(tmp_path)
+    table = loaded['na']['expected']
+    assert isinstance(table, ExpectedTable)
+    assert loaded['na']['coefficients'] == COEFF
+    assert dict(ship_dict['NA']) == tiers
+    assert list(table) == list(expected)
+    assert table['17'] == dict(expected['17'], ship_id=17)
+    assert loads(dumps(loaded, default=dict))['na']['expected']['3'] == \
+        dict(expected['3'], ship_id=3)
+    stats = random_stats(50, 30)
+    assert WTREngine(table, COEFF, ship_dict['NA']).wtr(stats) == \
+        WTREngine(expected, COEFF, tiers).wtr(stats)
+
+    files = sorted(p.name for p in tmp_path.glob('*.npy'))
+    assert save_wtr_cache(tmp_path, loaded, ship_dict)
+    assert len(list(tmp_path.glob('*.npy'))) == len(files)
+    assert files != sorted(p.name for p in tmp_path.glob('*.npy'))
+    assert not save_wtr_cache(tmp_path, data, {'NA': {'x': 1}})
+    (tmp_path / 'header.json').write_text('{}')
+    assert load_wtr_cache(tmp_path) is None
+
+
+def test_id_cache(tmp_path):
+    """
+    Test name searches are case folded, coalesced, negatively cached,
+    not cached on failure, and saved to file
+    """
+    loop = new_event_loop()
+    api = FakeApi(bad_ids={'Broken'})
+    path = tmp_path / 'ids.json'
+    cache = IdCache(path)
+
+    async def lookups(names):
+        return await gather(*[
+            get_player_id(Region.NA, api, getLogger(), name, cache)
+            for name in names
+        ])
+
+    def lookup(*names):
+        return loop.run_until_complete(lookups(names))
+
+    assert lookup('Yasen', 'yasen', 'YASEN') == [42, 42, 42]
+    assert lookup('yaSen', 'nobody', 'Nobody') == [42, None, None]
+    assert lookup('Broken') == [None]
+    assert lookup('Broken') == [None]
+    assert [name for _, name in api.calls] == [
+        'Yasen', 'nobody', 'Broken', 'Broken'
+    ]
+    assert lookup('Yasen', 'yasen') == [42, 42]
+    assert loop.run_until_complete(
+        get_player_id(Region.EU, api, getLogger(), 'yasen', cache)
+    ) == 42
+    assert len(api.calls) == 5
+    cache.save()
+    api.calls.clear()
+    cache = IdCache(path)
+    assert lookup('YASEN', 'nobody') == [42, None]
+    assert api.calls == []
+    assert cache.hits == 2
+    loop.close()
+
+
+def test_embed_cache(tmp_path, monkeypatch):
+    """
+    Test rendered embeds are served within their window and for the same
+    WTR data only, and a forced refresh skips them
+    """
+    monkeypatch.setattr(manager_module, 'data_path', tmp_path)
+    loop = new_event_loop()
+    session = FakeSessionManager(delay=0)
+    api = FakeApi(delay=0)
+    manager = WowsManager(api, getLogger())
+    loop.run_until_complete(manager.update_data(session))
+    api.calls.clear()
+
+    def shame(force=False):
+        return loop.run_until_complete(
+            manager.player_embed(Region.NA, 0, force)
+        )
+
+    embed = shame()
+    calls = len(api.calls)
+    assert calls
+    assert shame() is embed
+    assert len(api.calls) == calls
+    assert manager.embeds.hits == 1
+    shame(True)
+    assert len(api.calls) > calls
+    calls = len(api.calls)
+    embed = shame()
+    assert len(api.calls) == calls
+    assert manager.embeds.hits == 2
+
+    na_url = next(url for url in session.urls if '.na.' in url)
+    session.ratings[na_url] = 2000
+    loop.run_until_complete(manager.update_data(session))
+    api.calls.clear()
+    shame()
+    assert api.calls
+    manager.embeds.invalidate(('player', Region.NA, '0'))
+    manager.embeds.ttl = -1
+    api.calls.clear()
+    shame()
+    calls = len(api.calls)
+    shame()
+    assert calls and len(api.calls) == 2 * calls
+    assert manager.embeds.hits == 2
+    loop.close()
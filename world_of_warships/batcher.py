@@ -0,0 +1,93 @@
+from asyncio import ensure_future, get_event_loop, shield
+from functools import partial
+
+from wowspy import Region
+
+BATCHED = (
+    'player_personal_data', 'player_clan_data', 'player_statistics_by_date'
+)
+
+
+class RequestBatcher:
+    """
+    A WowsAsync proxy that coalesces concurrent single account calls.
+
+    Calls to the endpoints that take a list of account ids, made for the
+    same region and with the same parameters within a short window, are
+    sent as one call for up to max_ids accounts. Every caller gets the
+    whole response, which has the data of its account under its id as
+    usual. Every other call is passed through as is.
+    """
+    __slots__ = ('api', 'window', 'max_ids', 'calls', '__pending')
+
+    def __init__(self, api, window: float = 0.05, max_ids: int = 100):
+        """
+        :param api: the WowsAsync instance.
+        :param window: the amount of seconds to collect calls for.
+        :param max_ids: the maximum amount of account ids per call.
+        """
+        self.api = api
+        self.window = window
+        self.max_ids = max_ids
+        self.calls = 0
+        self.__pending = {}
+
+    def __getattr__(self, name):
+        if name in BATCHED:
+            return partial(self.__batched, name)
+        return getattr(self.api, name)
+
+    async def __batched(self, method: str, region: Region, account_id,
+                        **kwargs) -> dict:
+        """
+        Add an account to the pending batch of a call.
+        :param method: the WowsAsync method name.
+        :param region: the region.
+        :param account_id: the account id, a list of ids skips batching.
+        :param kwargs: the other parameters of the call.
+        :return: the response of the batched call.
+        """
+        if isinstance(account_id, list):
+            return await getattr(self.api, method)(
+                region, account_id, **kwargs
+            )
+        loop = get_event_loop()
+        key = (method, region, tuple(sorted(kwargs.items())))
+        batch = self.__pending.get(key)
+        if batch is None:
+            batch = self.__pending[key] = {}
+            loop.call_later(self.window, self.__flush, key, batch)
+        fut = batch.get(int(account_id))
+        if fut is None:
+            fut = batch[int(account_id)] = loop.create_future()
+        if len(batch) >= self.max_ids:
+            self.__flush(key, batch)
+        return await shield(fut)
+
+    def __flush(self, key: tuple, batch: dict):
+        """
+        Send a pending batch, unless it was already sent.
+        """
+        if self.__pending.get(key) is not batch:
+            return
+        del self.__pending[key]
+        ensure_future(self.__run(key, batch))
+
+    async def __run(self, key: tuple, batch: dict):
+        """
+        Make a batched call and hand the response to every caller.
+        """
+        method, region, kwargs = key
+        self.calls += 1
+        try:
+            resp = await getattr(self.api, method)(
+                region, list(batch), **dict(kwargs)
+            )
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_result(resp)
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Hashable, Optional
+
+from discord import Embed
+
+
+class EmbedCache:
+    """
+    A cache of rendered embeds.
+
+    An embed is served for ttl seconds after it's rendered, as long as it
+    was rendered from the same version of the data, e.g. the WTREngine of
+    its region. The least recently used embeds are dropped over capacity.
+    """
+    __slots__ = ('ttl', 'capacity', 'hits', 'misses', '__entries')
+
+    def __init__(self, ttl: float = 300, capacity: int = 1000):
+        """
+        :param ttl: the amount of seconds an embed is served for.
+        :param capacity: the maximum amount of embeds kept.
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+
+    def get(self, key: Hashable, version) -> Optional[Embed]:
+        """
+        Get a fresh embed.
+        :param key: the key, e.g. (kind, region, id).
+        :param version: the version of the data the embed must be rendered
+        from, compared by identity.
+        :return: the embed, None if there is no fresh embed.
+        """
+        entry = self.__entries.get(key)
+        if entry is not None:
+            embed, embed_version, expires_at = entry
+            if embed_version is version and expires_at > monotonic():
+                self.hits += 1
+                self.__entries.move_to_end(key)
+                return embed
+            del self.__entries[key]
+        self.misses += 1
+
+    def put(self, key: Hashable, version, embed: Embed):
+        """
+        Cache an embed.
+        :param key: the key.
+        :param version: the version of the data the embed was rendered from.
+        :param embed: the embed.
+        """
+        self.__entries[key] = (embed, version, monotonic() + self.ttl)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.capacity:
+            self.__entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """
+        Drop an embed.
+        :param key: the key.
+        """
+        self.__entries.pop(key, None)
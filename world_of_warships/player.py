@@ -1,4 +1,8 @@
+from asyncio import Future, ensure_future, gather, shield, wait
+from json import dumps, loads
+from time import time
 from typing import Optional
+from zlib import compress, decompress
 
 from discord import Embed
 from wowspy import Region, WowsAsync
@@ -6,12 +10,32 @@ from wowspy import Region, WowsAsync
 from scripts.helpers import get_date
 from world_of_warships.embed_builder import get_shame_embed
 from world_of_warships.wtr import CONVERT_REGION, choose_colour, wtr_absolute
+from world_of_warships.wtr_engine import WTRBreakdown, WTREngine
+
+
+def pack_ship_stats(ship_stats: dict) -> bytes:
+    """
+    Pack ship stats into compressed JSON, keeping the int ship ids.
+    :param ship_stats: the ship stats.
+    :return: the packed ship stats.
+    """
+    return compress(dumps(list(ship_stats.items())).encode())
+
+
+def unpack_ship_stats(packed: bytes) -> dict:
+    """
+    Unpack ship stats packed by pack_ship_stats.
+    :param packed: the packed ship stats.
+    :return: the ship stats.
+    """
+    return {ship_id: stats for ship_id, stats in loads(decompress(packed))}
 
 
 class Player:
     __slots__ = ('region', 'player_id', 'stats', 'recent_stats',
-                 'recent_date', 'ship_stats', 'logger', 'nick', 'hidden',
-                 'wtr', 'clan', 'updating', '__embed')
+                 'recent_date', 'logger', 'nick', 'hidden', 'wtr', 'clan',
+                 'fetched_at', 'stale', '__embed', '__breakdown',
+                 '__ship_stats', '__packed', '__update', '__ships_fetch')
 
     def __init__(self, region: Region, id_: str, logger, ship_stats=None):
         """
@@ -25,14 +49,96 @@ class Player:
         self.stats = {}
         self.recent_stats = {}
         self.recent_date = None
-        self.ship_stats = ship_stats
+        self.__ship_stats = ship_stats
+        self.__packed = None
+        self.__update = None
+        self.__ships_fetch = None
         self.logger = logger
         self.nick = None
         self.hidden = False
         self.wtr = None
         self.clan = None
-        self.updating = False
+        self.fetched_at = None
+        self.stale = False
         self.__embed = None
+        self.__breakdown = None
+
+    @property
+    def updating(self) -> bool:
+        """
+        :return: True if an update of the player is in flight.
+        """
+        return self.__update is not None
+
+    @property
+    def ship_stats(self) -> Optional[dict]:
+        """
+        :return: player ship stats, unpacked first if the player was
+        demoted.
+        """
+        if self.__packed is not None:
+            self.__ship_stats = unpack_ship_stats(self.__packed)
+            self.__packed = None
+        return self.__ship_stats
+
+    @ship_stats.setter
+    def ship_stats(self, ship_stats: Optional[dict]):
+        self.__ship_stats = ship_stats
+        self.__packed = None
+
+    def demote(self):
+        """
+        Shrink the player when it's no longer frequently used.
+        The ship stats are packed into compressed JSON until they are next
+        accessed and the embed and WTR breakdown are dropped.
+        """
+        if self.__ship_stats:
+            self.__packed = pack_ship_stats(self.__ship_stats)
+            self.__ship_stats = None
+        self.__embed = None
+        self.__breakdown = None
+
+    def snapshot(self) -> dict:
+        """
+        Get the state of the player worth keeping across restarts.
+        :return: a dict of the player fields, with the ship stats packed,
+        see pack_ship_stats.
+        """
+        packed = self.__packed
+        if packed is None and self.__ship_stats:
+            packed = pack_ship_stats(self.__ship_stats)
+        return {
+            'nick': self.nick, 'clan': self.clan, 'hidden': self.hidden,
+            'wtr': self.wtr, 'stats': self.stats,
+            'recent_stats': self.recent_stats,
+            'recent_date': self.recent_date, 'ship_stats': packed,
+            'fetched_at': self.fetched_at
+        }
+
+    @classmethod
+    def restore(cls, region: Region, id_: str, logger,
+                snapshot: dict) -> 'Player':
+        """
+        Create a player from a snapshot. The player is marked as stale until
+        it's revalidated.
+        :param region: the player region.
+        :param id_: the player id.
+        :param logger: the logger.
+        :param snapshot: the snapshot, see snapshot.
+        :return: the player.
+        """
+        player = cls(region, id_, logger)
+        player.nick = snapshot['nick']
+        player.clan = snapshot['clan']
+        player.hidden = snapshot['hidden']
+        player.wtr = snapshot['wtr']
+        player.stats = snapshot['stats']
+        player.recent_stats = snapshot['recent_stats']
+        player.recent_date = snapshot['recent_date']
+        player.fetched_at = snapshot['fetched_at']
+        player.__packed = snapshot['ship_stats']
+        player.stale = True
+        return player
 
     @property
     def region_today(self) -> str:
@@ -57,22 +163,32 @@ class Player:
         return (f'https://{self.region_today}.warships.today/'
                 f'player/{self.player_id}/{self.nick}')
 
-    async def get_embed(self, wows_api: WowsAsync,
-                        expected, coeff, ship_dict) -> Optional[Embed]:
+    async def get_embed(self, wows_api: WowsAsync, expected, coeff,
+                        ship_dict, engine: Optional[WTREngine] = None
+                        ) -> Optional[Embed]:
         """
         Get player stats embed.
         :param wows_api: the WowsAsync instance.
         :param expected: the expected server average.
         :param coeff: the coefficents used in WTR calculation.
         :param ship_dict: a dict of {ship_id: tier}
+        :param engine: the WTREngine of the region, optional.
         :return: player stats embed if any.
         """
         if self.hidden:
             return
-        updated = await self.update(wows_api, expected, coeff, ship_dict, True)
-        self.updating = False
+        updated = await self.update(
+            wows_api, expected, coeff, ship_dict, True, engine
+        )
         if not updated and self.__embed is not None:
             return self.__embed
+        return self.build_embed()
+
+    def build_embed(self) -> Optional[Embed]:
+        """
+        Build the player stats embed from the current stats.
+        :return: player stats embed if any.
+        """
         if self.hidden:
             return
         colour = choose_colour(self.wtr)
@@ -203,43 +319,140 @@ class Player:
         except (KeyError, TypeError):
             return
 
-    async def update(self, wows_api: WowsAsync,
-                     expected, coeff, ship_dict, update_ships: bool) -> bool:
+    async def __fetch_recent(self, wows_api: WowsAsync) -> tuple:
+        """
+        fetch_recent that logs errors instead of raising them.
+        """
+        try:
+            return await self.fetch_recent(wows_api)
+        except Exception as e:
+            self.logger.warn(str(e))
+            return None, None
+
+    def __update_wtr(self, engine: WTREngine) -> int:
+        """
+        Update the WTR breakdown of the player, starting a new one if the
+        engine was rebuilt with new expected values or coefficients.
+        :param engine: the WTREngine of the region.
+        :return: the WTR of the player.
+        """
+        if self.__breakdown is None or self.__breakdown.engine is not engine:
+            self.__breakdown = WTRBreakdown(engine)
+        return self.__breakdown.update(self.ship_stats)
+
+    @staticmethod
+    async def __none():
+        return None
+
+    async def update(self, wows_api: WowsAsync, expected, coeff, ship_dict,
+                     update_ships: bool,
+                     engine: Optional[WTREngine] = None) -> bool:
         """
         Update the player stats.
+        Concurrent calls share the update in flight, a call that needs the
+        ship stats waits for an update in flight without them to finish
+        and starts its own.
+        See __do_update for parameters.
+        :return: True if updated.
+        """
+        while self.__update is not None:
+            task, with_ships = self.__update
+            if with_ships or not update_ships:
+                return await shield(task)
+            await wait((task,))
+        task = ensure_future(self.__do_update(
+            wows_api, expected, coeff, ship_dict, update_ships, engine
+        ))
+        self.__update = (task, update_ships)
+        task.add_done_callback(self.__updated)
+        return await shield(task)
+
+    def __updated(self, task: Future):
+        """
+        Clear a finished update, the callers that awaited it got its
+        result or exception.
+        """
+        if self.__update is not None and self.__update[0] is task:
+            self.__update = None
+        if not task.cancelled():
+            task.exception()
+
+    async def refresh_ship_stats(self, wows_api: WowsAsync) -> Optional[dict]:
+        """
+        Fetch and store the ship stats, sharing a fetch already in flight.
+        :param wows_api: the WowsAsync instance.
+        :return: the player ship stats.
+        """
+        if self.__ships_fetch is None:
+            self.__ships_fetch = ensure_future(self.__fetch_ships(wows_api))
+        return await shield(self.__ships_fetch)
+
+    async def __fetch_ships(self, wows_api: WowsAsync) -> Optional[dict]:
+        """
+        The fetch shared by refresh_ship_stats.
+        """
+        try:
+            self.ship_stats = await self.fetch_ship_stats(wows_api)
+            if self.ship_stats:
+                self.fetched_at = time()
+            return self.ship_stats
+        finally:
+            self.__ships_fetch = None
+
+    async def __do_update(self, wows_api: WowsAsync, expected, coeff,
+                          ship_dict, update_ships: bool,
+                          engine: Optional[WTREngine]) -> bool:
+        """
+        Update the player stats.
+        The all time stats, clan and ship stats are requested at once, the
+        recent stats need the new all time stats so they follow. If the
+        battle count hasn't changed, the ship stats request is cancelled.
         :param wows_api: the WowsAsync instance.
         :param expected: the expected server average.
         :param coeff: the coefficents used in WTR calculation.
         :param ship_dict: a dict of {ship_id: tier}
         :param update_ships: True to update player ship stats.
+        :param engine: the WTREngine of the region, used for the WTR instead
+        of expected, coeff and ship_dict if provided. Only the ships whose
+        battle count changed since the last update are recalculated.
         :return: True if updated.
         """
-        self.updating = True
-        all_time, nick = await self.fetch(wows_api)
-        clan = await self.fetch_clan(wows_api)
+        ships = ensure_future(
+            self.fetch_ship_stats(wows_api)
+        ) if update_ships else None
+        try:
+            (all_time, nick), clan = await gather(
+                self.fetch(wows_api), self.fetch_clan(wows_api)
+            )
+        except BaseException:
+            if ships:
+                ships.cancel()
+            raise
         name_change = self.nick != nick or self.clan != clan
         self.nick = nick
         self.clan = clan
-        if self.stats and \
-                (all_time.get('battles') == self.stats.get('battles')):
-            return name_change
-        if not all_time:
-            return False
+        unchanged = self.stats and all_time and \
+            all_time.get('battles') == self.stats.get('battles')
+        if unchanged or not all_time:
+            if ships:
+                ships.cancel()
+            return name_change if unchanged else False
         self.stats = all_time
-        try:
-            recent_stats, recent_date = await self.fetch_recent(wows_api)
-        except Exception as e:
-            self.logger.warn(str(e))
-            recent_stats, recent_date = None, None
+        (recent_stats, recent_date), ship_stats = await gather(
+            self.__fetch_recent(wows_api), ships or self.__none()
+        )
         if recent_stats:
             self.recent_stats = recent_stats
         if recent_date:
             self.recent_date = recent_date
-        if update_ships:
-            ship_stats = await self.fetch_ship_stats(wows_api)
-            if ship_stats:
-                self.ship_stats = ship_stats
-        self.wtr = await wtr_absolute(
-            expected, coeff, self.ship_stats, ship_dict
-        )
+        if ship_stats:
+            self.ship_stats = ship_stats
+        if engine is not None:
+            self.wtr = self.__update_wtr(engine)
+        else:
+            self.wtr = await wtr_absolute(
+                expected, coeff, self.ship_stats, ship_dict
+            )
+        self.fetched_at = time()
+        self.stale = False
         return True
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Optional, Tuple
+
+from wowspy import Region
+
+from world_of_warships.player import Player
+
+PlayerKey = Tuple[Region, str]
+
+
+class PlayerCache:
+    """
+    A bounded cache of Players.
+
+    The most recently used players are kept as they are. Once there are
+    more than hot of them, the least recently used are demoted, see
+    Player.demote, and once there are more than capacity players in total
+    the least recently used demoted players are evicted. Players older than
+    ttl seconds are replaced by new ones on their next lookup, unless they
+    are being updated.
+    """
+    __slots__ = ('loader', 'capacity', 'hot', 'ttl', 'hits', 'misses',
+                 'evictions', 'expirations', 'demotions', '__hot', '__cold')
+
+    def __init__(self, loader: Callable[..., Player],
+                 capacity: int = 5000, hot: int = 1000,
+                 ttl: float = 6 * 60 * 60):
+        """
+        :param loader: a callable that creates the Player for a region and
+        player id, and the extra arguments given to get.
+        :param capacity: the maximum amount of players kept.
+        :param hot: the maximum amount of players kept undemoted.
+        :param ttl: the amount of seconds a player is kept for.
+        """
+        self.loader = loader
+        self.capacity = capacity
+        self.hot = min(hot, capacity)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.demotions = 0
+        self.__hot = OrderedDict()
+        self.__cold = OrderedDict()
+
+    def __len__(self):
+        return len(self.__hot) + len(self.__cold)
+
+    def __contains__(self, key: PlayerKey):
+        return key in self.__hot or key in self.__cold
+
+    def __live(self, entry: Optional[tuple]) -> bool:
+        """
+        :return: True if the entry can be served.
+        """
+        if entry is None:
+            return False
+        player, created_at = entry
+        return player.updating or monotonic() - created_at <= self.ttl
+
+    def is_cached(self, region: Region, id_: str) -> bool:
+        """
+        Check if get would return a cached player, without counting a
+        lookup.
+        :param region: the player region.
+        :param id_: the player id.
+        :return: True if the player is cached and not expired.
+        """
+        key = (region, id_)
+        return self.__live(self.__hot.get(key) or self.__cold.get(key))
+
+    def get(self, region: Region, id_: str, *args) -> Player:
+        """
+        Get a player, creating it if it's not cached or expired.
+        :param region: the player region.
+        :param id_: the player id.
+        :param args: extra arguments for the loader, if it's called.
+        :return: the player.
+        """
+        key = (region, id_)
+        entry = self.__hot.pop(key, None) or self.__cold.pop(key, None)
+        if entry is not None:
+            if self.__live(entry):
+                self.hits += 1
+                self.__store(key, entry)
+                return entry[0]
+            self.expirations += 1
+        self.misses += 1
+        entry = (self.loader(region, id_, *args), monotonic())
+        self.__store(key, entry)
+        return entry[0]
+
+    def __store(self, key: PlayerKey, entry: tuple):
+        """
+        Store an entry as the most recently used, demoting and evicting the
+        least recently used entries over the limits.
+        """
+        self.__hot[key] = entry
+        while len(self.__hot) > self.hot:
+            old_key, old = self.__hot.popitem(last=False)
+            old[0].demote()
+            self.demotions += 1
+            self.__cold[old_key] = old
+        while len(self) > self.capacity and self.__cold:
+            self.__cold.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: PlayerKey = None):
+        """
+        Drop cached players so they are created again on next lookup.
+        :param key: the (region, player id) to drop, None to drop every
+        player.
+        """
+        if key is None:
+            self.__hot.clear()
+            self.__cold.clear()
+        else:
+            self.__hot.pop(key, None)
+            self.__cold.pop(key, None)
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        :return: the ratio of lookups served from the cache.
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: the cache counters, for tuning, in the format of
+        DataManager.cache_stats.
+        """
+        return {
+            'size': len(self), 'hot': len(self.__hot),
+            'hits': self.hits, 'misses': self.misses,
+            'hit_ratio': self.hit_ratio, 'evictions': self.evictions,
+            'expirations': self.expirations, 'demotions': self.demotions
+        }
@@ -0,0 +1,162 @@
+from asyncio import AbstractEventLoop, get_event_loop, wrap_future
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from pathlib import Path
+from sqlite3 import Connection, connect
+from time import time
+from typing import List, Optional, Tuple, Union
+
+from wowspy import Region
+
+from data_manager.migrations import configure
+from data_manager.write_journal import WriteJournal
+
+SAVE_SQL = 'REPLACE INTO player VALUES (?, ?, ?, ?, ?, ?)'
+
+
+class PlayerStore:
+    """
+    An SQLite cache of player snapshots, see Player.snapshot, so players
+    looked up before a restart can be answered from disk right away.
+
+    All SQL runs on a dedicated writer thread, off the event loop. Saves
+    are batched through a WriteJournal and committed in one transaction.
+    """
+    __slots__ = ('connection', 'max_age', 'loop', 'writer', 'journal')
+
+    def __init__(self, connection: Connection, writer: ThreadPoolExecutor,
+                 loop: AbstractEventLoop, max_age: float = 7 * 86400,
+                 flush_interval: int = 1000, flush_ops: int = 64):
+        """
+        Initialize the instance of PlayerStore on the writer thread.
+        Use PlayerStore.from_path instead of this.
+        :param connection: the SQLite3 Connection owned by the writer thread.
+        :param writer: the single thread executor for the connection.
+        :param loop: the event loop.
+        :param max_age: the amount of seconds a snapshot is kept for.
+        :param flush_interval: the maximum time in ms a save stays pending.
+        :param flush_ops: the amount of pending saves that triggers a flush.
+        """
+        self.connection = connection
+        self.max_age = max_age
+        self.loop = loop
+        self.writer = writer
+        self.journal = WriteJournal(
+            self.__commit, loop, flush_interval, flush_ops
+        )
+        configure(self.connection, 64 * 1024 * 1024)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS player('
+            'region VARCHAR NOT NULL,'
+            'player_id VARCHAR NOT NULL,'
+            'fetched_at REAL NOT NULL,'
+            'battles INTEGER,'
+            'snapshot VARCHAR NOT NULL,'
+            'ship_stats BLOB,'
+            'PRIMARY KEY (region, player_id)'
+            ')'
+        )
+        self.__prune()
+
+    @classmethod
+    async def from_path(cls, path: Union[Path, str], *,
+                        loop: Optional[AbstractEventLoop] = None, **kwargs):
+        """
+        Get an instance of PlayerStore. Use this instead of __init__
+        :param path: the path to the db file.
+        :param loop: the event loop.
+        :param kwargs: the keyword arguments for PlayerStore.
+        :return: a new instance of PlayerStore
+        """
+        loop = loop or get_event_loop()
+        writer = ThreadPoolExecutor(1)
+        path = str(path)
+
+        def init():
+            conn = connect(path, check_same_thread=False)
+            return cls(conn, writer, loop, **kwargs)
+
+        return await loop.run_in_executor(writer, init)
+
+    async def load(self, region: Region, id_: str) -> Optional[dict]:
+        """
+        Load the snapshot of a player.
+        A pending save of the player is flushed first, so the snapshot is
+        never older than the last save.
+        :param region: the player region.
+        :param id_: the player id.
+        :return: the snapshot if any and not expired.
+        """
+        if (region.name, id_) in self.journal:
+            self.journal.flush()
+        return await self.loop.run_in_executor(
+            self.writer, self.__load, region.name, id_
+        )
+
+    def __load(self, region: str, id_: str) -> Optional[dict]:
+        """
+        Load the snapshot of a player on the writer thread.
+        """
+        row = self.connection.execute(
+            'SELECT fetched_at, snapshot, ship_stats FROM player '
+            'WHERE region=? AND player_id=? AND fetched_at>?',
+            (region, id_, time() - self.max_age)
+        ).fetchone()
+        if not row:
+            return
+        fetched_at, snapshot, ship_stats = row
+        res = loads(snapshot)
+        res['fetched_at'] = fetched_at
+        res['ship_stats'] = ship_stats
+        return res
+
+    def save(self, region: Region, id_: str, snapshot: dict):
+        """
+        Queue the snapshot of a player to be saved, a later save of the
+        same player replaces it.
+        :param region: the player region.
+        :param id_: the player id.
+        :param snapshot: the snapshot, see Player.snapshot.
+        """
+        snapshot = dict(snapshot)
+        fetched_at = snapshot.pop('fetched_at') or time()
+        ship_stats = snapshot.pop('ship_stats')
+        battles = (snapshot['stats'] or {}).get('battles')
+        self.journal.add((region.name, id_), SAVE_SQL, (
+            region.name, id_, fetched_at, battles, dumps(snapshot), ship_stats
+        ))
+
+    def __commit(self, ops: List[Tuple[str, tuple]]):
+        """
+        Commit a batch of saves on the writer thread.
+        :return: a Future of the commit.
+        """
+        return wrap_future(
+            self.writer.submit(self.__commit_sync, ops), loop=self.loop
+        )
+
+    def __commit_sync(self, ops: List[Tuple[str, tuple]]):
+        with self.connection:
+            self.connection.executemany(SAVE_SQL, [p for _, p in ops])
+
+    async def prune(self):
+        """
+        Delete the expired snapshots.
+        """
+        await self.loop.run_in_executor(self.writer, self.__prune)
+
+    def __prune(self):
+        self.connection.execute(
+            'DELETE FROM player WHERE fetched_at<=?',
+            (time() - self.max_age,)
+        )
+        self.connection.commit()
+
+    def close(self):
+        """
+        Flush the pending saves, wait for them to finish and close the
+        connection.
+        """
+        self.journal.flush()
+        self.writer.submit(self.connection.close)
+        self.writer.shutdown(wait=True)
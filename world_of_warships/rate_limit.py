@@ -0,0 +1,93 @@
+from asyncio import Lock, Semaphore, sleep
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import monotonic
+from typing import Optional
+
+from wowspy import WowsAsync
+
+
+class RateLimiter:
+    """
+    An async token bucket that also caps the amount of calls in flight.
+
+    Use it as an async context manager around every call that counts
+    toward the limit.
+    """
+    __slots__ = ('rate', 'per', 'semaphore', '__tokens', '__last', '__lock')
+
+    def __init__(self, rate: int, per: float = 1,
+                 concurrency: Optional[int] = None):
+        """
+        :param rate: the amount of calls allowed per period.
+        :param per: the length of the period in seconds.
+        :param concurrency: the maximum amount of calls in flight,
+        defaults to rate.
+        """
+        self.rate = rate
+        self.per = per
+        self.semaphore = Semaphore(concurrency or rate)
+        self.__tokens = rate
+        self.__last = monotonic()
+        self.__lock = Lock()
+
+    async def acquire(self):
+        """
+        Wait until a call is allowed.
+        """
+        await self.semaphore.acquire()
+        try:
+            async with self.__lock:
+                while True:
+                    now = monotonic()
+                    refill = (now - self.__last) * self.rate / self.per
+                    self.__tokens = min(self.rate, self.__tokens + refill)
+                    self.__last = now
+                    if self.__tokens >= 1:
+                        self.__tokens -= 1
+                        return
+                    await sleep((1 - self.__tokens) * self.per / self.rate)
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self):
+        """
+        Mark a call allowed by acquire as done.
+        """
+        self.semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class RateLimitedApi:
+    """
+    A WowsAsync proxy that runs every API call under a RateLimiter, so all
+    users of the proxy share the Wargaming per-application rate limit.
+    """
+    __slots__ = ('api', 'limiter')
+
+    def __init__(self, api: WowsAsync, limiter: RateLimiter):
+        """
+        :param api: the WowsAsync instance.
+        :param limiter: the RateLimiter.
+        """
+        self.api = api
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not iscoroutinefunction(attr):
+            return attr
+
+        @wraps(attr)
+        async def call(*args, **kwargs):
+            async with self.limiter:
+                return await attr(*args, **kwargs)
+
+        return call
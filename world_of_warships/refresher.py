@@ -0,0 +1,92 @@
+from asyncio import CancelledError, Event, ensure_future
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Tuple
+
+from wowspy import Region
+
+RefreshJob = Tuple[Region, str]
+
+
+class RefreshScheduler:
+    """
+    Refresh players in the background with a small pool of workers.
+
+    The queue is bounded and deduplicated by (region, player id). The most
+    recently requested players are refreshed first, a player requested
+    again moves back to the front, and the least recently requested jobs
+    are dropped once the queue is full. The workers make their API calls
+    through the shared rate limited api, so they wait their turn like any
+    other call, and there are only a few of them so commands still get
+    most of the rate limit.
+    """
+    __slots__ = ('refresh', 'workers', 'max_size', 'logger', 'done',
+                 'failed', 'dropped', '__queued', '__ready', '__tasks')
+
+    def __init__(self, refresh: Callable[[Region, str], Awaitable], logger,
+                 workers: int = 3, max_size: int = 500):
+        """
+        :param refresh: a coroutine function that refreshes a player by
+        region and player id.
+        :param logger: the logger.
+        :param workers: the amount of workers.
+        :param max_size: the maximum amount of queued jobs.
+        """
+        self.refresh = refresh
+        self.workers = workers
+        self.max_size = max_size
+        self.logger = logger
+        self.done = 0
+        self.failed = 0
+        self.dropped = 0
+        self.__queued = OrderedDict()
+        self.__ready = Event()
+        self.__tasks = []
+
+    def __len__(self):
+        return len(self.__queued)
+
+    def schedule(self, jobs: Iterable[RefreshJob]):
+        """
+        Queue players to be refreshed, ahead of every job already queued.
+        :param jobs: an iterable of (region, player id), the first job is
+        refreshed first.
+        """
+        for job in reversed(list(jobs)):
+            self.__queued[job] = None
+            self.__queued.move_to_end(job)
+        while len(self.__queued) > self.max_size:
+            self.__queued.popitem(last=False)
+            self.dropped += 1
+        if not self.__tasks:
+            self.__tasks = [
+                ensure_future(self.__work()) for _ in range(self.workers)
+            ]
+        self.__ready.set()
+
+    async def __work(self):
+        """
+        Refresh queued players until cancelled.
+        """
+        while True:
+            while not self.__queued:
+                self.__ready.clear()
+                await self.__ready.wait()
+            (region, id_), _ = self.__queued.popitem()
+            try:
+                await self.refresh(region, id_)
+            except CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                self.logger.warn(f'Failed to refresh player {id_}: {e}')
+            else:
+                self.done += 1
+
+    def close(self):
+        """
+        Stop the workers, dropping the queued jobs.
+        """
+        for task in self.__tasks:
+            task.cancel()
+        self.__tasks = []
+        self.__queued.clear()
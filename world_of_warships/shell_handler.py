@@ -17,6 +17,15 @@ class ConvertRegion(Converter):
             raise BadArgument('Please enter a region in `NA, EU, RU, AS`')
 
 
+class ConvertRefresh(Converter):
+    __slots__ = ()
+
+    async def convert(self, ctx, argument) -> bool:
+        if str(argument).lower() in ('refresh', 'force'):
+            return True
+        raise BadArgument('Please enter `refresh` to skip cached stats.')
+
+
 async def get_player_id(ctx: Context, name, region: Region):
     if not name:
         raise BadArgument('Please enter a player name.')
@@ -26,7 +35,9 @@ async def get_player_id(ctx: Context, name, region: Region):
     data_manager = bot.data_manager
     members, _ = leading_members(ctx, name)
     if not members:
-        id_ = await gpid(region, wows_api, logger, name)
+        id_ = await gpid(
+            region, wows_api, logger, name, bot.wows_manager.ids
+        )
         if id_ is not None:
             return id_
         raise BadArgument(f'Player **{name}** not found!')
@@ -50,7 +61,7 @@ async def get_clan_id(ctx: Context, name, region: Region):
     bot = ctx.bot
     wows_api = bot.wows_api
     logger = bot.logger
-    id_ = await gcid(region, wows_api, logger, name)
+    id_ = await gcid(region, wows_api, logger, name, bot.wows_manager.ids)
     if id_ is not None:
         return id_
     raise BadArgument(f'Clan **{name}** not found!')
@@ -1,43 +1,164 @@
-from typing import Optional
+from asyncio import ensure_future, shield
+from collections import OrderedDict
+from json import dumps, loads
+from pathlib import Path
+from time import time
+from typing import Awaitable, Callable, Optional
 
 from wowspy import Region, WowsAsync
 
+from scripts.helpers import write_atomic
 
-async def __get_id(coro, logger, key):
+
+class IdCache:
+    """
+    A cache of name searches to ids, by kind of search and region.
+
+    Names are case folded, found ids are kept for ttl seconds and names
+    that weren't found for negative_ttl seconds. Concurrent lookups of the
+    same name share one search. Failed searches are not cached.
+    """
+    __slots__ = ('path', 'ttl', 'negative_ttl', 'capacity', 'hits',
+                 'misses', '__entries', '__pending')
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = 86400,
+                 negative_ttl: float = 600, capacity: int = 10000):
+        """
+        :param path: the json file the cache is saved to, optional.
+        :param ttl: the amount of seconds a found id is kept for.
+        :param negative_ttl: the amount of seconds a name that wasn't found
+        is kept for.
+        :param capacity: the maximum amount of names kept.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__pending = {}
+        if path and path.is_file():
+            self.__load()
+
+    def __load(self):
+        now = time()
+        try:
+            entries = loads(self.path.read_text())
+        except ValueError:
+            return
+        for kind, region, name, id_, expires_at in entries:
+            if expires_at > now:
+                self.__entries[(kind, region, name)] = (id_, expires_at)
+
+    def save(self):
+        """
+        Save the cache to its file, if it has one.
+        """
+        if not self.path:
+            return
+        now = time()
+        entries = [
+            list(key) + list(val) for key, val in self.__entries.items()
+            if val[1] > now
+        ]
+        write_atomic(self.path, dumps(entries))
+
+    async def get(self, kind: str, region: Region, name: str,
+                  search: Callable[[], Awaitable[Optional[int]]]
+                  ) -> Optional[int]:
+        """
+        Get the id of a name.
+        :param kind: the kind of search, e.g. player or clan.
+        :param region: the region.
+        :param name: the name.
+        :param search: a coroutine function that searches the name, it
+        returns None if the name is not found.
+        :return: the id, None if the name is not found.
+        """
+        key = (kind, region.name, name.casefold())
+        entry = self.__entries.get(key)
+        if entry is not None and entry[1] > time():
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return entry[0]
+        self.misses += 1
+        fut = self.__pending.get(key)
+        if fut is None:
+            fut = self.__pending[key] = ensure_future(self.__search(
+                key, search
+            ))
+        return await shield(fut)
+
+    async def __search(self, key: tuple, search) -> Optional[int]:
+        """
+        Run a search and cache its result.
+        """
+        try:
+            id_ = await search()
+        finally:
+            del self.__pending[key]
+        ttl = self.negative_ttl if id_ is None else self.ttl
+        self.__entries[key] = (id_, time() + ttl)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.capacity:
+            self.__entries.popitem(last=False)
+        return id_
+
+
+async def __search_id(coro, key) -> Optional[int]:
+    resp = await coro
+    data = resp.get('data', None)
+    if not data:
+        return
+    return data[0].get(key, None)
+
+
+async def __get_id(search, logger, kind: str, region: Region, name,
+                   cache: Optional[IdCache]) -> Optional[int]:
     try:
-        resp = await coro
+        if cache is None:
+            return await search()
+        return await cache.get(kind, region, str(name), search)
     except Exception as e:
         logger.warn(str(e))
-    else:
-        data = resp.get('data', None)
-        if not data:
-            return
-        return data[0].get(key, None)
 
 
 async def get_player_id(region: Region, wows_api: WowsAsync,
-                        logger, search) -> Optional[int]:
+                        logger, search,
+                        cache: Optional[IdCache] = None) -> Optional[int]:
     """
     Get player id by search term.
     :param region: the region.
     :param wows_api: the WowsAsync instance.
     :param logger: the logger.
     :param search: the search query.
+    :param cache: the IdCache, optional.
     :return: the player id.
     """
-    coro = wows_api.players(region, search, language='en', limit=1)
-    return await __get_id(coro, logger, 'account_id')
+    return await __get_id(
+        lambda: __search_id(
+            wows_api.players(region, search, language='en', limit=1),
+            'account_id'
+        ), logger, 'player', region, search, cache
+    )
 
 
 async def get_clan_id(region: Region, wows_api: WowsAsync,
-                      logger, search) -> Optional[int]:
+                      logger, search,
+                      cache: Optional[IdCache] = None) -> Optional[int]:
     """
     Get clan id by search term.
     :param region: the region.
     :param wows_api: the WowsAsync instance.
     :param logger: the logger.
     :param search: the search query.
+    :param cache: the IdCache, optional.
     :return: the clan id.
     """
-    coro = wows_api.clans(region, search=search, language='en', limit=1)
-    return await __get_id(coro, logger, 'clan_id')
+    return await __get_id(
+        lambda: __search_id(
+            wows_api.clans(region, search=search, language='en', limit=1),
+            'clan_id'
+        ), logger, 'clan', region, search, cache
+    )
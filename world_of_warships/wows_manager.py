@@ -1,55 +1,92 @@
-from asyncio import sleep
+from asyncio import ensure_future, gather, get_event_loop, sleep
 from datetime import date
+from functools import partial
 from json import dumps, load
 from pathlib import Path
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 
 from aiohttp_wrapper import SessionManager
 from discord import Embed
 from wowspy import Region, WowsAsync
 
 from data import data_path
-from scripts.helpers import combine_objects
+from scripts.helpers import combine_objects, write_atomic
 from world_of_warships.embed_builder import build_clan_embed
+from world_of_warships.embed_cache import EmbedCache
 from world_of_warships.player import Player
+from world_of_warships.player_cache import PlayerCache
+from world_of_warships.player_store import PlayerStore
+from world_of_warships.refresher import RefreshScheduler
+from world_of_warships.war_gaming import IdCache
 from world_of_warships.wtr import CONVERT_REGION, choose_colour, \
-    coeff_all_region, get_ship_dicts, wtr_absolute
+    coeff_all_region, get_ship_dicts
+from world_of_warships.wtr_cache import load_validators, load_wtr_cache, \
+    save_wtr_cache
+from world_of_warships.wtr_engine import WTREngine
 
 
 class WowsManager:
     __slots__ = ('logger', 'wows_api', 'expected_and_coeff', 'ship_dict',
-                 'players', 'e_and_c_path', 'ship_path')
+                 'players', 'e_and_c_path', 'ship_path', 'engines',
+                 'store', 'refresher', 'data_task', 'validators',
+                 'cache_path', 'ids', 'embeds')
 
-    def __init__(self, wows_api: WowsAsync, logger):
+    def __init__(self, wows_api: WowsAsync, logger,
+                 store: Optional[PlayerStore] = None,
+                 ids: Optional[IdCache] = None, **cache_options):
         """
         :param wows_api: WowsAsync instance.
         :param logger: the logger.
+        :param store: the PlayerStore players are kept in across restarts,
+        optional.
+        :param ids: the IdCache of player and clan name searches, defaults
+        to one that isn't saved.
+        :param cache_options: options of the PlayerCache, see PlayerCache.
         """
         self.logger = logger
         self.wows_api = wows_api
         self.expected_and_coeff = None
         self.ship_dict = None
-        self.players = {
-            Region.NA: {},
-            Region.EU: {},
-            Region.RU: {},
-            Region.AS: {}
-        }
+        self.engines = {}
+        self.store = store
+        self.ids = ids or IdCache()
+        self.embeds = EmbedCache()
+        self.players = PlayerCache(self.__load_player, **cache_options)
+        self.refresher = RefreshScheduler(self.__refresh_player, logger)
+        self.data_task = None
+        self.validators = {'Warships Today': {}, 'Wargaming': {}}
         self.e_and_c_path = data_path.joinpath('expected_and_coeff.json')
         self.ship_path = data_path.joinpath('ship_dict.json')
+        self.cache_path = data_path.joinpath('wtr_cache')
 
     @classmethod
     async def wows_manager(cls, session_manager: SessionManager,
-                           wows_api: WowsAsync, logger):
+                           wows_api: WowsAsync, logger,
+                           store: Optional[PlayerStore] = None,
+                           refresh_interval: Optional[float] = None,
+                           ids: Optional[IdCache] = None):
         """
         Get an instance of WowsManager. Use this instead of __init__
+        The data used for WTR calculations is loaded from file and updated
+        in the background, it's only waited for if there is no file.
         :param session_manager: SessionManager instance.
         :param wows_api: WowsAsync instance.
         :param logger: the logger.
+        :param store: see __init__.
+        :param refresh_interval: the amount of seconds between updates of
+        the data used for WTR calculations, None to only update it once.
+        :param ids: see __init__.
         :return: a new instance of WowsManager
         """
-        instance = cls(wows_api, logger)
-        await instance.update_data(session_manager)
+        instance = cls(wows_api, logger, store, ids)
+        await instance.load_data()
+        wait = not instance.check_data()
+        if wait:
+            await instance.update_data(session_manager)
+        if not wait or refresh_interval:
+            instance.data_task = ensure_future(instance.refresh_data(
+                session_manager, refresh_interval, wait
+            ))
         return instance
 
     def expected(self, region):
@@ -61,83 +98,292 @@ class WowsManager:
     def check_data(self):
         return self.expected_and_coeff and self.ship_dict
 
-    async def __update_data(self, coro, path: Path) -> Optional[dict]:
+    @staticmethod
+    def __read(path: Path) -> Optional[dict]:
+        """
+        Read a json file, if it exists.
+        """
+        try:
+            with path.open() as f:
+                return load(f)
+        except FileNotFoundError:
+            return
+
+    async def load_data(self):
+        """
+        Load the data used for wtr calculations from the binary cache, or
+        from the json files if there is no cache, in which case the cache
+        is written from them.
+        The response validators are only loaded along with the cache, since
+        they describe the data it holds.
+        """
+        loop = get_event_loop()
+        cached = await loop.run_in_executor(
+            None, load_wtr_cache, self.cache_path
+        )
+        if cached:
+            self.expected_and_coeff, self.ship_dict = cached
+            validators = await loop.run_in_executor(
+                None, load_validators, self.cache_path
+            )
+            for source, val in validators.items():
+                if source in self.validators:
+                    self.validators[source] = val
+        else:
+            self.expected_and_coeff, self.ship_dict = await gather(
+                loop.run_in_executor(None, self.__read, self.e_and_c_path),
+                loop.run_in_executor(None, self.__read, self.ship_path)
+            )
+            await self.__save_cache()
+        self.build_engines()
+
+    async def __save_cache(self, previous_coeff: Optional[dict] = None,
+                           previous_ships: Optional[dict] = None):
+        """
+        Save the data used for wtr calculations to the binary cache, then
+        use the memory mapped tables of the cache in place of the parsed
+        data. The data of a region that is the same object as in previous
+        is kept, so its engine is kept.
+        :param previous_coeff: the coefficients before the update, if any.
+        :param previous_ships: the ship tiers before the update, if any.
+        """
+        if not self.check_data():
+            return
+        loop = get_event_loop()
+        try:
+            saved = await loop.run_in_executor(
+                None, save_wtr_cache, self.cache_path,
+                self.expected_and_coeff, self.ship_dict, self.validators
+            )
+            cached = saved and await loop.run_in_executor(
+                None, load_wtr_cache, self.cache_path
+            )
+        except Exception as e:
+            self.logger.warn(f'Failed to save the WTR data cache: {e}')
+            return
+        if not cached:
+            return
+        self.expected_and_coeff = self.__swap(
+            self.expected_and_coeff, cached[0], previous_coeff
+        )
+        self.ship_dict = self.__swap(self.ship_dict, cached[1], previous_ships)
+
+    @staticmethod
+    def __swap(data: dict, cached: dict, previous: Optional[dict]) -> dict:
+        """
+        Use the cached data of every region that changed since previous.
+        """
+        previous = previous or {}
+        return {
+            region: val if val is previous.get(region) else cached[region]
+            for region, val in data.items()
+        }
+
+    async def __update_data(self, fetch: Callable[[dict, dict], Awaitable],
+                            path: Path, source: str,
+                            current: Optional[dict]) -> Optional[dict]:
         """
         Helper method to update data used in wtr calculations.
         Dumps the new data to file if new data if fetched.
-        :param coro: the coroutine to be called.
+        The response validators of the source are only replaced once the
+        data they describe is in place.
+        :param fetch: the coroutine function that fetches the data, called
+        with a copy of the validators of the source and current.
         :param path: the path to the json file.
+        :param source: the name of the data source.
+        :param current: the current data, which fetch returns if the data
+        hasn't changed.
         :return: the new data if any.
         """
+        generic = f'Updating data from {source}'
+        self.logger.info(f'{generic}.')
+        validators = dict(self.validators[source])
         try:
-            data = await coro
+            data = await fetch(validators, current)
         except Exception as e:
-            self.logger.warn(str(e))
-        else:
-            with path.open('w+') as f:
-                f.write(dumps(data))
-            return data
+            self.logger.warn(f'{generic} failed: {e}')
+            return
+        if data is current:
+            self.validators[source] = validators
+            self.logger.info(f'{generic} success, no changes.')
+            return
+        await get_event_loop().run_in_executor(
+            None, write_atomic, path, dumps(data, default=dict)
+        )
+        self.validators[source] = validators
+        self.logger.info(f'{generic} success.')
+        return data
 
-    async def update_data(self, session_manager: SessionManager):
+    async def update_data(self, session_manager: SessionManager) -> bool:
         """
         Update data used for wtr calculations.
+        Warships Today and Wargaming are requested at once, the data that
+        fails to update or hasn't changed is kept as is, and only the
+        engines of the regions whose data changed are rebuilt.
+        The response validators are saved with the binary cache, so data
+        that hasn't changed over a restart isn't counted as changed.
         :param session_manager: SessionManager instance.
+        :return: True if any data changed.
         """
-        generic = 'Updating data from'
-        self.logger.info(f'{generic} Warships Today.')
-        coeff = await self.__update_data(
-            coeff_all_region(session_manager), self.e_and_c_path
+        current_coeff, current_ships = self.expected_and_coeff, self.ship_dict
+        coeff, ships = await gather(
+            self.__update_data(
+                partial(coeff_all_region, session_manager),
+                self.e_and_c_path, 'Warships Today', current_coeff
+            ),
+            self.__update_data(
+                partial(get_ship_dicts, self.wows_api),
+                self.ship_path, 'Wargaming', current_ships
+            )
         )
+        if not coeff and not ships:
+            return False
         if coeff:
             self.expected_and_coeff = coeff
-            self.logger.info(f'{generic} Warships Today success.')
-        else:
-            self.logger.warn(f'{generic} from Warships Today failed.')
-            with self.e_and_c_path.open() as f:
-                self.expected_and_coeff = load(f)
-
-        assert self.expected_and_coeff is not None
-
-        self.logger.info(f'{generic} from Wargaming.')
-        ships = await self.__update_data(
-            get_ship_dicts(self.wows_api), self.ship_path
-        )
         if ships:
             self.ship_dict = ships
-            self.logger.info(f'{generic} from Wargaming success.')
+        await self.__save_cache(current_coeff, current_ships)
+        self.build_engines()
+        return True
+
+    async def refresh_data(self, session_manager: SessionManager,
+                           interval: Optional[float], wait: bool = False):
+        """
+        Update data used for wtr calculations every interval seconds until
+        cancelled.
+        :param session_manager: SessionManager instance.
+        :param interval: the amount of seconds between updates, None to
+        update once.
+        :param wait: True to wait for interval before the first update.
+        """
+        while True:
+            if wait:
+                await sleep(interval)
+            try:
+                await self.update_data(session_manager)
+            except Exception as e:
+                self.logger.warn(f'Failed to update WTR data: {e}')
+            if not interval:
+                return
+            wait = True
+
+    def build_engines(self):
+        """
+        Load the WTR data of every region into a WTREngine.
+        The engine of a region is kept if its data is the same, so the WTR
+        breakdowns of its players stay valid.
+        """
+        if not self.check_data():
+            return
+        engines = {}
+        for region in Region:
+            data = (
+                self.expected(region), self.coeff(region),
+                self.ship_dict[region.name]
+            )
+            engine = self.engines.get(region)
+            if engine is None or any(
+                    a is not b for a, b in zip(engine.sources, data)):
+                engine = WTREngine(*data)
+            engines[region] = engine
+        self.engines = engines
+
+    def __load_player(self, region: Region, id_: str,
+                      snapshot: Optional[dict] = None) -> Player:
+        """
+        Create a player, from its snapshot in the store if there is one.
+        """
+        if snapshot:
+            return Player.restore(region, id_, self.logger, snapshot)
+        return Player(region, id_, self.logger)
+
+    def __save_player(self, player: Player):
+        """
+        Save a player to the store, if it was fetched.
+        """
+        if not self.store or not player.fetched_at:
+            return
+        try:
+            self.store.save(
+                player.region, player.player_id, player.snapshot()
+            )
+        except Exception as e:
+            self.logger.warn(f'Failed to save player {player.player_id}: {e}')
+
+    async def __revalidate(self, player: Player, coro):
+        """
+        Refresh a player served from the store in the background.
+        :param player: the player.
+        :param coro: the coroutine that refreshes the player.
+        """
+        try:
+            await coro
+        except Exception as e:
+            self.logger.warn(f'Failed to refresh player '
+                             f'{player.player_id}: {e}')
         else:
-            self.logger.warn(f'{generic} from Wargaming failed.')
+            self.__save_player(player)
 
     async def get_player(self, region: Region, id_: str) -> Player:
         """
         Get a player by region and id.
+        A player that isn't cached is loaded from the store if possible,
+        such a player is stale until it's refreshed.
         :param region: the player region.
         :param id_: the player id.
         :return: the player.
         """
-        if id_ not in self.players[region]:
-            self.players[region][id_] = Player(region, id_, self.logger)
-        player = self.players[region][id_]
-        while player.updating:
-            await sleep(0)
-        return player
+        if not self.store or self.players.is_cached(region, id_):
+            return self.players.get(region, id_)
+        try:
+            snapshot = await self.store.load(region, id_)
+        except Exception as e:
+            self.logger.warn(f'Failed to load player {id_}: {e}')
+            snapshot = None
+        return self.players.get(region, id_, snapshot)
 
-    async def get_clan_players(self, region: Region, ids: List[int]):
+    async def get_clan_players(
+            self, region: Region, ids: List[int],
+            progress: Optional[Callable[[int, int], Awaitable]] = None):
         """
         Get a list of players by ids.
+        The players are fetched concurrently, bounded by the rate limit of
+        the api. A player that fails to fetch is logged and left out.
         :param region: the region.
         :param ids: the list of ids.
-        :return: the list of Player if they have ship stats.
-        """
-        players = []
-        for id_ in ids:
-            new = await self.get_player(region, str(id_))
-            new.ship_stats = await new.fetch_ship_stats(self.wows_api)
-            if new.ship_stats:
-                players.append(new)
-        for player in players:
-            player.updating = True
-        return players
+        :param progress: an optional coroutine function called with
+        (players done, total players) after each player is fetched, its
+        failures are logged and ignored.
+        :return: the list of Player if they have ship stats, in the order
+        of ids.
+        """
+        done = 0
+
+        async def fetch(id_) -> Optional[Player]:
+            nonlocal done
+            try:
+                new = await self.get_player(region, str(id_))
+                if new.stale and new.ship_stats:
+                    new.stale = False
+                    ensure_future(self.__revalidate(
+                        new, new.refresh_ship_stats(self.wows_api)
+                    ))
+                else:
+                    await new.refresh_ship_stats(self.wows_api)
+                    self.__save_player(new)
+            except Exception as e:
+                self.logger.warn(f'Failed to fetch player {id_}: {e}')
+                new = None
+            done += 1
+            if progress:
+                try:
+                    await progress(done, len(ids))
+                except Exception as e:
+                    self.logger.warn(f'Failed to report clan progress: {e}')
+            return new
+
+        fetched = await gather(*[fetch(id_) for id_ in ids])
+        return [p for p in fetched if p is not None and p.ship_stats]
 
     async def clan_meta(self, region: Region, id_: int) -> Optional[dict]:
         """
@@ -168,12 +414,7 @@ class WowsManager:
         :return: the clan Embed.
         """
         clan_sats = combine_objects(*[p.ship_stats for p in players])
-        wtr = await wtr_absolute(
-            self.expected(region),
-            self.coeff(region),
-            clan_sats,
-            self.ship_dict[region.name]
-        )
+        wtr = await self.engines[region].wtr_async(clan_sats)
         name = clan_meta.get('name', 'None') or 'None'
         description = clan_meta.get('description', 'None') or 'None'
         tag = clan_meta.get('tag', 'None') or 'None'
@@ -192,56 +433,109 @@ class WowsManager:
         )
         return embed
 
-    async def player_embed(self, region: Region, player_id):
+    async def player_embed(self, region: Region, player_id,
+                           force: bool = False):
         """
         Get an embed for player stats.
+        An embed rendered recently from the same WTR data is served from
+        the EmbedCache without any request. A stale player is answered from
+        its stored stats right away and refreshed in the background.
         :param region: the region.
         :param player_id: the player id.
+        :param force: True to skip the cached embed and stored stats.
         :return: the Embed or a warships today signiture for fallback.
         """
+        key = ('player', region, str(player_id))
+        engine = self.engines.get(region)
+        if not force:
+            cached = self.embeds.get(key, engine)
+            if cached is not None:
+                return cached
         player = await self.get_player(region, str(player_id))
-        embed = await player.get_embed(
+        coro = player.get_embed(
             self.wows_api, self.expected(region), self.coeff(region),
-            self.ship_dict[region.name]
+            self.ship_dict[region.name], engine
         )
+        if player.stale and player.stats and not force:
+            player.stale = False
+            embed = player.build_embed()
+            ensure_future(self.__revalidate(player, coro))
+        else:
+            embed = await coro
+            self.__save_player(player)
+            if embed is not None:
+                self.embeds.put(key, engine, embed)
         return embed or player.warships_today_sig
 
-    async def cache_players(self, region: Region, players: List[Player]):
+    def cache_players(self, region: Region, players: List[Player]):
         """
-        Cache players' stats into Player objects.
+        Queue players' stats to be cached into Player objects in the
+        background, see RefreshScheduler.
         :param region: the region.
         :param players: a list of Players.
         """
-        for player in players:
-            try:
-                await player.update(
-                    self.wows_api,
-                    self.expected(region),
-                    self.coeff(region),
-                    self.ship_dict[region.name], False
-                )
-            except Exception as e:
-                self.logger.warn(str(e))
-            player.updating = False
+        self.refresher.schedule((region, p.player_id) for p in players)
+
+    async def __refresh_player(self, region: Region, id_: str):
+        """
+        Update a player without its ship stats, for the RefreshScheduler.
+        """
+        player = await self.get_player(region, id_)
+        if await player.update(
+                self.wows_api, self.expected(region), self.coeff(region),
+                self.ship_dict[region.name], False, self.engines.get(region)):
+            self.__save_player(player)
 
-    async def process_clan(self, region: Region, clan_id: int):
+    async def process_clan(
+            self, region: Region, clan_id: int,
+            progress: Optional[Callable[[int, int], Awaitable]] = None,
+            force: bool = False):
         """
         Process a request for getting clan info.
+        An embed rendered recently from the same WTR data is served from
+        the EmbedCache without any request.
         :param region: the region.
         :param clan_id: the clan id.
+        :param progress: see get_clan_players.
+        :param force: True to skip the cached embed.
+        :return: a tuple of (the embed or an error message, the players to
+        refresh in the background or None)
         """
         if not self.check_data():
             msg = 'Data needed for WTR calculation not available'
             self.logger.warn(f'{type(self)}: {msg}')
             return msg, None
+        key = ('clan', region, clan_id)
+        engine = self.engines.get(region)
+        if not force:
+            cached = self.embeds.get(key, engine)
+            if cached is not None:
+                return cached, None
 
         meta = await self.clan_meta(region, clan_id)
         player_ids = meta.get('members_ids', [])
-        players = await self.get_clan_players(region, player_ids)
+        players = await self.get_clan_players(region, player_ids, progress)
         if not players:
             return Embed(
                 title='Error',
                 description="The clan doesn't have any players.",
                 colour=0x930D0D
             ), None
-        return await self.clan_embed(region, players, meta), players
+        embed = await self.clan_embed(region, players, meta)
+        self.embeds.put(key, engine, embed)
+        return embed, players
+
+    def close(self):
+        """
+        Stop the background refreshes, save the IdCache and close the
+        player store, if any.
+        """
+        if self.data_task:
+            self.data_task.cancel()
+        self.refresher.close()
+        try:
+            self.ids.save()
+        except OSError as e:
+            self.logger.warn(f'Failed to save the id cache: {e}')
+        if self.store:
+            self.store.close()
@@ -1,3 +1,9 @@
+from asyncio import gather, get_event_loop
+from functools import partial
+from hashlib import sha1
+from json import dumps, loads
+from typing import Callable, Optional, Tuple
+
 from aiohttp_wrapper import SessionManager
 from wowspy import Region, WowsAsync
 
@@ -10,6 +16,18 @@ CONVERT_REGION = {
     Region.AS: 'asia'
 }
 
+# WTR calculations over more ships than this run in an executor.
+EXECUTOR_THRESHOLD = 300
+
+
+def _coeff_url(region: str) -> str:
+    return (f'https://api.{region}.warships.today/json/wows/ratings/'
+            f'warships-today-rating/coefficients')
+
+
+def _digest(content: bytes) -> str:
+    return sha1(content).hexdigest()
+
 
 async def get_coeff(region: str, session_manager: SessionManager) -> dict:
     """
@@ -19,41 +37,130 @@ async def get_coeff(region: str, session_manager: SessionManager) -> dict:
     :param session_manager: the SessionManager.
     :return: the coefficients used for WTR calculations.
     """
-    return await session_manager.get_json(
-        f'https://api.{region}.warships.today/json/wows/ratings/'
-        f'warships-today-rating/coefficients'
+    return await session_manager.get_json(_coeff_url(region))
+
+
+async def get_coeff_if_changed(region: str, session_manager: SessionManager,
+                               validators: dict) -> Tuple[Optional[dict],
+                                                          dict]:
+    """
+    Get the coefficients used for WTR calculations, unless they haven't
+    changed since the response validators were recorded.
+    The ETag and Last-Modified of the last response are sent along, and
+    the content is hashed so an unchanged body isn't parsed either.
+    :param region: the region.
+    :param session_manager: the SessionManager.
+    :param validators: the validators of the last response, may be empty.
+    :return: a tuple of (the coefficients or None if unchanged,
+    the validators of this response)
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    resp = await session_manager.get(
+        _coeff_url(region), (200, 304), headers=headers
     )
+    async with resp as r:
+        if r.status == 304:
+            return None, validators
+        content = await r.read()
+        new = {
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'hash': _digest(content)
+        }
+    if new['hash'] == validators.get('hash'):
+        return None, new
+    return loads(content), new
+
+
+def _parse_coeff(resp: dict) -> dict:
+    """
+    Key the expected values of a coefficients response by str ship id.
+    """
+    tmp = {}
+    __expected = resp.get('expected', None)
+    expected = {}
+    for entry in __expected:
+        expected[str(entry['ship_id'])] = entry
+    for key in resp:
+        if key == 'expected':
+            continue
+        tmp[key] = resp[key]
+    tmp['expected'] = expected
+    return tmp
 
 
-async def coeff_all_region(session_manager: SessionManager) -> dict:
+async def coeff_all_region(session_manager: SessionManager,
+                           validators: Optional[dict] = None,
+                           current: Optional[dict] = None) -> dict:
     """
-    Get coefficients for all regions.
+    Get coefficients for all regions, the regions are requested at once.
     :param session_manager: the SessionManager.
-    :return: coefficients for all regions.
+    :param validators: a dict of {region: response validators}, see
+    get_coeff_if_changed. If given, regions that haven't changed keep
+    their data from current, and the dict is updated once every region
+    succeeds.
+    :param current: the current coefficients for all regions.
+    :return: coefficients for all regions, current itself if no region
+    changed.
     """
+    regions = ('na', 'eu', 'ru', 'asia')
+    if validators is None:
+        resps = await gather(
+            *[get_coeff(region, session_manager) for region in regions]
+        )
+        return {r: _parse_coeff(resp) for r, resp in zip(regions, resps)}
+    current = current or {}
+    results = await gather(*[
+        get_coeff_if_changed(
+            region, session_manager,
+            validators.get(region, {}) if region in current else {}
+        ) for region in regions
+    ])
     res = {}
-    for region in ('na', 'eu', 'ru', 'asia'):
-        resp = await get_coeff(region, session_manager)
-        tmp = {}
-        __expected = resp.get('expected', None)
-        expected = {}
-        for entry in __expected:
-            expected[str(entry['ship_id'])] = entry
-        for key in resp:
-            if key == 'expected':
-                continue
-            tmp[key] = resp[key]
-        tmp['expected'] = expected
-        res[region] = tmp
+    for region, (resp, new) in zip(regions, results):
+        validators[region] = new
+        res[region] = current[region] if resp is None else _parse_coeff(resp)
+    if all(res[r] is current.get(r) for r in regions):
+        return current
     return res
 
 
-async def get_ship_dicts(wows_api: WowsAsync):
+async def get_ship_dicts(wows_api: WowsAsync,
+                         validators: Optional[dict] = None,
+                         current: Optional[dict] = None):
+    """
+    Get the ship tiers for all regions, the regions are requested at once.
+    :param wows_api: the WowsAsync instance.
+    :param validators: a dict of {region name: content hash}. If given,
+    regions with the same hash keep their data from current, and the dict
+    is updated once every region succeeds.
+    :param current: the current ship tiers for all regions.
+    :return: a dict of {region name: {ship id: tier}}, current itself if
+    no region changed.
+    """
+    regions = list(Region)
+    resps = await gather(*[
+        wows_api.warships(region, fields='tier', language='en')
+        for region in regions
+    ])
     res = {}
-    for region in Region:
-        resp = await wows_api.warships(region, fields='tier', language='en')
+    for region, resp in zip(regions, resps):
         data = resp['data']
         res[region.name] = {key: val['tier'] for key, val in data.items()}
+    if validators is None:
+        return res
+    current = current or {}
+    for name, tiers in res.items():
+        digest = _digest(dumps(tiers, sort_keys=True).encode())
+        if validators.get(name) == digest and name in current:
+            res[name] = current[name]
+        validators[name] = digest
+    if all(res[name] is current.get(name) for name in res):
+        return current
     return res
 
 
@@ -136,7 +243,7 @@ def __adjust(value, average_level, base) -> float:
     return adjusted_base + for_adjusting * coef
 
 
-async def wtr_absolute(all_expected, coeff, actual: dict, ship_dict) -> int:
+def wtr_absolute_sync(all_expected, coeff, actual: dict, ship_dict) -> int:
     """
     Calculate the absolute WTR for a player
     :param all_expected: the expected stats values
@@ -153,16 +260,39 @@ async def wtr_absolute(all_expected, coeff, actual: dict, ship_dict) -> int:
         if not expected:
             continue
         tier = ship_dict.get(ship_id, 7.5)
-        wtr, battles = await __wtr(expected, stat, tier, coeff)
+        wtr, battles = __wtr(expected, stat, tier, coeff)
         total += wtr
         total_battles += battles
     return round(try_divide(total, total_battles))
 
 
-async def __wtr(expected, stats, tier, coeff):
+async def wtr_absolute(all_expected, coeff, actual: dict, ship_dict) -> int:
+    """
+    Awaitable version of wtr_absolute_sync, see run_wtr.
+    """
+    return await run_wtr(
+        actual, wtr_absolute_sync, all_expected, coeff, actual, ship_dict
+    )
+
+
+async def run_wtr(actual: Optional[dict], fn: Callable[..., int], *args):
+    """
+    Run a WTR calculation, in the default executor if it covers more than
+    EXECUTOR_THRESHOLD ships so it does not block the event loop.
+    :param actual: the actual stats the calculation covers.
+    :param fn: the synchronous WTR function.
+    :param args: the arguments to fn.
+    :return: the result of fn.
+    """
+    if actual and len(actual) > EXECUTOR_THRESHOLD:
+        return await get_event_loop().run_in_executor(None, partial(fn, *args))
+    return fn(*args)
+
+
+def __wtr(expected, stats, tier, coeff):
     """
-    Helper function for wtr_absolute
-    See wtr_absolute for parameters
+    Helper function for wtr_absolute_sync
+    See wtr_absolute_sync for parameters
     """
     battles = stats.get('battles', None)
     if battles:
@@ -0,0 +1,211 @@
+"""
+A binary cache of the data used for WTR calculations.
+
+The expected values and ship tiers of every region are kept as .npy
+arrays that are memory mapped read-only on load, so loading doesn't parse
+them and processes loading the same cache share their pages. A small JSON
+header holds the rest of the data, the names of the array files and the
+response validators the data was fetched with.
+"""
+from collections.abc import Mapping
+from json import dumps, loads
+from pathlib import Path
+from typing import Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+from scripts.helpers import write_atomic
+from world_of_warships.wtr_engine import STATS
+
+__all__ = ['ExpectedTable', 'TierTable', 'load_validators', 'load_wtr_cache',
+           'save_wtr_cache']
+
+VERSION = 1
+HEADER = 'header.json'
+EXPECTED_DTYPE = np.dtype([('ship_id', '<i8')] + [(s, '<f8') for s in STATS])
+TIER_DTYPE = np.dtype([('ship_id', '<i8'), ('tier', '<i2')])
+
+
+class ExpectedTable(Mapping):
+    """
+    A read-only mapping of str ship id to expected values, backed by an
+    array of EXPECTED_DTYPE. The values are built on access.
+    """
+    __slots__ = ('array', '__index')
+
+    def __init__(self, array: np.ndarray):
+        """
+        :param array: the array of EXPECTED_DTYPE.
+        """
+        self.array = array
+        self.__index = None
+
+    def __index_of(self) -> dict:
+        if self.__index is None:
+            self.__index = {
+                str(ship_id): i
+                for i, ship_id in enumerate(self.array['ship_id'].tolist())
+            }
+        return self.__index
+
+    def __getitem__(self, ship_id: str) -> dict:
+        row = self.array[self.__index_of()[ship_id]]
+        res = {s: float(row[s]) for s in STATS}
+        res['ship_id'] = int(row['ship_id'])
+        return res
+
+    def __iter__(self):
+        return (str(ship_id) for ship_id in self.array['ship_id'].tolist())
+
+    def __len__(self):
+        return len(self.array)
+
+    def stats_matrix(self) -> Tuple[list, np.ndarray]:
+        """
+        :return: a tuple of (str ship ids, expected values in the order of
+        STATS), see WTREngine.
+        """
+        matrix = np.column_stack([self.array[s] for s in STATS])
+        return list(self), matrix.reshape(-1, len(STATS))
+
+
+class TierTable(Mapping):
+    """
+    A read-only mapping of str ship id to tier, backed by an array of
+    TIER_DTYPE. Like the ship dicts loaded from JSON, it's keyed by str.
+    """
+    __slots__ = ('array', '__tiers')
+
+    def __init__(self, array: np.ndarray):
+        """
+        :param array: the array of TIER_DTYPE.
+        """
+        self.array = array
+        self.__tiers = None
+
+    def __getitem__(self, ship_id: str) -> int:
+        if self.__tiers is None:
+            self.__tiers = dict(zip(
+                map(str, self.array['ship_id'].tolist()),
+                self.array['tier'].tolist()
+            ))
+        return self.__tiers[ship_id]
+
+    def __iter__(self):
+        return (str(ship_id) for ship_id in self.array['ship_id'].tolist())
+
+    def __len__(self):
+        return len(self.array)
+
+
+def _expected_array(expected: Mapping) -> Optional[np.ndarray]:
+    if isinstance(expected, ExpectedTable):
+        return np.asarray(expected.array)
+    if not all(str(k).isdigit() for k in expected):
+        return
+    return np.array([
+        (int(ship_id),) + tuple(e[s] for s in STATS)
+        for ship_id, e in expected.items()
+    ], dtype=EXPECTED_DTYPE)
+
+
+def _tier_array(tiers: Mapping) -> Optional[np.ndarray]:
+    if isinstance(tiers, TierTable):
+        return np.asarray(tiers.array)
+    if not all(str(k).isdigit() for k in tiers):
+        return
+    return np.array(
+        [(int(ship_id), tier) for ship_id, tier in tiers.items()],
+        dtype=TIER_DTYPE
+    )
+
+
+def save_wtr_cache(path: Path, expected_and_coeff: dict, ship_dict: dict,
+                   validators: Optional[dict] = None) -> bool:
+    """
+    Save the data used for WTR calculations.
+    The arrays are written under new names and the header is replaced
+    last, so a process loading the cache sees either the old or the new
+    data. Array files the header no longer names are removed, processes
+    that mapped them keep their mapping.
+    :param path: the cache directory.
+    :param expected_and_coeff: the coefficients of all regions.
+    :param ship_dict: the ship tiers of all regions.
+    :param validators: the response validators of the data, see
+    WowsManager.update_data, optional.
+    :return: True if saved, False if the data has non numeric ship ids.
+    """
+    arrays = {}
+    header = {'version': VERSION, 'coeff': {}, 'ships': {},
+              'validators': validators or {}}
+    for region, data in expected_and_coeff.items():
+        expected = _expected_array(data['expected'])
+        if expected is None:
+            return False
+        rest = {k: v for k, v in data.items() if k != 'expected'}
+        arrays[f'expected_{region}'] = expected
+        header['coeff'][region] = {'data': rest}
+    for region, tiers in ship_dict.items():
+        array = _tier_array(tiers)
+        if array is None:
+            return False
+        arrays[f'tiers_{region}'] = array
+    path.mkdir(parents=True, exist_ok=True)
+    generation = uuid4().hex
+    files = {}
+    for name, array in arrays.items():
+        file = f'{name}.{generation}.npy'
+        np.save(str(path / file), array, allow_pickle=False)
+        files[name] = file
+    for region in header['coeff']:
+        header['coeff'][region]['file'] = files[f'expected_{region}']
+    for region in ship_dict:
+        header['ships'][region] = files[f'tiers_{region}']
+    write_atomic(path / HEADER, dumps(header))
+    for old in path.glob('*.npy'):
+        if old.name not in files.values():
+            old.unlink()
+    return True
+
+
+def load_wtr_cache(path: Path) -> Optional[Tuple[dict, dict]]:
+    """
+    Load the data used for WTR calculations, with the arrays memory mapped.
+    :param path: the cache directory.
+    :return: a tuple of (expected_and_coeff, ship_dict) as stored by
+    save_wtr_cache, or None if there is no usable cache.
+    """
+    try:
+        header = loads((path / HEADER).read_text())
+        if header.get('version') != VERSION:
+            return
+        expected_and_coeff = {}
+        for region, entry in header['coeff'].items():
+            data = dict(entry['data'])
+            array = np.load(str(path / entry['file']), mmap_mode='r')
+            data['expected'] = ExpectedTable(array)
+            expected_and_coeff[region] = data
+        ship_dict = {
+            region: TierTable(np.load(str(path / file), mmap_mode='r'))
+            for region, file in header['ships'].items()
+        }
+    except (OSError, ValueError, KeyError):
+        return
+    return expected_and_coeff, ship_dict
+
+
+def load_validators(path: Path) -> dict:
+    """
+    Load the response validators the cached data was fetched with.
+    :param path: the cache directory.
+    :return: the validators as saved by save_wtr_cache, empty if there are
+    none.
+    """
+    try:
+        header = loads((path / HEADER).read_text())
+    except (OSError, ValueError):
+        return {}
+    if header.get('version') != VERSION:
+        return {}
+    return header.get('validators') or {}
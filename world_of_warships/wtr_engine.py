@@ -0,0 +1,216 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from world_of_warships.wtr import run_wtr
+
+STATS = (
+    'wins', 'damage_dealt', 'frags', 'capture_points',
+    'dropped_capture_points', 'planes_killed'
+)
+
+_WINS, _DAMAGE, _FRAGS, _CAPTURE, _DROPPED, _PLANES = range(len(STATS))
+_WEIGHTED = [_WINS, _DAMAGE, _CAPTURE, _DROPPED]
+_MISSING = (object(),)
+
+
+class WTREngine:
+    """
+    A vectorized WTR calculator for one region.
+
+    The expected values of every ship, the coefficients and the ship tiers
+    are kept in arrays aligned by ship index, so the WTR of any amount of
+    ships is a handful of array operations. The results match wtr_absolute
+    within floating point tolerance.
+    """
+    __slots__ = ('index', 'ship_ids', 'inverse', 'aircraft_frags_coef',
+                 'has_frags', 'weights', 'frags_weight', 'tiers',
+                 'nominal_rating', 'sources')
+
+    def __init__(self, all_expected: dict, coeff: dict, ship_dict: dict):
+        """
+        :param all_expected: the expected stats values, by str ship id, or
+        an ExpectedTable.
+        :param coeff: the coefficents used in calculation.
+        :param ship_dict: dict of ship_id mapped to ship tier.
+        """
+        self.sources = (all_expected, coeff, ship_dict)
+        stats_matrix = getattr(all_expected, 'stats_matrix', None)
+        if stats_matrix is not None:
+            self.ship_ids, expected = stats_matrix()
+        else:
+            self.ship_ids = list(all_expected)
+            expected = np.array(
+                [[e[s] for s in STATS] for e in all_expected.values()],
+                dtype=np.float64
+            ).reshape(-1, len(STATS))
+        self.index = {ship_id: i for i, ship_id in enumerate(self.ship_ids)}
+        with np.errstate(divide='ignore'):
+            self.inverse = np.where(expected != 0, 1 / expected, 0)
+        planes, frags = expected[:, _PLANES], expected[:, _FRAGS]
+        self.has_frags = planes + frags > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aircraft = planes / (
+                planes + coeff['ship_frags_importance_weight'] * frags
+            )
+        self.aircraft_frags_coef = np.where(self.has_frags, aircraft, 0)
+        self.weights = np.array([
+            coeff['wins_weight'], coeff['damage_weight'],
+            coeff['capture_weight'], coeff['dropped_capture_weight']
+        ], dtype=np.float64)
+        self.frags_weight = coeff['frags_weight']
+        self.nominal_rating = coeff['nominal_rating']
+        self.tiers = np.array([
+            ship_dict.get(self.__ship_key(ship_id), 7.5)
+            for ship_id in self.ship_ids
+        ], dtype=np.float64)
+
+    @staticmethod
+    def __ship_key(ship_id: str):
+        """
+        The ship stats are keyed by int ship ids, so are the tier lookups
+        in wtr_absolute.
+        """
+        return int(ship_id) if ship_id.isdigit() else ship_id
+
+    def __rows(self, actual: dict) -> Tuple[list, list]:
+        """
+        Collect the stats rows of the ships with expected values and battles.
+        :return: a tuple of (ship ids, rows)
+        """
+        index = self.index
+        keys, rows = [], []
+        for ship_id, stat in actual.items():
+            i = index.get(str(ship_id))
+            battles = stat.get('battles')
+            if i is None or not battles:
+                continue
+            keys.append(ship_id)
+            rows.append((i, battles) + tuple(stat.get(s, 0) for s in STATS))
+        return keys, rows
+
+    @staticmethod
+    def __arrays(rows: list) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Split the rows from __rows into arrays, see matrix.
+        """
+        if not rows:
+            empty = np.zeros(0)
+            return empty.astype(np.intp), empty, empty.reshape(0, len(STATS))
+        arr = np.array(rows, dtype=np.float64)
+        return arr[:, 0].astype(np.intp), arr[:, 1], arr[:, 2:]
+
+    def matrix(self, actual: dict) -> Tuple[np.ndarray, np.ndarray,
+                                            np.ndarray]:
+        """
+        Turn ship stats into arrays aligned with the expected values.
+        Ships without expected values or battles are left out.
+        :param actual: the stats of the player, by ship id.
+        :return: a tuple of (ship indexes, battles, stats matrix)
+        """
+        return self.__arrays(self.__rows(actual)[1])
+
+    def breakdown(self, actual: dict) -> Dict[int, Tuple[float, float]]:
+        """
+        Get the battles and weighted WTR of every ship.
+        Ships without expected values or battles are left out.
+        :param actual: the stats of the player, by ship id.
+        :return: a dict of {ship id: (battles, weighted WTR)}
+        """
+        keys, rows = self.__rows(actual)
+        idx, battles, stats = self.__arrays(rows)
+        weighted = self.contributions(idx, battles, stats)
+        return dict(zip(keys, zip(battles.tolist(), weighted.tolist())))
+
+    def contributions(self, idx: np.ndarray, battles: np.ndarray,
+                      stats: np.ndarray) -> np.ndarray:
+        """
+        Get the WTR of every ship weighted by its battles.
+        :param idx: the ship indexes.
+        :param battles: the battles of every ship.
+        :param stats: the stats matrix, see matrix.
+        :return: the weighted WTR of every ship.
+        """
+        ratios = stats / battles[:, None] * self.inverse[idx]
+        aircraft = self.aircraft_frags_coef[idx]
+        ship_frags = ratios[:, _FRAGS] * (1 - aircraft)
+        frags = ship_frags + ratios[:, _PLANES] * aircraft
+        frags = np.where(self.has_frags[idx], frags, 1)
+        wtr = ratios[:, _WEIGHTED] @ self.weights + frags * self.frags_weight
+        base = self.nominal_rating
+        wtr *= base
+        coef = 1 + (self.tiers[idx] - 7.5) * 0.1
+        adjusted = np.minimum(wtr, base) + np.maximum(0, wtr - base) * coef
+        return adjusted * battles
+
+    def wtr(self, actual: Optional[Dict[int, dict]]) -> int:
+        """
+        Calculate the absolute WTR for a player or a clan.
+        :param actual: the actual stats, by ship id.
+        :return: the wtr.
+        """
+        if not actual:
+            return 0
+        idx, battles, stats = self.matrix(actual)
+        total_battles = battles.sum()
+        if not total_battles:
+            return 0
+        total = self.contributions(idx, battles, stats).sum()
+        return round(float(total / total_battles))
+
+    async def wtr_async(self, actual: Optional[Dict[int, dict]]) -> int:
+        """
+        Awaitable version of wtr, see run_wtr.
+        """
+        return await run_wtr(actual, self.wtr, actual)
+
+
+class WTRBreakdown:
+    """
+    The WTR of one player, kept per ship so that only the ships whose
+    battle count changed are recalculated on an update.
+    """
+    __slots__ = ('engine', 'ships', 'total', 'battles')
+
+    def __init__(self, engine: WTREngine):
+        """
+        :param engine: the WTREngine the contributions are calculated with.
+        """
+        self.engine = engine
+        self.ships = {}
+        self.total = 0.0
+        self.battles = 0.0
+
+    def __remove(self, ship_id):
+        _, battles, weighted = self.ships.pop(ship_id)
+        self.battles -= battles
+        self.total -= weighted
+
+    def update(self, actual: Optional[Dict[int, dict]]) -> int:
+        """
+        Bring the breakdown up to date with new ship stats.
+        :param actual: the stats of the player, by ship id.
+        :return: the WTR of the player.
+        """
+        actual = actual or {}
+        ships = self.ships
+        for ship_id in ships.keys() - actual.keys():
+            self.__remove(ship_id)
+        changed = {
+            ship_id: stat for ship_id, stat in actual.items()
+            if ships.get(ship_id, _MISSING)[0] != stat.get('battles')
+        }
+        for ship_id in changed.keys() & ships.keys():
+            self.__remove(ship_id)
+        weighted = self.engine.breakdown(changed)
+        for ship_id, stat in changed.items():
+            battles, total = weighted.get(ship_id, (0, 0))
+            ships[ship_id] = (stat.get('battles'), battles, total)
+            self.battles += battles
+            self.total += total
+        if not ships:
+            # Start over from exact zeros once every ship is gone.
+            self.total = self.battles = 0.0
+        if not self.battles:
+            return 0
+        return round(self.total / self.battles)
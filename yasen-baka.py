@@ -2,7 +2,6 @@
 from asyncio import get_event_loop
 from os import getenv
 from pathlib import Path
-from sqlite3 import connect
 from time import time
 
 from aiohttp import ClientSession
@@ -13,12 +12,17 @@ from bot.logger import get_console_handler, setup_logging
 from cogs import *
 from config import Config
 from data import data_path
-from data_manager import DataManager
+from data_manager import AsyncDataManager
 from scripts.clear_cache import clean
 from world_of_warships import WowsManager
+from world_of_warships.batcher import RequestBatcher
+from world_of_warships.player_store import PlayerStore
+from world_of_warships.war_gaming import IdCache
+from world_of_warships.rate_limit import RateLimitedApi, RateLimiter
 
 IN_DOCKER = str(getenv('IN_DOCKER')) == '1'
 DB_PATH = Path('/db') if IN_DOCKER else data_path
+WOWS_RATE_LIMIT = 10
 
 
 async def run():
@@ -37,10 +41,17 @@ async def run():
         cache_pages=1, cache_mal_entries=40, logger=logger
     )
     session_manager = anime_search.session_manager
-    data_manager = DataManager(connect(f'{DB_PATH / "yasen_db"}'))
-    wows_api = WowsAsync(config.wows, session)
+    data_manager = await AsyncDataManager.from_path(
+        DB_PATH / 'yasen_db', write_behind=True, shared=config.shared_db
+    )
+    wows_api = RequestBatcher(RateLimitedApi(
+        WowsAsync(config.wows, session), RateLimiter(WOWS_RATE_LIMIT)
+    ))
     wows_manager = await WowsManager.wows_manager(
-        session_manager, wows_api, logger
+        session_manager, wows_api, logger,
+        await PlayerStore.from_path(DB_PATH / 'wows_cache.db'),
+        config.wows_refresh_interval,
+        IdCache(DB_PATH / 'wows_ids.json')
     )
     bot = Yasen(
         logger=logger,
@@ -68,5 +79,8 @@ if __name__ == '__main__':
     try:
         b.start_bot(c)
     except KeyboardInterrupt:
-        loop.close()
         exit(0)
+    finally:
+        b.data_manager.close()
+        b.wows_manager.close()
+        loop.close()